@@ -0,0 +1,247 @@
+"""
+Async versions of the upstream-bound api views, for ASGI deployments.
+
+Under WSGI every request holds a worker thread until it finishes. A proxied
+``GetFeature`` from a slow station keeps its thread for up to the full
+upstream timeout, so a worker can only have as many upstream calls in
+flight as it has threads. With ``DHA_ASYNC['ENABLED']`` (``ASYNC_VIEWS=True``)
+api/urls.py routes these views instead:
+
+- ``proxy_geoserver`` relays upstream responses on the event loop
+  (``proxy_stream.stream_async``);
+- ``check_server_connectivity`` probes the station on the event loop.
+
+Both use a shared aiohttp session per worker, so one process keeps
+hundreds of upstream requests in flight (``MAX_CONNECTIONS``). The
+summaries and the schema catalog are served on the event loop from their
+materialized copies (``materialize.aget``). Only a missing copy takes a
+worker thread, for its blocking builder, and concurrent requests for it
+await that one build. Summary streams replay a materialized copy on the
+event loop too. A stream built live pulls the blocking generator in a
+worker thread, and closes it when the client goes away. Graph
+aggregations (api/graph_aggregate.py) run on the fan-out loop
+(api/fanout.py) and the request awaits them there.
+
+Worker profile (see dha_web_gis/asgi.py)::
+
+    gunicorn dha_web_gis.asgi:application -k uvicorn_worker.UvicornWorker \\
+        --workers <CPU cores> --timeout 60 --graceful-timeout 30
+
+One process per core, with no threads: concurrency comes from the event
+loop. Set ``ASYNC_VIEWS=True`` in that deployment only. Under WSGI, Django
+would run each async view on a throwaway event loop, so the sync views are
+the better choice there.
+"""
+import asyncio
+import logging
+from contextlib import aclosing
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from api import (
+    circuit, dha_servers, graph_aggregate, materialize, metrics, proxy_stream, responses, schema_catalog, snapshot, station_fixtures,
+    views,
+)
+from api.geo_server_config import GEOSERVER_CONFIG
+from api.responses import JsonResponse
+from api.summary_specs import SUMMARY_SPECS
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "ENABLED": False,
+    # Upstream connections per worker process, and per station
+    "MAX_CONNECTIONS": 512,
+    "PER_STATION_CONNECTIONS": 64,
+}
+
+
+def async_setting(name):
+    return getattr(settings, "DHA_ASYNC", {}).get(name, DEFAULTS[name])
+
+
+def enabled():
+    return async_setting("ENABLED")
+
+
+_sessions = {}
+
+
+def session():
+    """The worker's shared aiohttp session for the running event loop."""
+    loop = asyncio.get_running_loop()
+    shared = _sessions.get(loop)
+    if shared is None or shared.closed:
+        connector = aiohttp.TCPConnector(
+            limit=async_setting("MAX_CONNECTIONS"),
+            limit_per_host=async_setting("PER_STATION_CONNECTIONS"),
+            ttl_dns_cache=300,
+        )
+        # Proxied bodies are relayed as the station compressed them
+        shared = _sessions[loop] = aiohttp.ClientSession(connector=connector, auto_decompress=False)
+    return shared
+
+
+def in_thread(fn):
+    return sync_to_async(fn, thread_sensitive=False)
+
+
+# --- GeoServer proxy and connectivity ----------------------------------------------
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def proxy_geoserver(request):
+    try:
+        call = proxy_stream.ProxyCall(request)
+    except ValueError as e:
+        return responses.json_response(request, {"error": str(e)}, status=400)
+
+    try:
+        response = await in_thread(call.early_response)()
+        if response:
+            return response
+
+        # Stations whose circuit is open are answered right away instead of timing out
+        if call.station:
+            circuit.check(call.station)
+
+        if proxy_stream.streaming() and not station_fixtures.recording():
+            return await proxy_stream.stream_async(call, session())
+
+        # Buffered mode and recording coalesce and store through the sync path
+        return await in_thread(call.buffered)()
+    except Exception as e:
+        return proxy_stream.error_response(e, request)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def check_server_connectivity(request):
+    """Check connectivity to a specific DHA server."""
+    server_name = request.GET.get('server')
+    if server_name not in GEOSERVER_CONFIG['dha_servers']:
+        logger.error(f'Server {server_name} not found in config')
+        return JsonResponse({'error': f'Server {server_name} not found in config'}, status=404)
+
+    server_details, test_url, safe_url = dha_servers.connectivity_target(server_name)
+    logger.info(f'Testing connection to: {safe_url}')
+    try:
+        with metrics.upstream_call(server_name, test_url, 'connectivity') as measured:
+            async with session().get(
+                test_url,
+                headers={'Accept': 'application/xml', 'Accept-Encoding': 'identity'},
+                timeout=aiohttp.ClientTimeout(total=5),
+            ) as response:
+                measured.first_byte()
+                body = await response.read()
+                measured.bytes = len(body)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return dha_servers.connectivity_response(server_name, server_details, safe_url, error=e)
+    text = body.decode(response.get_encoding(), errors='replace')
+    return dha_servers.connectivity_response(server_name, server_details, safe_url, response.status, text)
+
+
+# --- Summaries ----------------------------------------------------------------------
+
+async def _aiter_in_thread(iterator):
+    """Pull a blocking generator one item at a time in a worker thread, closing it when done with."""
+    done = object()
+    loop = asyncio.get_running_loop()
+    pulling = None
+    try:
+        while True:
+            # A disconnect cancels the response mid-pull; the pull itself runs on
+            pulling = loop.run_in_executor(None, next, iterator, done)
+            item = await asyncio.shield(pulling)
+            if item is done:
+                return
+            yield item
+    finally:
+        if pulling is None or pulling.done():
+            loop.run_in_executor(None, iterator.close)
+        else:
+            # The generator is running in a thread; close it once that pull is over
+            pulling.add_done_callback(lambda _: loop.run_in_executor(None, iterator.close))
+
+
+async def _summary_records(name, budget):
+    """``views.summary_records`` that only takes a worker thread for a live build."""
+    entry = materialize.peek(name)
+    if entry is None and snapshot.enabled():
+        entry = await materialize.aget(name, budget=budget)
+    if entry is not None:
+        for record in views.materialized_records(entry):
+            yield record
+        return
+    async with aclosing(_aiter_in_thread(views.live_records(name, budget))) as records:
+        async for record in records:
+            yield record
+
+
+def _summary_view(name):
+    @csrf_exempt
+    async def view(request):
+        try:
+            budget = materialize.latency_budget(request.GET.get("budget"))
+        except ValueError:
+            return JsonResponse({"error": "'budget' must be a number of seconds"}, status=400)
+        entry = await materialize.aget(name, budget=budget)
+        return responses.materialized(request, name, entry)
+    view.__name__ = name
+    return view
+
+
+def _summary_stream_view(name):
+    @csrf_exempt
+    async def view(request):
+        return views.stream_response(name, request, records=_summary_records)
+    view.__name__ = f"{name}_stream"
+    return view
+
+
+land_summary = _summary_view("land_summary")
+town_summary = _summary_view("town_summary")
+services_summary = _summary_view("services_summary")
+horticulture_summary = _summary_view("horticulture_summary")
+security_summary = _summary_view("security_summary")
+
+land_summary_stream = _summary_stream_view("land_summary")
+town_summary_stream = _summary_stream_view("town_summary")
+services_summary_stream = _summary_stream_view("services_summary")
+horticulture_summary_stream = _summary_stream_view("horticulture_summary")
+security_summary_stream = _summary_stream_view("security_summary")
+
+
+@csrf_exempt
+async def summary(request, name):
+    """Serve any summary declared in api/summary_specs.py by name."""
+    if name not in SUMMARY_SPECS:
+        return JsonResponse({"error": f"Unknown summary '{name}'"}, status=404)
+    return await _summary_view(name)(request)
+
+
+@csrf_exempt
+async def summary_stream(request, name):
+    """Stream any summary declared in api/summary_specs.py by name."""
+    if name not in SUMMARY_SPECS:
+        return JsonResponse({"error": f"Unknown summary '{name}'"}, status=404)
+    return await _summary_stream_view(name)(request)
+
+
+# --- Query engine -------------------------------------------------------------------
+
+@csrf_exempt
+async def query_aggregate(request):
+    """Group a layer for a query engine graph; the request awaits the fan-out loop."""
+    return await graph_aggregate.aresponse(request)
+
+
+@csrf_exempt
+async def layer_fields(request):
+    """Allowed fields of every query engine layer; served from the materialized catalog."""
+    return await schema_catalog.aresponse(request)
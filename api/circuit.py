@@ -0,0 +1,251 @@
+"""
+Per-station circuit breakers.
+
+Every upstream call to a DHA station, from the summary fan-out and from
+``proxy_geoserver`` alike, goes through the station's breaker. After
+``FAILURE_THRESHOLD`` consecutive connection failures or timeouts the
+circuit opens and calls to the station fail immediately with
+``CircuitOpenError`` instead of waiting out their timeout. The first call
+after ``RESET_TIMEOUT`` moves the circuit to half-open and starts a single
+background probe (a GetCapabilities request with ``PROBE_TIMEOUT``); calls
+keep being rejected meanwhile, so no dashboard request ever waits on a dead
+station. If the probe succeeds the circuit closes, otherwise it reopens for
+twice as long (up to ``MAX_RESET_TIMEOUT``).
+
+Breakers live in the worker process, so each worker learns about a dead
+station from its own first few failures.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from django.conf import settings
+
+from api.geo_server_config import GEOSERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "ENABLED": True,
+    "FAILURE_THRESHOLD": 3,
+    "RESET_TIMEOUT": 30,
+    "MAX_RESET_TIMEOUT": 300,
+    "PROBE_TIMEOUT": 5,
+    # Recent calls kept per station for latency and failure-rate reporting
+    "WINDOW": 50,
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def circuit_setting(name):
+    return getattr(settings, "DHA_CIRCUIT", {}).get(name, DEFAULTS[name])
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, station_name, retry_in):
+        super().__init__(f"{station_name} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+        self.station_name = station_name
+        self.retry_in = retry_in
+
+
+def is_station_failure(exc):
+    """Connection problems, timeouts and gateway/server errors count against a station."""
+    if isinstance(exc, (asyncio.TimeoutError, aiohttp.ClientConnectionError)):
+        return True
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status >= 500
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code >= 500
+    return isinstance(exc, (ConnectionError, TimeoutError))
+
+
+class Breaker:
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.reset_timeout = circuit_setting("RESET_TIMEOUT")
+        self.recent = deque(maxlen=circuit_setting("WINDOW"))  # (ok, latency)
+
+    def retry_in(self):
+        if self.state == CLOSED:
+            return 0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """Admit a call unless the circuit is open; a due open circuit starts its probe."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN or self.retry_in() > 0:
+                return False
+            self.state = HALF_OPEN
+        logger.info(f"{self.name}: circuit half-open, probing")
+        threading.Thread(target=self._probe, name=f"probe-{self.name}", daemon=True).start()
+        return False
+
+    def _probe(self):
+        started = time.monotonic()
+        try:
+            ok = probe_station(self.name)
+        except Exception as e:
+            logger.info(f"{self.name}: probe failed: {e}")
+            ok = False
+        if ok:
+            self.record_success(time.monotonic() - started)
+        else:
+            self.record_failure(time.monotonic() - started)
+
+    def record_success(self, latency):
+        with self._lock:
+            self.recent.append((True, latency))
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info(f"{self.name}: circuit closed again")
+            self.state = CLOSED
+            self.reset_timeout = circuit_setting("RESET_TIMEOUT")
+
+    def record_failure(self, latency):
+        with self._lock:
+            self.recent.append((False, latency))
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                # Failed probe: back off further
+                self.reset_timeout = min(self.reset_timeout * 2, circuit_setting("MAX_RESET_TIMEOUT"))
+                self._open()
+            elif self.state == CLOSED and self.consecutive_failures >= circuit_setting("FAILURE_THRESHOLD"):
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        logger.warning(f"{self.name}: circuit open for {self.reset_timeout:.0f}s after {self.consecutive_failures} failure(s)")
+
+    def expected_latency(self):
+        latencies = [latency for ok, latency in self.recent if ok]
+        return sum(latencies) / len(latencies) if latencies else 0.0
+
+    def status(self):
+        with self._lock:
+            calls = len(self.recent)
+            failures = sum(1 for ok, _ in self.recent if not ok)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "retry_in": round(self.retry_in(), 1),
+                "recent_calls": calls,
+                "recent_failure_rate": round(failures / calls, 3) if calls else 0.0,
+                "mean_latency": round(self.expected_latency(), 3),
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(station_name):
+    key = station_name.lower()
+    found = _breakers.get(key)
+    if found is None:
+        with _breakers_lock:
+            found = _breakers.setdefault(key, Breaker(key))
+    return found
+
+
+def probe_station(station_name):
+    """Cheap reachability check of a station's GeoServer."""
+    cfg = GEOSERVER_CONFIG["dha_servers"].get(station_name)
+    if not cfg or not cfg.get("dhaip"):
+        return True
+    response = requests.get(
+        f"http://{cfg['dhaip']}/geoserver/ows",
+        params={"service": "WFS", "version": "1.0.0", "request": "GetCapabilities", "authkey": cfg["auth_key"]},
+        timeout=circuit_setting("PROBE_TIMEOUT"),
+    )
+    return response.status_code < 500
+
+
+def check(station_name):
+    """Raise ``CircuitOpenError`` right away if the station's calls are being rejected."""
+    if not circuit_setting("ENABLED"):
+        return
+    b = breaker(station_name)
+    if not b.allow():
+        raise CircuitOpenError(station_name, b.retry_in())
+
+
+class _Call:
+    """Handle yielded by ``guard``; ``fail()`` marks a returned response as a station failure."""
+
+    failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+@contextmanager
+def guard(station_name):
+    """
+    Run one upstream call under the station's breaker.
+
+    Usable from sync code and from coroutines (nothing is awaited on entry or
+    exit). Errors that are not the station's fault, such as a malformed
+    body, still prove the station is reachable.
+    """
+    call = _Call()
+    if not circuit_setting("ENABLED") or station_name is None:
+        yield call
+        return
+    b = breaker(station_name)
+    if not b.allow():
+        raise CircuitOpenError(station_name, b.retry_in())
+    started = time.monotonic()
+    try:
+        yield call
+    except (asyncio.CancelledError, GeneratorExit, KeyboardInterrupt):
+        # Abandoned by the caller: no verdict on the station
+        raise
+    except Exception as e:
+        if is_station_failure(e):
+            b.record_failure(time.monotonic() - started)
+        else:
+            b.record_success(time.monotonic() - started)
+        raise
+    else:
+        if call.failed:
+            b.record_failure(time.monotonic() - started)
+        else:
+            b.record_success(time.monotonic() - started)
+
+
+def by_expected_latency(station_names):
+    """Slowest stations first, so they are started before the quick ones."""
+    return sorted(station_names, key=lambda name: breaker(name).expected_latency(), reverse=True)
+
+
+def station_for_url(url):
+    """Name of the configured station a URL points at, or None."""
+    host = urlsplit(url).netloc
+    for name, cfg in GEOSERVER_CONFIG["dha_servers"].items():
+        if cfg.get("dhaip") and cfg["dhaip"] == host:
+            return name
+    return None
+
+
+def status():
+    return {name: b.status() for name, b in sorted(_breakers.items())}
@@ -0,0 +1,231 @@
+"""
+Columnar batch aggregation for large station layers.
+
+``ColumnarAggregator`` is a drop-in replacement for
+``summary_engine.Aggregator``. ``add()`` only appends the raw values of the
+fields a spec reads to per-field columns. When the groups are first read,
+each dimension is normalized once per distinct raw value, each metric
+column is coerced in one pass, and every group-by sum is computed with
+``numpy.bincount``.
+
+Every feature keeps its arrival position, and the columns of all layers
+are put back in that order before grouping. Groups therefore appear in the
+order the row loop first sees them. ``bincount`` accumulates in that same
+order, so the sums are bit-for-bit the ones the row-by-row loop produces,
+even when the features of several layers interleave. Buckets that only
+ever received integers are converted back to ``int`` so the JSON output is
+identical too.
+
+NumPy is optional: ``available()`` is False without it and the engine keeps
+using the row aggregator.
+"""
+from itertools import compress, repeat
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from api.summary_engine import COERCIONS, SKIP, compile_dimension
+
+_NUMERIC = {int, float, bool}
+
+
+def available():
+    return np is not None
+
+
+class _Segment:
+    """Raw field columns for features sharing the same metric subset (layer)."""
+
+    def __init__(self, fields):
+        self.columns = [(field, []) for field in fields]
+        # Arrival position of every feature across all segments
+        self.positions = []
+        self.count = 0
+
+
+class ColumnarAggregator:
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.dimensions = [
+            (name, compile_dimension(dim), dim["fields"])
+            for name, dim in spec["dimensions"].items()
+        ]
+        self.metric_specs = spec["metrics"]
+        self.initial = {name: m.get("initial", 0) for name, m in spec["metrics"].items()}
+        self.group_dims = spec["groups"]
+
+        fields = []
+        for _, _, dim_fields in self.dimensions:
+            fields.extend(dim_fields)
+        for metric in self.metric_specs.values():
+            fields.extend(metric.get("fields", [metric["field"]] if "field" in metric else []))
+        self.fields = list(dict.fromkeys(fields))
+
+        self._segments = {}
+        self._groups = None
+        self._feature_count = 0
+        self._added = 0
+
+    def add(self, props, metric_names=None):
+        key = tuple(metric_names) if metric_names else None
+        segment = self._segments.get(key)
+        if segment is None:
+            segment = self._segments[key] = _Segment(self.fields)
+        get = props.get
+        for field, column in segment.columns:
+            column.append(get(field))
+        segment.positions.append(self._added)
+        self._added += 1
+        segment.count += 1
+        self._groups = None
+
+    def zero(self):
+        return dict(self.initial)
+
+    @property
+    def feature_count(self):
+        self.groups
+        return self._feature_count
+
+    @property
+    def groups(self):
+        if self._groups is None:
+            self._groups = self._aggregate()
+        return self._groups
+
+    # --- Batch computation ------------------------------------------------
+
+    def _aggregate(self):
+        labels = {name: [] for name, _, _ in self.dimensions}
+        label_codes = {name: {} for name, _, _ in self.dimensions}
+        dim_codes = {name: [] for name, _, _ in self.dimensions}
+        values = {name: [] for name in self.metric_specs}
+        positions = []
+        self._feature_count = 0
+
+        for metric_names, segment in self._segments.items():
+            columns = dict(segment.columns)
+            seg_codes = {}
+            mask = np.ones(segment.count, dtype=bool)
+            for name, value, fields in self.dimensions:
+                seg_codes[name] = self._dimension_codes(value, fields, columns, labels[name], label_codes[name])
+                mask &= seg_codes[name] >= 0
+
+            # Skipped features are dropped before their metrics are coerced,
+            # exactly like the row aggregator never reads them
+            if not mask.all():
+                columns = {field: list(compress(col, mask)) for field, col in columns.items()}
+            count = int(mask.sum())
+            self._feature_count += count
+
+            positions.append(np.array(segment.positions, dtype=np.int64)[mask])
+            for name in seg_codes:
+                dim_codes[name].append(seg_codes[name][mask])
+            for name, metric in self.metric_specs.items():
+                if metric_names is not None and name not in metric_names:
+                    values[name].append((np.zeros(count), np.zeros(count, dtype=bool)))
+                else:
+                    values[name].append(self._metric_column(metric, columns, count))
+
+        if not self._feature_count:
+            return {group: {} for group in self.group_dims}
+
+        # Back into arrival order, for the row loop's group order and summation order
+        arrival = np.argsort(np.concatenate(positions), kind="stable")
+        codes = {name: np.concatenate(parts)[arrival] for name, parts in dim_codes.items()}
+        sums = {
+            name: (np.concatenate([v for v, _ in parts])[arrival], np.concatenate([f for _, f in parts])[arrival])
+            for name, parts in values.items()
+        }
+        return {
+            group: self._group_sums(dims, codes, labels, sums)
+            for group, dims in self.group_dims.items()
+        }
+
+    def _dimension_codes(self, value, fields, columns, labels, label_codes):
+        """Normalize each distinct raw value once; -1 marks features the dimension skips."""
+        raw = columns[fields[0]] if len(fields) == 1 else list(zip(*(columns[f] for f in fields)))
+        distinct = {}
+        try:
+            raw_codes = [distinct.setdefault(r, len(distinct)) for r in raw]
+        except TypeError:
+            # Unhashable field values: fall back to normalizing every row
+            distinct = None
+
+        def code_for(label):
+            if label is SKIP:
+                return -1
+            code = label_codes.get(label)
+            if code is None:
+                code = label_codes[label] = len(labels)
+                labels.append(label)
+            return code
+
+        def props_for(r):
+            return dict(zip(fields, r)) if len(fields) > 1 else {fields[0]: r}
+
+        if distinct is None:
+            return np.array([code_for(value(props_for(r))) for r in raw], dtype=np.int64)
+        mapping = np.array([code_for(value(props_for(r))) for r in distinct], dtype=np.int64)
+        return mapping[np.array(raw_codes, dtype=np.int64)] if raw_codes else np.zeros(0, dtype=np.int64)
+
+    def _metric_column(self, metric, columns, count):
+        """Coerced values as float64 plus a mask of which ones were Python floats."""
+        if metric.get("count"):
+            return np.ones(count), np.zeros(count, dtype=bool)
+
+        coerce = COERCIONS[metric.get("coerce", "or_zero")]
+        if "compute" in metric:
+            args = [list(map(coerce, columns[f])) for f in metric["fields"]]
+            vals = list(map(metric["compute"], *args))
+        else:
+            vals = list(map(coerce, columns[metric["field"]]))
+
+        unsupported = set(map(type, vals)) - _NUMERIC
+        if unsupported:
+            # Same failure the row aggregator hits on ``bucket += val``
+            raise TypeError(f"unsupported operand type(s) for +=: 'int' and '{unsupported.pop().__name__}'")
+        is_float = np.fromiter(map(isinstance, vals, repeat(float)), dtype=bool, count=count)
+        return np.array(vals, dtype=np.float64), is_float
+
+    def _group_sums(self, dim_names, codes, labels, sums):
+        n = self._feature_count
+        if not n:
+            return {}
+
+        combined = np.zeros(n, dtype=np.int64)
+        for name in dim_names:
+            combined = combined * len(labels[name]) + codes[name]
+
+        # Dense group ids in order of first appearance, like dict insertion order
+        uniq, first, inverse = np.unique(combined, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind="stable")
+        rank = np.empty(len(uniq), dtype=np.int64)
+        rank[order] = np.arange(len(uniq))
+        dense = rank[inverse.ravel()]
+        k = len(uniq)
+
+        totals = {}
+        float_counts = {}
+        for name, (vals, is_float) in sums.items():
+            totals[name] = np.bincount(dense, weights=vals, minlength=k)
+            float_counts[name] = np.bincount(dense, weights=is_float, minlength=k)
+
+        result = {}
+        for idx, code in enumerate(uniq[order].tolist()):
+            key = []
+            for name in reversed(dim_names):
+                code, label_code = divmod(code, len(labels[name]))
+                key.append(labels[name][label_code])
+            bucket = {}
+            for name, initial in self.initial.items():
+                total = totals[name][idx]
+                if isinstance(initial, float) or float_counts[name][idx]:
+                    bucket[name] = initial + float(total)
+                else:
+                    bucket[name] = initial + int(total)
+            result[tuple(reversed(key))] = bucket
+        return result
@@ -1,16 +1,35 @@
 import json
 import os
 import logging
-from django.http import JsonResponse
+from functools import lru_cache
 from django.views.decorators.csrf import csrf_exempt
 logger = logging.getLogger(__name__)
 from .geo_server_config import GEOSERVER_CONFIG
+from . import json_codec, responses
+from .responses import JsonResponse
+
+
+# The config is loaded once at startup, so it is serialized once too
+@lru_cache(maxsize=None)
+def encoded_config():
+    return responses.encode(GEOSERVER_CONFIG)
+
+
+@lru_cache(maxsize=None)
+def encoded_allowed_fields():
+    return responses.encode({'allowed_fields': GEOSERVER_CONFIG.get('allowed_fields', [])})
+
+
+@lru_cache(maxsize=None)
+def allowed_field_names():
+    """The allowed fields, lowercased, for case-insensitive lookups."""
+    return frozenset(field.lower() for field in GEOSERVER_CONFIG.get('allowed_fields', []))
 
 
 @csrf_exempt
 def get_geoserver_config(request):
     
-    return JsonResponse(GEOSERVER_CONFIG)
+    return responses.respond(request, encoded_config())
 
 @csrf_exempt
 def get_allowed_fields(request):
@@ -18,13 +37,7 @@ def get_allowed_fields(request):
     Return the list of allowed fields for query_engine/graph dropdowns
     """
     try:
-        config = GEOSERVER_CONFIG
-        allowed_fields = config.get('allowed_fields', [])
-        logger.info(f'Allowed fields loaded: {allowed_fields}')
-        
-        return JsonResponse({
-            'allowed_fields': allowed_fields
-        })
+        return responses.respond(request, encoded_allowed_fields())
     except Exception as e:
         logger.error(f'Error getting allowed fields: {str(e)}')
         return JsonResponse({'error': str(e)}, status=500)
@@ -47,28 +60,22 @@ def filter_layer_fields(request):
     try:
         logger.info('filter_layer_fields called')
         if request.method != 'POST':
-            return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+            return responses.json_response(request, {'error': 'Only POST method is allowed'}, status=405)
             
-        import json
-        data = json.loads(request.body)
+        data = json_codec.loads(request.body)
         
         if 'fields' not in data:
-            return JsonResponse({'error': 'Missing fields parameter'}, status=400)
+            return responses.json_response(request, {'error': 'Missing fields parameter'}, status=400)
+
+        allowed_fields = allowed_field_names()
+        logger.debug(f'{len(allowed_fields)} allowed fields')
 
-        config = GEOSERVER_CONFIG
-        
-        allowed_fields = config.get('allowed_fields', [])
-        logger.info(f'Allowed fields loaded: {allowed_fields}')
-            
-        all_fields = data['fields']
-        
         # Filter fields to only include those in the allowed_fields list (case-insensitive)
-        allowed_fields_lower = [field.lower() for field in allowed_fields]
-        filtered_fields = [field for field in all_fields if field['name'].lower() in allowed_fields_lower]
+        filtered_fields = [field for field in data['fields'] if field['name'].lower() in allowed_fields]
         
-        return JsonResponse({
+        return responses.json_response(request, {
             'filtered_fields': filtered_fields
         })
     except Exception as e:
         logger.error(f'Error filtering fields: {str(e)}')
-        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+        return responses.json_response(request, {'error': str(e)}, status=500)
\ No newline at end of file
@@ -0,0 +1,444 @@
+"""
+Incremental (delta) sync of the summary layers.
+
+Spec layers that declare an ``updated_field`` (a change timestamp such as
+``Last_Updated``) are only downloaded in full on the first refresh. The
+engine keeps a per-station, per-layer watermark (the newest timestamp seen)
+together with the layer's grouped sums and every feature's contribution to
+them. Later refreshes ask GeoServer only for the features changed since the
+watermark (``CQL_FILTER``), take back the old contribution of each changed
+feature and add its new one, so a refresh costs in proportion to the edits
+rather than to the layer.
+
+Delta sync is off by default (``DHA_DELTA_SYNC['ENABLED']``). When it is on,
+it takes over every spec with an ``updated_field`` layer from the process
+pool and the columnar aggregator (see ``summary_engine.iter_summary``), and
+its full syncs aggregate one feature at a time. It pays off for large
+layers that see few edits between refreshes.
+
+Features re-read at the watermark whose contribution did not change are left
+alone, so an unedited layer keeps exactly the sums of its last full sync.
+Edited features subtract and add floats, so the sums match a fresh
+aggregation up to float rounding until the next full resync. Sums are kept
+per layer and merged per station, so as with the process pool the last
+digit may differ from a single-pass run.
+
+The cache holds one small entry per station (watermarks and per-layer sums)
+and the contributions of each incremental layer split into chunks of about
+``CHUNK_FEATURES`` features by feature id. A delta reads and rewrites only
+the chunks of the features that changed.
+
+A change timestamp cannot reveal deleted features. After each delta the
+layer's ``resultType=hits`` count is compared with the features on record,
+and any mismatch triggers a full resync of that layer. Layers are also
+fully resynced every ``FULL_SYNC_INTERVAL`` seconds. Layers without a
+timestamp column, or whose features carry no ids, are fully refreshed
+every time and store no contributions.
+"""
+import asyncio
+import copy
+import logging
+import math
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from api.fanout import gather_or_cancel
+from api.process_pool import MergedAggregate
+from api.summary_engine import SKIP, Aggregator, aggregate_layer, aggregate_page, count_features
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "ENABLED": False,
+    "CACHE": "default",
+    "FULL_SYNC_INTERVAL": 60 * 60 * 24,
+    # Compare the layer's hits count after each delta to catch deletions
+    "VERIFY_COUNT": True,
+    # Features per stored chunk of contributions (keeps each cache value small)
+    "CHUNK_FEATURES": 1000,
+}
+
+_MISSING = object()
+
+
+def delta_setting(name):
+    return getattr(settings, "DHA_DELTA_SYNC", {}).get(name, DEFAULTS[name])
+
+
+def enabled(spec):
+    return delta_setting("ENABLED") and any(layer.get("updated_field") for layer in spec["layers"])
+
+
+# --- Sync state -------------------------------------------------------------
+
+def _cache():
+    return caches[delta_setting("CACHE")]
+
+
+def _key(summary, station_name):
+    return f"dha:delta:{summary}:{station_name}"
+
+
+def _chunk_key(summary, station_name, layer, index):
+    return f"dha:delta:{summary}:{station_name}:{layer}:{index}"
+
+
+def chunk_of(feature_id, chunks):
+    return zlib.crc32(str(feature_id).encode("utf-8")) % chunks
+
+
+def load(summary, station_names):
+    """Return ``{station_name: state}`` for the stations that have been synced before."""
+    keys = {_key(summary, name): name for name in station_names}
+    return {keys[key]: state for key, state in _cache().get_many(list(keys)).items()}
+
+
+def load_chunks(summary, station_name, layer, indexes):
+    """Return ``{index: {feature_id: contribution}}`` for the stored chunks among ``indexes``."""
+    keys = {_chunk_key(summary, station_name, layer, index): index for index in indexes}
+    return {keys[key]: chunk for key, chunk in _cache().get_many(list(keys)).items()}
+
+
+def save(summary, synced):
+    """Store the states and chunks in ``synced`` and delete the chunks they no longer use."""
+    values = {}
+    stale = []
+    for station_name, sync in synced.items():
+        values[_key(summary, station_name)] = sync["state"]
+        for (layer, index), chunk in sync["chunks"].items():
+            values[_chunk_key(summary, station_name, layer, index)] = chunk
+        stale.extend(_chunk_key(summary, station_name, layer, index) for layer, index in sync["stale"])
+    _cache().set_many(values, timeout=None)
+    if stale:
+        _cache().delete_many(stale)
+
+
+class SyncedStates:
+    """
+    The new states of one refresh's stations, collected from the fan-out loop.
+
+    ``save`` stores what has been collected so far. A station that finishes
+    after that (past the deadline) is not added any more; its worker saves
+    it on its own.
+    """
+
+    def __init__(self, summary):
+        self.summary = summary
+        self._states = {}
+        self._saved = False
+        self._lock = threading.Lock()
+
+    def put(self, station_name, sync):
+        """Collect a station's state; False if the refresh was already saved."""
+        with self._lock:
+            if self._saved:
+                return False
+            self._states[station_name] = sync
+            return True
+
+    def save(self):
+        with self._lock:
+            self._saved = True
+            states = self._states
+        save(self.summary, states)
+
+
+def reset(summary, station_names):
+    """Forget the watermarks so the next refresh downloads every layer in full."""
+    keys = [_key(summary, name) for name in station_names]
+    for station_name, state in load(summary, station_names).items():
+        for layer, layer_state in state.get("layers", {}).items():
+            keys.extend(_chunk_key(summary, station_name, layer, i) for i in range(layer_state.get("chunks", 0)))
+    _cache().delete_many(keys)
+
+
+# --- Aggregation --------------------------------------------------------------
+
+class DeltaAggregator(Aggregator):
+    """
+    ``Aggregator`` for one layer that remembers what every feature contributed.
+
+    ``contributions`` holds the features loaded for this sync: all of them on
+    a full sync, the chunks of the changed ones on a delta. A feature whose
+    new contribution equals the stored one is left alone. Buckets left
+    without any feature are removed, as a fresh aggregation would not have
+    them.
+    """
+
+    def __init__(self, spec, state=None, contributions=None):
+        super().__init__(spec)
+        # feature_id -> (group keys, metric values), or None if skipped
+        self.contributions = {} if contributions is None else contributions
+        # group -> {key: number of features in the bucket}
+        self.members = {name: {} for name in self.group_dims}
+        # Feature ids whose contribution changed, and how many of them are new
+        self.changed = set()
+        self.added = 0
+        if state:
+            self.members = state["members"]
+            self.groups = state["groups"]
+            self.feature_count = state["feature_count"]
+
+    def state(self):
+        return {
+            "members": self.members,
+            "groups": self.groups,
+            "feature_count": self.feature_count,
+        }
+
+    def upsert(self, feature_id, props, metric_names=None):
+        contribution = None
+        dims = {}
+        for name, value in self.dimensions:
+            val = value(props)
+            if val is SKIP:
+                break
+            dims[name] = val
+        else:
+            keys = tuple(tuple(dims[d] for d in dim_names) for dim_names in self.group_dims.values())
+            values = tuple((name, self.metrics[name](props)) for name in (metric_names or self.metrics))
+            contribution = (keys, values)
+
+        previous = self.contributions.get(feature_id, _MISSING)
+        if previous == contribution:
+            return
+        if previous is _MISSING:
+            self.added += 1
+        elif previous is not None:
+            self._apply(*previous, -1)
+        self.contributions[feature_id] = contribution
+        self.changed.add(feature_id)
+        if contribution is not None:
+            self._apply(*contribution, 1)
+
+    def _apply(self, keys, values, sign):
+        self.feature_count += sign
+        for group, key in zip(self.group_dims, keys):
+            buckets = self.groups[group]
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = dict(self.initial)
+            for name, val in values:
+                if sign > 0:
+                    bucket[name] += val
+                else:
+                    bucket[name] -= val
+
+            members = self.members[group]
+            members[key] = members.get(key, 0) + sign
+            if not members[key]:
+                del members[key]
+                del buckets[key]
+
+
+# --- Syncing ----------------------------------------------------------------
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+async def full_sync(spec, station_name, cfg, layer, request_stamp):
+    """
+    Aggregate a fresh download of all of a layer's features.
+
+    Returns ``(layer_state, chunks)``; ``chunks`` maps every chunk index to
+    its contributions, and is empty for layers that cannot be synced
+    incrementally.
+    """
+    type_name = layer["typeName"]
+    field = layer.get("updated_field")
+    metric_names = layer.get("metrics")
+    agg = DeltaAggregator(spec)
+
+    seen = {"anonymous": 0, "watermark": None}
+
+    def consume(feature):
+        props = feature.get("properties") or {}
+        feature_id = feature.get("id")
+        if feature_id is None:
+            seen["anonymous"] += 1
+            feature_id = f"#{seen['anonymous']}"
+        agg.upsert(feature_id, props, metric_names)
+        stamp = props.get(field) if field else None
+        if stamp and (seen["watermark"] is None or str(stamp) > seen["watermark"]):
+            seen["watermark"] = str(stamp)
+
+    await aggregate_layer(spec, consume, station_name, cfg, layer, extra=(field,) if request_stamp else ())
+
+    now = time.time()
+    incremental = seen["watermark"] is not None and not seen["anonymous"]
+    if field and request_stamp and not incremental:
+        logger.info(f"{station_name}: {type_name} has no usable {field}, refreshing it in full")
+
+    chunks = {}
+    if incremental:
+        count = max(1, math.ceil(len(agg.contributions) / delta_setting("CHUNK_FEATURES")))
+        chunks = {index: {} for index in range(count)}
+        for feature_id, contribution in agg.contributions.items():
+            chunks[chunk_of(feature_id, count)][feature_id] = contribution
+    return {
+        "incremental": incremental,
+        "watermark": seen["watermark"],
+        "full_synced_at": now,
+        "checked_at": now if request_stamp else None,
+        "size": len(agg.contributions),
+        "chunks": len(chunks),
+        "aggregate": agg.state(),
+    }, chunks
+
+
+async def delta_sync(spec, summary, station_name, cfg, layer, layer_state):
+    """
+    Apply the features changed since the layer's watermark.
+
+    Returns ``(layer_state, chunks)`` with only the chunks that changed, or
+    None if the layer no longer matches the features on record (or its
+    chunks were evicted) and has to be resynced in full.
+    """
+    type_name = layer["typeName"]
+    field = layer["updated_field"]
+    metric_names = layer.get("metrics")
+    since = layer_state["watermark"]
+    seen = {"watermark": since}
+    changed = []
+
+    def consume(feature):
+        feature_id = feature.get("id")
+        if feature_id is None:
+            raise ValueError(f"{type_name} returned a feature without an id")
+        props = feature.get("properties") or {}
+        changed.append((feature_id, props))
+        stamp = props.get(field)
+        if stamp and str(stamp) > seen["watermark"]:
+            seen["watermark"] = str(stamp)
+
+    # ">=" re-reads the features stamped exactly at the watermark, so edits
+    # made within the same timestamp as the last refresh are not missed
+    await aggregate_page(spec, consume, station_name, cfg, layer, extra=(field,), cql_filter=f"{field} >= {_quote(since)}")
+
+    count = layer_state["chunks"]
+    indexes = {chunk_of(feature_id, count) for feature_id, _ in changed}
+    loop = asyncio.get_running_loop()
+    loaded = await loop.run_in_executor(None, load_chunks, summary, station_name, type_name, indexes)
+    if len(loaded) < len(indexes):
+        logger.info(f"{station_name}: stored contributions of {type_name} are missing")
+        return None
+
+    contributions = {}
+    for chunk in loaded.values():
+        contributions.update(chunk)
+    # The stored state is left as it was if the layer has to be resynced
+    agg = DeltaAggregator(spec, copy.deepcopy(layer_state["aggregate"]), contributions)
+    for feature_id, props in changed:
+        agg.upsert(feature_id, props, metric_names)
+    size = layer_state["size"] + agg.added
+
+    if delta_setting("VERIFY_COUNT"):
+        total = await count_features(station_name, cfg, layer, timeout=layer.get("timeout", spec.get("timeout")))
+        if total is not None and total != size:
+            logger.info(f"{station_name}: {type_name} has {total} features, {size} on record")
+            return None
+
+    chunks = {}
+    for feature_id in agg.changed:
+        index = chunk_of(feature_id, count)
+        chunks[index] = loaded[index]
+        chunks[index][feature_id] = contributions[feature_id]
+
+    logger.info(
+        f"{station_name}: {len(changed)} feature(s) of {type_name} read since {since}, {len(agg.changed)} changed"
+    )
+    return dict(layer_state, watermark=seen["watermark"], size=size, aggregate=agg.state()), chunks
+
+
+async def sync_layer(spec, summary, station_name, cfg, layer, layer_state):
+    """
+    Sync one layer from its stored state.
+
+    Returns ``(layer_state, chunks, stale)``: the chunks to store and the
+    indexes of stored chunks the layer no longer uses.
+    """
+    if layer_state and "aggregate" not in layer_state:
+        # Stored before the contributions were chunked
+        layer_state = None
+    now = time.time()
+    full_sync_interval = delta_setting("FULL_SYNC_INTERVAL")
+    if (
+        layer.get("updated_field")
+        and layer_state
+        and layer_state["incremental"]
+        and now - layer_state["full_synced_at"] < full_sync_interval
+    ):
+        synced = await delta_sync(spec, summary, station_name, cfg, layer, layer_state)
+        if synced is not None:
+            return (*synced, [])
+
+    # Layers found without a usable timestamp only look for one again on the
+    # periodic full resync, rather than on every refresh
+    request_stamp = bool(layer.get("updated_field")) and (
+        not layer_state
+        or layer_state["incremental"]
+        or now - (layer_state.get("checked_at") or 0) >= full_sync_interval
+    )
+    synced, chunks = await full_sync(spec, station_name, cfg, layer, request_stamp)
+    if not request_stamp and layer_state:
+        synced["checked_at"] = layer_state.get("checked_at")
+    stale = range(len(chunks), layer_state.get("chunks", 0)) if layer_state else []
+    return synced, chunks, list(stale)
+
+
+def station_worker(summary, spec, states, synced):
+    """
+    Fan-out worker that syncs a station from its stored state.
+
+    ``states`` holds the stored state of each station; the new state of every
+    station that synced successfully, with the chunks to write and delete, is
+    put in ``synced`` (a ``SyncedStates``) for the caller to save, so an
+    interrupted sync never overwrites a good one.
+    """
+    async def worker(station_name, cfg):
+        previous = (states.get(station_name) or {}).get("layers", {})
+        layers = {}
+        chunks = {}
+        stale = []
+        errors = []
+
+        async def run_layer(layer):
+            type_name = layer["typeName"]
+            try:
+                layer_state, written, dropped = await sync_layer(
+                    spec, summary, station_name, cfg, layer, previous.get(type_name)
+                )
+            except Exception as e:
+                if not spec.get("partial_layers"):
+                    raise
+                logger.warning(f"Error fetching {type_name} for {station_name}: {e}")
+                errors.append(f"{type_name}: {e}")
+                # Keep its last sums for now and resync it in full next time
+                if previous.get(type_name) and "aggregate" in previous[type_name]:
+                    layers[type_name] = dict(previous[type_name], full_synced_at=0)
+                return
+            layers[type_name] = layer_state
+            chunks.update({(type_name, index): chunk for index, chunk in written.items()})
+            stale.extend((type_name, index) for index in dropped)
+
+        try:
+            await gather_or_cancel(run_layer(layer) for layer in spec["layers"])
+            agg = MergedAggregate(spec)
+            for layer in spec["layers"]:
+                layer_state = layers.get(layer["typeName"])
+                if layer_state:
+                    agg.merge((layer_state["aggregate"]["feature_count"], layer_state["aggregate"]["groups"]))
+            entry = spec["station"](station_name, agg, errors)
+        except Exception as e:
+            return spec["error"](station_name, e)
+        sync = {"state": {"layers": layers}, "chunks": chunks, "stale": stale}
+        if not synced.put(station_name, sync):
+            await asyncio.get_running_loop().run_in_executor(None, save, summary, {station_name: sync})
+        return entry
+    return worker
@@ -2,11 +2,13 @@ import json
 import os
 import logging
 import requests
-from django.http import JsonResponse,HttpResponse
+from django.http import HttpResponse
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from .geo_server_config import GEOSERVER_CONFIG
+from . import circuit, metrics, proxy_stream, responses, station_fixtures
+from .responses import JsonResponse
 
 logger = logging.getLogger(__name__)
 
@@ -14,25 +16,28 @@ logger = logging.getLogger(__name__)
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
 def proxy_geoserver(request):
-    base_url = request.GET.get("url")
-    if not base_url:
-        return JsonResponse({"error": "Missing 'url' parameter"}, status=400)
+    try:
+        call = proxy_stream.ProxyCall(request)
+    except ValueError as e:
+        return responses.json_response(request, {"error": str(e)}, status=400)
 
     try:
-        # Remove 'url' from params before forwarding
-        params = request.GET.dict()
-        params.pop("url", None)
-
-        # Forward request to GeoServer
-        response = requests.get(base_url, params=params, timeout=20)
-
-        return HttpResponse(
-            response.content,
-            status=response.status_code,
-            content_type=response.headers.get("Content-Type", "application/json"),
-        )
+        response = call.early_response()
+        if response:
+            return response
+
+        # Stations whose circuit is open are answered right away instead of timing out
+        if call.station:
+            circuit.check(call.station)
+
+        # Relay large responses as they arrive (recording needs the whole body)
+        if proxy_stream.streaming() and not station_fixtures.recording():
+            return proxy_stream.stream(call)
+
+        # Forward request to GeoServer; identical concurrent requests share one upstream call
+        return call.buffered()
     except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
+        return proxy_stream.error_response(e, request)
 
 # Remove login_required to facilitate testing
 @csrf_exempt
@@ -48,11 +53,58 @@ def get_dha_servers(request):
             return JsonResponse({'error': 'No DHA servers found in config'}, status=404)
         
         logger.info(f'DHA servers loaded successfully: {config["dha_servers"]}')
-        return JsonResponse(config["dha_servers"])
+        return responses.json_response(request, config["dha_servers"])
     except Exception as e:
         logger.error(f'Error loading DHA servers: {str(e)}')
         return JsonResponse({'error': str(e)}, status=500)
 
+def connectivity_target(server_name):
+    """The server's config, its GetCapabilities test URL and that URL with the auth key redacted."""
+    server_details = GEOSERVER_CONFIG['dha_servers'][server_name]
+    server_ip = server_details.get('dhaip')
+    auth_key = server_details.get('auth_key')
+    workspace = 'dha_coregis'
+    test_url = f'http://{server_ip}/geoserver/{workspace}/wfs?service=WFS&version=2.0.0&request=GetCapabilities&authkey={auth_key}'
+    safe_url = f'http://{server_ip}/geoserver/{workspace}/wfs?service=WFS&version=2.0.0&request=GetCapabilities&authkey=REDACTED'
+    return server_details, test_url, safe_url
+
+
+def connectivity_response(server_name, server_details, safe_url, status_code=None, text='', error=None):
+    """The answer of a connectivity check, from the test's status code or its connection error."""
+    if error is not None:
+        logger.warning(f'Connection to {server_name} failed: {str(error)}')
+        return JsonResponse({
+            'server': server_name,
+            'status': 'disconnected',
+            'message': f'Could not connect to server: {str(error)}',
+            'details': server_details
+        })
+
+    logger.info(f'Connection test result for {server_name}: Status {status_code}')
+
+    if status_code in [200, 201]:
+        return JsonResponse({
+            'server': server_name,
+            'status': 'connected',
+            'message': 'Successfully connected to server',
+            'details': {
+                'dhaip': server_details.get('dhaip'),
+                'test_url': safe_url
+            }
+        })
+    logger.warning(f'Server {server_name} returned error status: {status_code}')
+    logger.warning(f'Response content: {text[:200]}...')
+    return JsonResponse({
+        'server': server_name,
+        'status': 'error',
+        'message': f'Server returned status code: {status_code}',
+        'details': {
+            'dhaip': server_details.get('dhaip'),
+            'test_url': safe_url
+        }
+    })
+
+
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
 def check_server_connectivity(request):
@@ -67,66 +119,33 @@ def check_server_connectivity(request):
             logger.error(f'Server {server_name} not found in config')
             return JsonResponse({'error': f'Server {server_name} not found in config'}, status=404)
         
-        server_details = config['dha_servers'][server_name]
-        server_ip = server_details.get('dhaip')
-        auth_key = server_details.get('auth_key')
+        server_details, test_url, safe_url = connectivity_target(server_name)
         
         logger.info(f'Server details: {server_details}')
         
         # Attempt to connect to the server
         try:
-            # Construct a test URL to the GeoServer capabilities endpoint
-            workspace = 'dha_coregis'
-            test_url = f'http://{server_ip}/geoserver/{workspace}/wfs?service=WFS&version=2.0.0&request=GetCapabilities&authkey={auth_key}'
-            
             # Log the URL for debugging purposes (without the auth key for security)
-            safe_url = f'http://{server_ip}/geoserver/{workspace}/wfs?service=WFS&version=2.0.0&request=GetCapabilities&authkey=REDACTED'
             logger.info(f'Testing connection to: {safe_url}')
             
             # Set a short timeout to avoid long waits
-            response = requests.get(
-                test_url, 
-                headers={
-                    'Accept': 'application/xml',
-                    'Content-Type': 'application/xml'
-                }, 
-                timeout=5
-            )
-            
-            logger.info(f'Connection test result for {server_name}: Status {response.status_code}')
+            with metrics.upstream_call(server_name, test_url, 'connectivity') as measured:
+                response = requests.get(
+                    test_url, 
+                    headers={
+                        'Accept': 'application/xml',
+                        'Content-Type': 'application/xml'
+                    }, 
+                    timeout=5
+                )
+                measured.first_byte(response.elapsed.total_seconds())
+                measured.bytes = len(response.content)
             
-            if response.status_code in [200, 201]:
-                return JsonResponse({
-                    'server': server_name,
-                    'status': 'connected',
-                    'message': 'Successfully connected to server',
-                    'details': {
-                        'dhaip': server_details.get('dhaip'),
-                        'test_url': safe_url
-                    }
-                })
-            else:
-                logger.warning(f'Server {server_name} returned error status: {response.status_code}')
-                logger.warning(f'Response content: {response.text[:200]}...')
-                return JsonResponse({
-                    'server': server_name,
-                    'status': 'error',
-                    'message': f'Server returned status code: {response.status_code}',
-                    'details': {
-                        'dhaip': server_details.get('dhaip'),
-                        'test_url': safe_url
-                    }
-                })
+            return connectivity_response(server_name, server_details, safe_url, response.status_code, response.text)
                 
         except requests.exceptions.RequestException as e:
-            logger.warning(f'Connection to {server_name} failed: {str(e)}')
-            return JsonResponse({
-                'server': server_name,
-                'status': 'disconnected',
-                'message': f'Could not connect to server: {str(e)}',
-                'details': server_details
-            })
+            return connectivity_response(server_name, server_details, safe_url, error=e)
             
     except Exception as e:
         logger.error(f'Error checking server connectivity: {str(e)}')
-        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': str(e)}, status=500)
@@ -0,0 +1,381 @@
+"""
+Shared asyncio fan-out engine for the station summary views.
+
+Every upstream WFS call made by the summary views goes through a single
+event loop that runs in a background thread of the worker process. Each
+DHA station gets its own connection-pooled aiohttp session, all calls share
+one concurrency budget, and every fan-out is bounded by a global deadline
+on top of the per-request timeouts.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from functools import partial
+
+import aiohttp
+from django.conf import settings
+
+from api import circuit, json_codec, metrics, station_fixtures
+from api.geojson_stream import aiter_features
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "MAX_CONCURRENCY": 32,
+    "PER_STATION_CONNECTIONS": 4,
+    "REQUEST_TIMEOUT": 15,
+    "GLOBAL_DEADLINE": 20,
+    "STREAM_FEATURES": True,
+    "STREAM_CHUNK_SIZE": 64 * 1024,
+}
+
+
+def fanout_setting(name):
+    return getattr(settings, "DHA_FANOUT", {}).get(name, DEFAULTS[name])
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """A station was still running when the fan-out deadline expired."""
+
+
+class FanoutEngine:
+    """
+    Owns the background event loop and the per-station client sessions.
+
+    The loop is started lazily on first use (and restarted after a fork) so
+    it is safe to import this module in the gunicorn master.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._sessions = {}
+        self._station_slots = {}
+        self._budget = None
+        self._late = set()
+
+    # --- Event loop -------------------------------------------------------
+
+    @property
+    def loop(self):
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    self._start()
+        return self._loop
+
+    def _start(self):
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name="dha-fanout", daemon=True)
+        thread.start()
+        self._loop = loop
+        self._thread = thread
+        self._pid = os.getpid()
+        self._sessions = {}
+        self._station_slots = {}
+        self._budget = None
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the engine loop and block until it finishes."""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(timeout)
+
+    async def arun(self, coro):
+        """Run a coroutine on the engine loop and await it from another event loop."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    # --- Sessions ---------------------------------------------------------
+
+    def session(self, station_name):
+        """Return the pooled client session for a station (loop thread only)."""
+        session = self._sessions.get(station_name)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=fanout_setting("PER_STATION_CONNECTIONS"),
+                ttl_dns_cache=300,
+            )
+            session = aiohttp.ClientSession(connector=connector, trace_configs=[metrics.trace_config(station_name)])
+            self._sessions[station_name] = session
+        return session
+
+    def station_slot(self, station_name):
+        """
+        Per-station cap on in-flight calls (loop thread only).
+
+        Taken before the global budget so that calls queued behind a busy
+        station do not hold budget slots other stations could use.
+        """
+        slot = self._station_slots.get(station_name)
+        if slot is None:
+            slot = self._station_slots[station_name] = asyncio.Semaphore(fanout_setting("PER_STATION_CONNECTIONS"))
+        return slot
+
+    @property
+    def budget(self):
+        if self._budget is None:
+            self._budget = asyncio.Semaphore(fanout_setting("MAX_CONCURRENCY"))
+        return self._budget
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+    def shutdown(self):
+        """Close the sessions and stop the loop (registered with atexit)."""
+        if self._loop is None or self._pid != os.getpid() or not self._loop.is_running():
+            return
+        try:
+            self.run(self.close(), timeout=5)
+        except Exception as e:
+            logger.warning(f"Error closing fan-out sessions: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # --- Upstream calls ---------------------------------------------------
+
+    async def _get(self, station_name, url, timeout, read):
+        """GET a station URL under its breaker and slots; ``read(resp, call)`` consumes the body."""
+        if station_fixtures.replaying():
+            with metrics.upstream_call(station_name, url, "replay") as call:
+                return await read(station_fixtures.replay(station_name, url), call)
+        timeout = aiohttp.ClientTimeout(total=timeout or fanout_setting("REQUEST_TIMEOUT"))
+        circuit.check(station_name)
+        async with self.station_slot(station_name), self.budget:
+            with circuit.guard(station_name), metrics.upstream_call(station_name, url, "summary") as call:
+                async with self.session(station_name).get(url, timeout=timeout) as resp:
+                    call.first_byte()
+                    resp.raise_for_status()
+                    if station_fixtures.recording():
+                        resp = await station_fixtures.record(station_name, url, resp)
+                    return await read(resp, call)
+
+    async def get_json(self, station_name, url, timeout=None):
+        """GET a station URL and decode its JSON body."""
+        async def read(resp, call):
+            body = await resp.read()
+            call.bytes = len(body)
+            started = time.perf_counter()
+            try:
+                return json_codec.loads(body) if body.strip() else None
+            finally:
+                call.decode = time.perf_counter() - started
+        return await self._get(station_name, url, timeout, read)
+
+    async def get_bytes(self, station_name, url, timeout=None):
+        """GET a station URL and return its raw body."""
+        async def read(resp, call):
+            body = await resp.read()
+            call.bytes = len(body)
+            return body
+        return await self._get(station_name, url, timeout, read)
+
+    async def get_text(self, station_name, url, timeout=None):
+        """GET a station URL and return its body as text."""
+        async def read(resp, call):
+            call.bytes = len(await resp.read())
+            return await resp.text()
+        return await self._get(station_name, url, timeout, read)
+
+    async def iter_features(self, station_name, url, timeout=None):
+        """
+        Yield the features of a station's GeoJSON layer.
+
+        In streaming mode (``STREAM_FEATURES``) features are parsed straight
+        off the socket as they arrive; otherwise the body is decoded whole.
+        The time spent by the consumer between features is recorded as
+        aggregation time.
+        """
+        if not fanout_setting("STREAM_FEATURES"):
+            data = await self.get_json(station_name, url, timeout=timeout)
+            # An empty body is a layer without features
+            for feature in (data or {}).get("features") or []:
+                yield feature
+            return
+
+        if station_fixtures.replaying():
+            with metrics.upstream_call(station_name, url, "replay") as call:
+                async for feature in self._features(station_fixtures.replay(station_name, url), call):
+                    yield feature
+            return
+
+        timeout = aiohttp.ClientTimeout(total=timeout or fanout_setting("REQUEST_TIMEOUT"))
+        circuit.check(station_name)
+        async with self.station_slot(station_name), self.budget:
+            with circuit.guard(station_name), metrics.upstream_call(station_name, url, "summary") as call:
+                async with self.session(station_name).get(url, timeout=timeout) as resp:
+                    call.first_byte()
+                    resp.raise_for_status()
+                    if station_fixtures.recording():
+                        resp = await station_fixtures.record(station_name, url, resp)
+                    async for feature in self._features(resp, call):
+                        yield feature
+
+    async def _features(self, resp, call):
+        """Parse the features of a response body as its chunks arrive."""
+        waiting = 0.0
+
+        async def chunks():
+            nonlocal waiting
+            source = resp.content.iter_chunked(fanout_setting("STREAM_CHUNK_SIZE")).__aiter__()
+            while True:
+                started = time.perf_counter()
+                try:
+                    chunk = await source.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    waiting += time.perf_counter() - started
+                call.bytes += len(chunk)
+                yield chunk
+
+        started = time.perf_counter()
+        try:
+            async for feature in aiter_features(chunks()):
+                call.features += 1
+                handed = time.perf_counter()
+                yield feature
+                call.aggregation += time.perf_counter() - handed
+        finally:
+            call.decode = time.perf_counter() - started - waiting - call.aggregation
+
+    # --- Fan-out ----------------------------------------------------------
+
+    async def gather(self, jobs, worker, on_error, deadline=None, on_late=None, on_result=None):
+        """
+        Run ``worker(station_name, job)`` for every station concurrently.
+
+        Results are returned in completion order. Stations that raise, or are
+        still running when the global deadline expires, are replaced by
+        ``on_error(station_name, exc)`` (``DeadlineExceeded`` for the latter).
+
+        Late stations are cancelled, unless ``on_late`` is given: then they
+        run to completion in the background and ``on_late(station_name,
+        result, exc)`` is called with their outcome from a worker thread.
+
+        ``on_result`` (loop thread, must not block) sees every result as
+        soon as it is known.
+        """
+        deadline = deadline or fanout_setting("GLOBAL_DEADLINE")
+        # Historically slow stations start first; open circuits fail at their first call
+        tasks = {
+            asyncio.ensure_future(worker(name, jobs[name])): name
+            for name in circuit.by_expected_latency(jobs)
+        }
+        results = []
+        pending = set(tasks)
+        expires_at = time.monotonic() + deadline
+
+        def emit(result):
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+        while pending:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                name = tasks[task]
+                try:
+                    emit(task.result())
+                except Exception as e:
+                    logger.warning(f"Fan-out worker for {name} failed: {e}")
+                    emit(on_error(name, e))
+
+        for task in pending:
+            name = tasks[task]
+            logger.warning(f"{name} missed the {deadline}s fan-out deadline")
+            if on_late is None:
+                task.cancel()
+            else:
+                # The loop only holds weak references to tasks
+                self._late.add(task)
+                task.add_done_callback(partial(self._finish_late, name, on_late))
+            emit(on_error(name, DeadlineExceeded(f"Global deadline of {deadline}s exceeded")))
+
+        return results
+
+    def _finish_late(self, name, on_late, task):
+        self._late.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        result = None if exc else task.result()
+        # on_late may block (cache writes), so keep it off the event loop
+        self.loop.run_in_executor(None, on_late, name, result, exc)
+
+
+engine = FanoutEngine()
+atexit.register(engine.shutdown)
+
+
+async def get_json(station_name, url, timeout=None):
+    return await engine.get_json(station_name, url, timeout=timeout)
+
+
+async def get_bytes(station_name, url, timeout=None):
+    return await engine.get_bytes(station_name, url, timeout=timeout)
+
+
+async def get_text(station_name, url, timeout=None):
+    return await engine.get_text(station_name, url, timeout=timeout)
+
+
+def iter_features(station_name, url, timeout=None):
+    return engine.iter_features(station_name, url, timeout=timeout)
+
+
+def fan_out(jobs, worker, on_error, deadline=None, on_late=None):
+    """
+    Blocking entry point used by the sync views.
+
+    ``jobs`` maps station name to whatever the async ``worker`` needs (usually
+    its URL). ``on_error`` builds the placeholder entry for a failed station.
+    """
+    return engine.run(engine.gather(jobs, worker, on_error, deadline=deadline, on_late=on_late))
+
+
+async def afan_out(jobs, worker, on_error, deadline=None, on_late=None):
+    """``fan_out`` for the async views: the caller's event loop awaits the fan-out instead of a thread."""
+    return await engine.arun(engine.gather(jobs, worker, on_error, deadline=deadline, on_late=on_late))
+
+
+def iter_fan_out(jobs, worker, on_error, deadline=None, on_late=None):
+    """Like ``fan_out``, but yields each station's result as soon as it is known."""
+    results = queue.SimpleQueue()
+    finished = object()
+
+    async def run():
+        try:
+            await engine.gather(jobs, worker, on_error, deadline=deadline, on_late=on_late, on_result=results.put)
+        finally:
+            results.put(finished)
+
+    future = asyncio.run_coroutine_threadsafe(run(), engine.loop)
+    while True:
+        result = results.get()
+        if result is finished:
+            break
+        yield result
+    future.result()
+
+
+async def gather_or_cancel(coros):
+    """Await coroutines concurrently; on the first failure cancel the rest and re-raise."""
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -0,0 +1,130 @@
+"""
+Incremental GeoJSON FeatureCollection parser.
+
+Feeds on raw response chunks and hands back each feature of the top-level
+``features`` array as soon as it has fully arrived, so a station's layer can
+be aggregated while it downloads without ever holding the whole parsed
+FeatureCollection in memory.
+"""
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class FeatureStreamParser:
+    """
+    Push parser for a GeoJSON FeatureCollection.
+
+    ``feed(chunk)`` returns the features completed by that chunk, ``close()``
+    returns any remaining ones and raises ``ValueError`` if the document had
+    no features array or ended in the middle of it. An empty (or all
+    whitespace) document is a collection without features.
+    """
+
+    def __init__(self):
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._state = "seek"  # seek -> array -> done
+        self._retry_at = 0
+        self._blank = True
+
+    def feed(self, chunk):
+        if self._state == "done":
+            return []
+        if self._blank and chunk.strip():
+            self._blank = False
+        self._buf += self._utf8.decode(chunk)
+        return self._parse()
+
+    def close(self):
+        self._buf += self._utf8.decode(b"", final=True)
+        features = self._parse(final=True)
+        if self._state == "seek" and self._blank:
+            return features
+        if self._state == "seek":
+            raise ValueError("Response is not a GeoJSON FeatureCollection")
+        if self._state == "array":
+            raise ValueError("GeoJSON stream ended inside the features array")
+        return features
+
+    def _parse(self, final=False):
+        if self._state == "seek" and not self._seek_array():
+            return []
+
+        features = []
+        buf = self._buf
+        pos = self._pos
+
+        # A feature that failed to decode is only retried once the buffer has
+        # grown enough, so a huge feature arriving in small chunks stays linear
+        if not final and len(buf) < self._retry_at:
+            return features
+
+        while self._state == "array":
+            while pos < len(buf) and buf[pos] in _WHITESPACE + ",":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                self._state = "done"
+                pos += 1
+                break
+            try:
+                feature, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise ValueError("Malformed feature in GeoJSON stream")
+                self._retry_at = pos + 2 * (len(buf) - pos)
+                break
+            features.append(feature)
+            pos = end
+
+        # Drop everything already consumed
+        self._buf = buf[pos:]
+        self._pos = 0
+        if self._retry_at:
+            self._retry_at = max(0, self._retry_at - pos)
+        if self._state == "done":
+            self._buf = ""
+        return features
+
+    def _seek_array(self):
+        key = self._buf.find('"features"', self._pos)
+        if key == -1:
+            # Keep just enough of the tail to match a key split across chunks
+            self._buf = self._buf[-len('"features"'):]
+            self._pos = 0
+            return False
+        pos = key + len('"features"')
+        while pos < len(self._buf) and self._buf[pos] in _WHITESPACE + ":":
+            pos += 1
+        if pos >= len(self._buf):
+            self._pos = key
+            return False
+        if self._buf[pos] != "[":
+            raise ValueError("GeoJSON 'features' member is not an array")
+        self._buf = self._buf[pos + 1:]
+        self._pos = 0
+        self._state = "array"
+        return True
+
+
+def iter_features(chunks):
+    """Yield the features of a FeatureCollection given an iterable of byte chunks."""
+    parser = FeatureStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+async def aiter_features(chunks):
+    """Async counterpart of ``iter_features`` for an async iterable of byte chunks."""
+    parser = FeatureStreamParser()
+    async for chunk in chunks:
+        for feature in parser.feed(chunk):
+            yield feature
+    for feature in parser.close():
+        yield feature
@@ -0,0 +1,374 @@
+"""
+Server-side group-by for the query engine graphs.
+
+The graph builder used to download every feature of a layer from each
+selected station, one station after another, and group them in the
+browser. ``/api/query/aggregate`` does the grouping here instead:
+
+- every station is asked in parallel on the fan-out loop (api/fanout.py)
+  for only the x-axis and y-axis properties, without geometry;
+- features are grouped by the x-axis value as they stream in, per station,
+  and the station results are merged;
+- the response is just the category x series matrix the chart draws.
+
+Query parameters::
+
+    layer=<layer id>&x=<field>&y=<field>,<field>&agg=<fn>[,<fn>...]&servers=<name>,<name>
+
+``agg`` is one function for every y-axis field or one per field, in order.
+``servers`` defaults to every configured station. Layers and fields must be
+the ones the query engine offers (``query_engine_layers`` and
+``allowed_fields`` in api/geo_server_config.py).
+
+Differences from the browser's old ``processGraphData``:
+
+- ``count`` counts every non-empty value, and ``count_distinct`` counts its
+  distinct non-empty values. The browser skipped values that did not parse
+  as numbers, so text fields always counted 0.
+- ``min`` and ``max`` are taken over the numeric values only. The browser
+  started each cell at 0 and treated 0 as "no value yet".
+- ``mean`` (what the graph builder sends for "Average") averages. The
+  browser did not know it and summed.
+- Categories are keyed and returned by how the chart labels them, so
+  ``"1"`` and ``1`` are one category instead of two bars both labelled 1.
+"""
+import hashlib
+import logging
+import re
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+from api import circuit, singleflight
+from api.config_api import allowed_field_names
+from api.fanout import afan_out, fan_out, iter_features
+from api.geo_server_config import GEOSERVER_CONFIG
+from api.responses import JsonResponse, json_response
+from api.summary_engine import layer_url
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "WORKSPACE": "dha_coregis",
+    # Per-request timeout and fan-out deadline in seconds (None: the fan-out defaults)
+    "TIMEOUT": None,
+    "DEADLINE": None,
+    # Queries grouping into more categories are refused
+    "MAX_CATEGORIES": 5000,
+}
+
+DHA_CONFIGS = GEOSERVER_CONFIG['dha_servers']
+
+# The summary techniques of graph_controller.js; 'count_unique' is labelled "SUM (Estimated)"
+FUNCTIONS = {"sum", "count", "min", "max", "mean", "average", "count_unique", "count_distinct"}
+
+_FIELD = re.compile(r"^\w+$")
+
+
+def aggregate_setting(name):
+    return getattr(settings, "DHA_GRAPH_AGGREGATE", {}).get(name, DEFAULTS[name])
+
+
+def query_layers():
+    layers = GEOSERVER_CONFIG.get("query_engine_layers", {})
+    ids = set(layers.get("flat", []))
+    for group in layers.get("groups", []):
+        ids.update(layer["id"] for layer in group.get("layers", []))
+    return ids
+
+
+class TooManyCategories(Exception):
+    """The x-axis field has more distinct values than ``MAX_CATEGORIES``."""
+
+
+# --- Queries --------------------------------------------------------------------
+
+class GraphQuery:
+    """A validated aggregation request."""
+
+    def __init__(self, layer, x_axis, y_axes, functions, servers):
+        self.layer = layer
+        self.x_axis = x_axis
+        self.y_axes = y_axes
+        self.functions = functions
+        self.servers = servers
+
+    @classmethod
+    def from_request(cls, request):
+        """Parse the query string; raises ValueError with a message for the client."""
+        def listed(name):
+            return [v.strip() for v in request.GET.get(name, "").split(",") if v.strip()]
+
+        layer = request.GET.get("layer", "").strip()
+        if layer not in query_layers():
+            raise ValueError(f"Unknown layer '{layer}'")
+
+        x_axis = request.GET.get("x", "").strip()
+        y_axes = list(dict.fromkeys(listed("y")))
+        if not x_axis or not y_axes:
+            raise ValueError("'x' and 'y' are required")
+        allowed = allowed_field_names()
+        for field in [x_axis, *y_axes]:
+            if not _FIELD.match(field) or field.lower() not in allowed:
+                raise ValueError(f"Field '{field}' is not available")
+
+        functions = [f.lower() for f in listed("agg")] or ["sum"]
+        if len(functions) == 1:
+            functions = functions * len(y_axes)
+        if len(functions) != len(y_axes):
+            raise ValueError("'agg' needs one function, or one per 'y' field")
+        unknown = [f for f in functions if f not in FUNCTIONS]
+        if unknown:
+            raise ValueError(f"Unknown aggregation function '{unknown[0]}'")
+
+        servers = [s.lower() for s in listed("servers")] or list(DHA_CONFIGS)
+        unknown = [s for s in servers if s not in DHA_CONFIGS]
+        if unknown:
+            raise ValueError(f"Unknown server '{unknown[0]}'")
+
+        return cls(layer, x_axis, y_axes, dict(zip(y_axes, functions)), list(dict.fromkeys(servers)))
+
+    def properties(self):
+        return list(dict.fromkeys([self.x_axis, *self.y_axes]))
+
+    def key(self):
+        query = urlencode([
+            ("layer", self.layer), ("x", self.x_axis),
+            ("y", ",".join(f"{f}:{self.functions[f]}" for f in self.y_axes)),
+            ("servers", ",".join(sorted(self.servers))),
+        ])
+        return "graph:" + hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+
+# --- Aggregation --------------------------------------------------------------------
+
+def _number(val):
+    """The numeric value of a property, or None (unlike ``parse_number``, blanks are not zero)."""
+    if isinstance(val, bool) or val is None:
+        return None
+    if isinstance(val, (int, float)):
+        return val
+    try:
+        return float(str(val).replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+def _label(val):
+    """The category as JavaScript's ``String()`` spells it; categories are keyed and sorted by it."""
+    if val is None:
+        return "null"
+    if isinstance(val, bool):
+        return "true" if val else "false"
+    if isinstance(val, float) and val.is_integer():
+        return str(int(val))
+    return str(val)
+
+
+class GroupBy:
+    """
+    Single-pass group-by of one station's features on the x-axis field.
+
+    Each cell keeps what its function needs to be merged with the cells of
+    other stations: a number, ``[sum, count]`` for means, or a set of
+    distinct values.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.cells = {}
+        self.features = 0
+
+    def _new_cells(self):
+        cells = {}
+        for field, fn in self.query.functions.items():
+            if fn in ("mean", "average"):
+                cells[field] = [0.0, 0]
+            elif fn == "count_distinct":
+                cells[field] = set()
+            elif fn in ("min", "max"):
+                cells[field] = None
+            else:
+                cells[field] = 0
+        return cells
+
+    def add(self, props):
+        self.features += 1
+        x = _label(props.get(self.query.x_axis))
+        row = self.cells.get(x)
+        if row is None:
+            if len(self.cells) >= aggregate_setting("MAX_CATEGORIES"):
+                raise TooManyCategories(
+                    f"'{self.query.x_axis}' has more than {aggregate_setting('MAX_CATEGORIES')} distinct values"
+                )
+            row = self.cells[x] = self._new_cells()
+        for field, fn in self.query.functions.items():
+            raw = props.get(field)
+            if raw is None or raw == "":
+                continue
+            if fn == "count":
+                row[field] += 1
+            elif fn == "count_distinct":
+                row[field].add(_label(raw))
+                continue
+            value = _number(raw)
+            if value is None:
+                continue
+            if fn in ("sum", "count_unique"):
+                row[field] += value
+            elif fn in ("mean", "average"):
+                row[field][0] += value
+                row[field][1] += 1
+            elif fn == "min":
+                row[field] = value if row[field] is None else min(row[field], value)
+            elif fn == "max":
+                row[field] = value if row[field] is None else max(row[field], value)
+
+    def merge(self, other):
+        self.features += other.features
+        for x, theirs in other.cells.items():
+            row = self.cells.get(x)
+            if row is None:
+                self.cells[x] = theirs
+                continue
+            for field, fn in self.query.functions.items():
+                mine, value = row[field], theirs[field]
+                if fn in ("mean", "average"):
+                    mine[0] += value[0]
+                    mine[1] += value[1]
+                elif fn == "count_distinct":
+                    mine |= value
+                elif fn in ("min", "max"):
+                    if mine is None or value is None:
+                        row[field] = value if mine is None else mine
+                    else:
+                        row[field] = min(mine, value) if fn == "min" else max(mine, value)
+                else:
+                    row[field] = mine + value
+        if len(self.cells) > aggregate_setting("MAX_CATEGORIES"):
+            raise TooManyCategories(
+                f"'{self.query.x_axis}' has more than {aggregate_setting('MAX_CATEGORIES')} distinct values"
+            )
+
+    def matrix(self):
+        """``(categories, {field: values})`` with empty cells as 0, like the browser did."""
+        ordered = sorted(self.cells)
+        series = {}
+        for field, fn in self.query.functions.items():
+            values = []
+            for x in ordered:
+                cell = self.cells[x][field]
+                if fn in ("mean", "average"):
+                    cell = cell[0] / cell[1] if cell[1] else 0
+                elif fn == "count_distinct":
+                    cell = len(cell)
+                values.append(cell or 0)
+            series[field] = values
+        return ordered, series
+
+
+# --- Fan-out ------------------------------------------------------------------------
+
+async def _fetch(station_name, cfg, query):
+    """Group one station's features, retrying without the property selection if it is rejected."""
+    layer = {"workspace": aggregate_setting("WORKSPACE"), "typeName": query.layer}
+    timeout = aggregate_setting("TIMEOUT")
+    groups = GroupBy(query)
+    try:
+        async for feature in iter_features(station_name, layer_url(cfg, layer, query.properties()), timeout=timeout):
+            groups.add(feature.get("properties") or {})
+        return groups
+    except Exception as e:
+        if groups.features or isinstance(e, (circuit.CircuitOpenError, TooManyCategories)) or circuit.is_station_failure(e):
+            raise
+        # Older layers may lack one of the fields; fetch whole features instead
+        logger.info(f"{station_name}: property selection rejected for {query.layer} ({e}), retrying unfiltered")
+    groups = GroupBy(query)
+    async for feature in iter_features(station_name, layer_url(cfg, layer), timeout=timeout):
+        groups.add(feature.get("properties") or {})
+    return groups
+
+
+def _fan_out_args(query):
+    async def worker(station_name, cfg):
+        return station_name, await _fetch(station_name, cfg, query), None
+
+    def on_error(station_name, exc):
+        return station_name, None, exc
+
+    jobs = {name: DHA_CONFIGS[name] for name in query.servers}
+    return jobs, worker, on_error
+
+
+def _merged(query, results):
+    merged = GroupBy(query)
+    stations = []
+    for station_name, groups, error in results:
+        if isinstance(error, TooManyCategories):
+            raise error
+        if error is not None:
+            stations.append({"station_name": station_name, "error": str(error)})
+            continue
+        merged.merge(groups)
+        stations.append({"station_name": station_name, "features": groups.features})
+
+    categories, series = merged.matrix()
+    return {
+        "layer": query.layer,
+        "x_axis": query.x_axis,
+        "functions": query.functions,
+        "categories": categories,
+        "series": series,
+        "features": merged.features,
+        "stations": sorted(stations, key=lambda s: s["station_name"]),
+    }
+
+
+def run(query):
+    """Fan the query out to its stations and merge their groups into the chart payload."""
+    return _merged(query, fan_out(*_fan_out_args(query), deadline=aggregate_setting("DEADLINE")))
+
+
+async def arun(query):
+    """``run`` for the async views, awaiting the fan-out loop instead of blocking a thread."""
+    return _merged(query, await afan_out(*_fan_out_args(query), deadline=aggregate_setting("DEADLINE")))
+
+
+def _parsed(request):
+    try:
+        return GraphQuery.from_request(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+def _respond(request, payload):
+    if not any("error" not in s for s in payload["stations"]):
+        return JsonResponse({"error": "No data received from any server", "stations": payload["stations"]}, status=502)
+    return json_response(request, payload)
+
+
+def response(request):
+    query = _parsed(request)
+    if isinstance(query, JsonResponse):
+        return query
+
+    try:
+        # Graphs opened at the same time by several users share one fan-out
+        payload = singleflight.do(query.key(), lambda: run(query))
+    except TooManyCategories as e:
+        return JsonResponse({"error": str(e)}, status=422)
+    return _respond(request, payload)
+
+
+async def aresponse(request):
+    """``response`` for the async views."""
+    query = _parsed(request)
+    if isinstance(query, JsonResponse):
+        return query
+
+    try:
+        payload = await singleflight.ado(query.key(), lambda: arun(query))
+    except TooManyCategories as e:
+        return JsonResponse({"error": str(e)}, status=422)
+    return _respond(request, payload)
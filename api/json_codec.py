@@ -0,0 +1,90 @@
+"""
+JSON codec used for upstream bodies and api responses.
+
+``loads`` and ``dumps`` use orjson when it is installed and fall back to
+the standard library otherwise (or always, with
+``DHA_JSON['CODEC'] = 'stdlib'``). Both paths produce the same bytes:
+compact separators, UTF-8 rather than ``\\u`` escapes, and
+``DjangoJSONEncoder`` for dates, decimals and UUIDs. Both write the
+shortest digits that round-trip a float, but not in the same notation:
+below ``1e-4`` and from ``1e16`` up the standard library uses an exponent
+(``1e+16``) where orjson writes ``1e16`` or spells out the zeros, and orjson
+writes ``NaN`` and ``Infinity`` as ``null``. A payload holding such a float
+is encoded with the standard library. Anything else orjson cannot handle
+(integers beyond 64 bits, ``NaN`` literals in a body being decoded) also
+goes to the standard library.
+
+``geojson_stream`` keeps using the standard library because it needs
+``raw_decode``.
+"""
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+DEFAULTS = {
+    # "auto" (orjson when installed) or "stdlib"
+    "CODEC": "auto",
+}
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def json_setting(name):
+    return getattr(settings, "DHA_JSON", {}).get(name, DEFAULTS[name])
+
+
+def fast():
+    """Whether orjson is in use."""
+    return orjson is not None and json_setting("CODEC") != "stdlib"
+
+
+_django_default = DjangoJSONEncoder().default
+
+
+def _differs(obj):
+    """Whether ``obj`` holds a float that orjson and the stdlib write differently."""
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, float):
+            magnitude = abs(item)
+            if magnitude != magnitude or magnitude >= 1e16 or 0 < magnitude < 1e-4:
+                return True
+        elif isinstance(item, dict):
+            stack.extend(item)
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return False
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, cls=DjangoJSONEncoder, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps(obj):
+    """Serialize to compact UTF-8 JSON bytes."""
+    if not fast() or _differs(obj):
+        return stdlib_dumps(obj)
+    try:
+        return orjson.dumps(obj, default=_django_default, option=_ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+        # The stdlib either manages or raises its usual TypeError
+        return stdlib_dumps(obj)
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    if fast():
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
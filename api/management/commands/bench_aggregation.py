@@ -0,0 +1,156 @@
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import columnar, json_codec, station_fixtures, synthetic
+from api.geojson_stream import iter_features
+from api.summary_engine import Aggregator, spec_properties
+from api.summary_specs import SUMMARY_SPECS
+
+DEFAULT_SIZES = "1000,10000,100000"
+CHUNK_SIZE = 64 * 1024
+
+
+def chunks(body):
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield body[start:start + CHUNK_SIZE]
+
+
+def aggregate(new_aggregator, spec, layer, feature_list):
+    """Aggregate decoded features and shape the station entry, like ``station_worker`` does."""
+    agg = new_aggregator(spec)
+    metric_names = layer.get("metrics")
+    for feature in feature_list:
+        agg.add(feature.get("properties") or {}, metric_names)
+    return spec["station"]("Benchmark", agg, [])
+
+
+def measure(fn, repeat):
+    """Best wall time over ``repeat`` runs, then the peak traced allocation of one more."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the decode and aggregation stages of every summary on synthetic or recorded layers "
+        "and report peak memory; results can be saved and compared against a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("summaries", nargs="*", help="Summary names to benchmark (default: all)")
+        parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated feature counts (default: {DEFAULT_SIZES}; up to 1000000)")
+        parser.add_argument("--recorded", action="store_true", help="Use the recorded station responses (see api/station_fixtures.py) instead of synthetic layers")
+        parser.add_argument("--repeat", type=int, default=3, help="Timing runs per stage (best is kept)")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--compare", help="Baseline JSON from an earlier --output run")
+        parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline (0.25 = 25%%)")
+
+    def handle(self, *args, **options):
+        names = options["summaries"] or list(SUMMARY_SPECS)
+        unknown = [n for n in names if n not in SUMMARY_SPECS]
+        if unknown:
+            raise CommandError(f"Unknown summaries: {', '.join(unknown)}")
+        try:
+            sizes = [int(s) for s in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes must be comma-separated integers")
+
+        results = []
+        for name in names:
+            spec, _interval = SUMMARY_SPECS[name]
+            for layer in spec["layers"]:
+                for source, body in self.inputs(spec, layer, sizes, options["recorded"]):
+                    results.extend(self.bench_layer(name, spec, layer, source, body, options["repeat"]))
+
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "json_codec": "orjson" if json_codec.fast() else "stdlib",
+                "repeat": options["repeat"],
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["compare"]:
+            self.compare(results, options["compare"], options["tolerance"])
+
+    def inputs(self, spec, layer, sizes, recorded):
+        """``(source, body)`` pairs to benchmark a layer on."""
+        type_name = layer["typeName"]
+        if recorded:
+            bodies = [(station, body[:]) for station, body in station_fixtures.recorded_bodies(type_name)]
+            if not bodies:
+                self.stdout.write(self.style.WARNING(f"No recorded responses for {type_name}"))
+            return bodies
+        # The engine selects only the spec's properties, so no geometry comes back
+        properties = set(spec_properties(spec, layer))
+        return [("synthetic", synthetic.feature_collection(type_name, size, properties=properties)) for size in sizes]
+
+    def bench_layer(self, name, spec, layer, source, body, repeat):
+        type_name = layer["typeName"]
+        decoded = json_codec.loads(body)["features"]
+        size = len(decoded)
+        self.stdout.write(f"{name} / {type_name} / {source} / {size} features")
+
+        stages = {
+            "decode_whole": lambda: json_codec.loads(body),
+            "decode_stream": lambda: sum(1 for _ in iter_features(chunks(body))),
+            "aggregate_row": lambda: aggregate(Aggregator, spec, layer, decoded),
+        }
+        if columnar.available():
+            stages["aggregate_columnar"] = lambda: aggregate(columnar.ColumnarAggregator, spec, layer, decoded)
+
+        results = []
+        for stage, fn in stages.items():
+            seconds, peak = measure(fn, repeat)
+            results.append({
+                "summary": name,
+                "layer": type_name,
+                "source": source,
+                "features": size,
+                "bytes": len(body),
+                "stage": stage,
+                "seconds": seconds,
+                "features_per_second": size / seconds if seconds else None,
+                "peak_bytes": peak,
+            })
+            self.stdout.write(f"  {stage:<20}{seconds * 1000:>10.1f} ms{peak / 2**20:>10.1f} MiB peak")
+        return results
+
+    def compare(self, results, baseline_path, tolerance):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = {
+                (r["summary"], r["layer"], r.get("source", "synthetic"), r["features"], r["stage"]): r
+                for r in json.load(f)["results"]
+            }
+        regressions = []
+        for r in results:
+            before = baseline.get((r["summary"], r["layer"], r["source"], r["features"], r["stage"]))
+            if before and r["seconds"] > before["seconds"] * (1 + tolerance):
+                regressions.append(
+                    f"{r['summary']} / {r['layer']} / {r['source']} / {r['features']} / {r['stage']}: "
+                    f"{before['seconds'] * 1000:.1f} ms -> {r['seconds'] * 1000:.1f} ms"
+                )
+        if regressions:
+            raise CommandError("Slower than the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No stage is more than {tolerance:.0%} slower than {baseline_path}"))
@@ -0,0 +1,68 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import json_codec
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "..", "response_templates")
+
+
+def best_of(fn, repeat, number):
+    """Best per-call time in seconds over ``repeat`` runs of ``number`` calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+class Command(BaseCommand):
+    help = "Compare the stdlib and orjson codecs on the api/response_templates fixtures."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=50, help="Calls per timing run")
+        parser.add_argument("--repeat", type=int, default=5, help="Timing runs per measurement (best is kept)")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        if json_codec.orjson is None:
+            raise CommandError("orjson is not installed; there is nothing to compare against")
+
+        results = []
+        for filename in sorted(os.listdir(FIXTURES)):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(FIXTURES, filename), "rb") as f:
+                raw = f.read()
+            payload = json.loads(raw)
+
+            fast = json_codec.dumps(payload)
+            slow = json_codec.stdlib_dumps(payload)
+            if fast != slow:
+                raise CommandError(f"{filename}: the codecs produce different output")
+            if json_codec.orjson.loads(raw) != payload:
+                raise CommandError(f"{filename}: the codecs decode differently")
+
+            timings = {
+                "decode_stdlib": best_of(lambda: json.loads(raw), options["repeat"], options["number"]),
+                "decode_orjson": best_of(lambda: json_codec.orjson.loads(raw), options["repeat"], options["number"]),
+                "encode_stdlib": best_of(lambda: json_codec.stdlib_dumps(payload), options["repeat"], options["number"]),
+                "encode_orjson": best_of(lambda: json_codec.dumps(payload), options["repeat"], options["number"]),
+            }
+            results.append({"fixture": filename, "bytes": len(raw), **timings})
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'fixture':<28}{'bytes':>9}{'decode x':>10}{'encode x':>10}   (stdlib time / orjson time)")
+        for r in results:
+            self.stdout.write(
+                f"{r['fixture']:<28}{r['bytes']:>9}"
+                f"{r['decode_stdlib'] / r['decode_orjson']:>10.1f}"
+                f"{r['encode_stdlib'] / r['encode_orjson']:>10.1f}"
+            )
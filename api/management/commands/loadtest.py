@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.station_fleet import StationFleet
+from api.summary_specs import SUMMARY_SPECS
+
+SUMMARY_ROUTES = ["land-summary", "town-summary", "services-summary", "horticulture-summary", "security-summary"]
+PAGE_ROUTES = ["land", "townplan", "cheif_engineering", "horticulture", "security", "corgis", "query-engine"]
+PROXY_LAYERS = ["finalreport", "phase_plot_category_summary", "Horticulture Point"]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def build_targets(fleet, routes, page_cookie):
+    """``(endpoint label, path)`` pairs the clients cycle through."""
+    targets = []
+    if "summaries" in routes:
+        targets += [(f"/api/{route}/", f"/api/{route}/") for route in SUMMARY_ROUTES]
+    if "proxy" in routes:
+        for index, layer in enumerate(PROXY_LAYERS):
+            station = fleet.stations[index % len(fleet.stations)]
+            upstream = f"http://{fleet.address(station)}/geoserver/dha_coregis/wfs"
+            query = urllib.parse.urlencode({
+                "url": upstream, "service": "WFS", "version": "1.0.0", "request": "GetFeature",
+                "typeName": f"dha_coregis:{layer}", "outputFormat": "application/json", "maxFeatures": 500,
+            })
+            targets.append(("/api/proxy/geoserver/", f"/api/proxy/geoserver/?{query}"))
+    if "pages" in routes and page_cookie:
+        targets += [(f"/{route}/", f"/{route}/") for route in PAGE_ROUTES]
+    return targets
+
+
+class Command(BaseCommand):
+    help = (
+        "Start simulated GeoServer stations and gunicorn, drive concurrent traffic against the "
+        "summary, proxy and page routes, and report throughput and latency percentiles per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        group = parser.add_argument_group("station fleet")
+        group.add_argument("--base-port", type=int, default=18100, help="Port of the first station; one port per station")
+        group.add_argument("--features", type=int, default=5000, help="Features per layer")
+        group.add_argument("--latency", type=float, default=0.05, help="Mean station latency in seconds")
+        group.add_argument("--jitter", type=float, default=0.02, help="Latency jitter in seconds (+/-)")
+        group.add_argument("--error-rate", type=float, default=0.0, help="Share of station requests answered with 503")
+        group.add_argument("--seed", type=int, default=0)
+
+        group = parser.add_argument_group("application")
+        group.add_argument("--target", help="Base URL of an already running app (skips starting gunicorn; "
+                                            "it must already point at the fleet)")
+        group.add_argument("--bind", default="127.0.0.1:18000", help="Address gunicorn listens on")
+        group.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+        group.add_argument("--threads", type=int, default=4, help="Threads per gunicorn worker")
+        group.add_argument("--worker-class", default="gthread", help="gunicorn worker class")
+        group.add_argument("--timeout", type=int, default=60, help="gunicorn worker timeout")
+        group.add_argument("--asgi", action="store_true", help="Serve dha_web_gis.asgi with uvicorn workers and the "
+                                                               "async views (ASYNC_VIEWS=True; --threads is ignored)")
+
+        group = parser.add_argument_group("traffic")
+        group.add_argument("--routes", default="summaries,proxy,pages",
+                           help="Comma-separated route groups: summaries, proxy, pages")
+        group.add_argument("--concurrency", type=int, default=20, help="Concurrent clients")
+        group.add_argument("--duration", type=float, default=30, help="Measured seconds")
+        group.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds before the run")
+        group.add_argument("--page-user", help="Username whose session is used for the page routes "
+                                               "(they need a login; skipped otherwise)")
+        group.add_argument("--json", dest="output", help="Write the report as JSON to this file")
+
+    def handle(self, *args, **options):
+        routes = {r.strip() for r in options["routes"].split(",") if r.strip()}
+        unknown = routes - {"summaries", "proxy", "pages"}
+        if unknown:
+            raise CommandError(f"Unknown route groups: {', '.join(sorted(unknown))}")
+
+        fleet = StationFleet(
+            base_port=options["base_port"], features=options["features"], latency=options["latency"],
+            jitter=options["jitter"], error_rate=options["error_rate"], seed=options["seed"],
+        )
+        page_cookie = self.page_cookie(options["page_user"]) if "pages" in routes else None
+        if "pages" in routes and not page_cookie:
+            self.stdout.write(self.style.WARNING("No --page-user given; the page routes are skipped"))
+
+        self.stdout.write(f"Starting {len(fleet.stations)} stations from port {options['base_port']}")
+        fleet.start()
+        server = None
+        try:
+            if options["target"]:
+                base_url = options["target"].rstrip("/")
+            else:
+                base_url = f"http://{options['bind']}"
+                server = self.start_server(fleet, options)
+            self.wait_ready(base_url, server)
+
+            targets = build_targets(fleet, routes, page_cookie)
+            if not targets:
+                raise CommandError("Nothing to load-test")
+            cookies = {settings.SESSION_COOKIE_NAME: page_cookie} if page_cookie else {}
+            if options["warmup"]:
+                self.stdout.write(f"Warming up for {options['warmup']:g}s")
+                asyncio.run(drive(base_url, targets, options["concurrency"], options["warmup"], cookies))
+            self.stdout.write(f"Running {options['concurrency']} clients for {options['duration']:g}s")
+            samples = asyncio.run(drive(base_url, targets, options["concurrency"], options["duration"], cookies))
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+            fleet.stop()
+
+        report = self.report(samples, options, fleet)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+
+    def page_cookie(self, username):
+        if not username:
+            return None
+        from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+        from django.contrib.sessions.backends.db import SessionStore
+
+        try:
+            user = get_user_model().objects.get(username=username)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user named {username!r}")
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    def start_server(self, fleet, options):
+        env = dict(os.environ, **fleet.env())
+        if options["asgi"]:
+            env["ASYNC_VIEWS"] = "True"
+            app, worker = ["dha_web_gis.asgi:application"], ["--worker-class", "uvicorn_worker.UvicornWorker"]
+        else:
+            app, worker = ["dha_web_gis.wsgi:application"], ["--threads", str(options["threads"]), "--worker-class", options["worker_class"]]
+        command = [
+            sys.executable, "-m", "gunicorn", *app,
+            "--bind", options["bind"],
+            "--workers", str(options["workers"]),
+            *worker,
+            "--timeout", str(options["timeout"]),
+            "--log-level", "warning",
+        ]
+        self.stdout.write(" ".join(command[2:]))
+        try:
+            return subprocess.Popen(command, env=env, cwd=settings.BASE_DIR)
+        except OSError as e:
+            raise CommandError(f"Could not start gunicorn: {e}")
+
+    def wait_ready(self, base_url, server, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise CommandError(f"gunicorn exited with status {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"{base_url}/api/dha/servers", timeout=5):
+                    return
+            except OSError:
+                time.sleep(0.5)
+        raise CommandError(f"{base_url} did not answer within {timeout}s")
+
+    def report(self, samples, options, fleet):
+        duration = options["duration"]
+        endpoints = []
+        self.stdout.write(f"\n{'endpoint':<28}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for endpoint, entries in sorted(samples.items()):
+            latencies = sorted(seconds for seconds, ok in entries)
+            errors = sum(1 for _, ok in entries if not ok)
+            row = {
+                "endpoint": endpoint,
+                "requests": len(entries),
+                "requests_per_second": len(entries) / duration,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "errors": errors,
+            }
+            endpoints.append(row)
+            self.stdout.write(
+                f"{endpoint:<28}{row['requests']:>9}{row['requests_per_second']:>9.1f}{row['p50_ms']:>9.0f}"
+                f"{row['p95_ms']:>9.0f}{row['p99_ms']:>9.0f}{errors:>8}"
+            )
+        return {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "target": options["target"],
+                "gunicorn": None if options["target"] else {
+                    "app": "asgi" if options["asgi"] else "wsgi",
+                    "workers": options["workers"],
+                    "threads": None if options["asgi"] else options["threads"],
+                    "worker_class": "uvicorn_worker.UvicornWorker" if options["asgi"] else options["worker_class"],
+                },
+                "concurrency": options["concurrency"],
+                "duration": duration,
+                "fleet": {
+                    "stations": len(fleet.stations), "features": fleet.features, "latency": fleet.latency,
+                    "jitter": fleet.jitter, "error_rate": fleet.error_rate,
+                },
+                "summaries": list(SUMMARY_SPECS),
+            },
+            "endpoints": endpoints,
+        }
+
+
+async def drive(base_url, targets, concurrency, duration, cookies):
+    """Run ``concurrency`` clients for ``duration`` seconds; returns ``{endpoint: [(seconds, ok)]}``."""
+    import aiohttp
+
+    samples = {}
+    deadline = time.monotonic() + duration
+    timeout = aiohttp.ClientTimeout(total=120)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(base_url, cookies=cookies, timeout=timeout, connector=connector) as session:
+        async def client(offset):
+            i = offset
+            while time.monotonic() < deadline:
+                endpoint, path = targets[i % len(targets)]
+                i += 1
+                started = time.perf_counter()
+                try:
+                    async with session.get(path, allow_redirects=False) as response:
+                        await response.read()
+                        ok = response.status < 300
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    ok = False
+                samples.setdefault(endpoint, []).append((time.perf_counter() - started, ok))
+
+        await asyncio.gather(*(client(n) for n in range(concurrency)))
+    return samples
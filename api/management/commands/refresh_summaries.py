@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import delta_sync, materialize, station_cache
+from api.geo_server_config import GEOSERVER_CONFIG
+import api.views  # noqa: F401  (registers the summary builders)
+
+
+class Command(BaseCommand):
+    help = "Materialize the dashboard summaries, once or continuously on their refresh intervals."
+
+    def add_arguments(self, parser):
+        parser.add_argument("summaries", nargs="*", help="Summary names to refresh (default: all)")
+        parser.add_argument("--loop", action="store_true", help="Keep running and refresh each summary when it goes stale")
+        parser.add_argument("--tick", type=float, default=5, help="Seconds between staleness checks in --loop mode")
+        parser.add_argument("--force", action="store_true", help="Refresh even if the stored copy is still fresh")
+        parser.add_argument("--full-sync", action="store_true", help="Drop the incremental sync watermarks so every layer is downloaded in full")
+
+    def handle(self, *args, **options):
+        names = options["summaries"] or list(materialize.SUMMARIES)
+        unknown = [n for n in names if n not in materialize.SUMMARIES]
+        if unknown:
+            raise CommandError(f"Unknown summaries: {', '.join(unknown)}")
+
+        if options["full_sync"]:
+            stations = [station.title() for station in GEOSERVER_CONFIG["dha_servers"]]
+            for name in names:
+                delta_sync.reset(name, stations)
+                station_cache.invalidate(name, stations)
+
+        if options["loop"]:
+            self.stdout.write(f"Refreshing {', '.join(names)} (Ctrl+C to stop)")
+            try:
+                materialize.run_scheduler(names, tick=options["tick"])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        if options["force"] or options["full_sync"]:
+            for name in names:
+                materialize.refresh(name)
+            refreshed = names
+        else:
+            refreshed = materialize.refresh_due(names)
+
+        for name in refreshed:
+            self.stdout.write(self.style.SUCCESS(f"Materialized {name}"))
+        if not refreshed:
+            self.stdout.write("All summaries are fresh")
@@ -0,0 +1,242 @@
+"""
+Materialized dashboard summaries with stale-while-revalidate serving.
+
+Each summary builder registered here is refreshed on its own interval and
+the result is stored in the Django cache, so the summary views can always
+answer from the most recent copy. When a copy is older than its interval the
+view still serves it and kicks off a background refresh.
+
+The refresh loop runs either as ``python manage.py refresh_summaries --loop``
+or in-process (``DHA_MATERIALIZE['IN_PROCESS_SCHEDULER']``).
+
+A copy that had to be built on request is built within the request's
+latency budget; stations that did not make it are marked stale or pending
+in it, and such a partial copy is refreshed again after ``PARTIAL_RETRY``
+seconds instead of its full interval.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from api import metrics, singleflight
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "CACHE": "default",
+    "IN_PROCESS_SCHEDULER": False,
+    "INTERVALS": {},
+    # Seconds a request may wait for a summary that has to be built
+    "LATENCY_BUDGET": 8,
+    "MAX_LATENCY_BUDGET": 30,
+    "PARTIAL_RETRY": 10,
+}
+
+# name -> {"builder": callable, "interval": seconds}
+SUMMARIES = {}
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_scheduler = None
+
+
+def materialize_setting(name):
+    return getattr(settings, "DHA_MATERIALIZE", {}).get(name, DEFAULTS[name])
+
+
+def summary(name, interval):
+    """Register a summary builder; ``INTERVALS`` in settings overrides ``interval``."""
+    def decorator(builder):
+        SUMMARIES[name] = {
+            "builder": builder,
+            "interval": materialize_setting("INTERVALS").get(name, interval),
+        }
+        return builder
+    return decorator
+
+
+def _cache():
+    return caches[materialize_setting("CACHE")]
+
+
+def _key(name):
+    return f"dha:summary:{name}"
+
+
+def is_stale(entry, name):
+    age = time.time() - entry["refreshed_at"]
+    if entry.get("partial"):
+        return age >= materialize_setting("PARTIAL_RETRY")
+    return age >= SUMMARIES[name]["interval"]
+
+
+def latency_budget(requested=None):
+    """The request's budget in seconds, defaulting to and capped by the settings."""
+    if requested is None:
+        return materialize_setting("LATENCY_BUDGET")
+    budget = float(requested)
+    if not math.isfinite(budget):
+        raise ValueError(f"Invalid latency budget: {requested}")
+    return min(max(budget, 0.1), materialize_setting("MAX_LATENCY_BUDGET"))
+
+
+def refresh(name, deadline=None):
+    """
+    Rebuild one summary now and store the result.
+
+    Concurrent refreshes of the same summary, in this process or any other
+    worker, are coalesced into a single upstream fan-out. ``deadline``
+    bounds the fan-out (default: the fan-out engine's global deadline).
+    A caller that joins a build with a shorter deadline than its own and
+    gets a partial copy builds again with the time it has left, so a tiny
+    ``?budget=`` does not cut short the requests that asked for more.
+    """
+    if deadline is None:
+        return singleflight.do(f"summary:{name}", lambda: _build(name))
+    expires_at = time.monotonic() + deadline
+    while True:
+        remaining = expires_at - time.monotonic()
+        entry = singleflight.do(f"summary:{name}", lambda: _build(name, remaining))
+        if _settled(entry, expires_at):
+            return entry
+
+
+def _settled(entry, expires_at):
+    """Whether a caller with ``expires_at`` can take a copy: complete, or built with at least its time left."""
+    deadline = entry.get("deadline")
+    return not entry["partial"] or deadline is None or expires_at - time.monotonic() <= deadline
+
+
+def _build(name, deadline=None):
+    started = time.monotonic()
+    entry = store(name, SUMMARIES[name]["builder"](deadline=deadline), deadline=deadline)
+    metrics.summary_build.observe(time.monotonic() - started, summary=name)
+    logger.info(f"Materialized {name} in {time.monotonic() - started:.2f}s")
+    return entry
+
+
+def store(name, payload, deadline=None):
+    """Store a freshly built payload as the summary's materialized copy."""
+    entry = {
+        "payload": payload,
+        "refreshed_at": time.time(),
+        "partial": isinstance(payload, dict) and payload.get("partial", False),
+        # The fan-out deadline it was built with (None: the default)
+        "deadline": deadline,
+    }
+    _cache().set(_key(name), entry, timeout=None)
+    return entry
+
+
+def refresh_in_background(name):
+    """Start a background refresh unless one is already running in this process."""
+    with _refreshing_lock:
+        if name in _refreshing:
+            return
+        _refreshing.add(name)
+
+    def run():
+        try:
+            refresh(name)
+        except Exception as e:
+            logger.error(f"Background refresh of {name} failed: {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(name)
+
+    threading.Thread(target=run, name=f"refresh-{name}", daemon=True).start()
+
+
+def get(name, budget=None):
+    """
+    Return the materialized entry for a summary.
+
+    A stale copy is returned as-is while a refresh runs in the background.
+    Only a missing copy (never built, or evicted) is built synchronously,
+    within ``budget`` seconds (see ``latency_budget``).
+    """
+    entry = peek(name)
+    if entry is None:
+        return refresh(name, deadline=budget or latency_budget())
+    return entry
+
+
+async def aget(name, budget=None):
+    """
+    ``get`` for the async views. The copy is read on the event loop; a
+    missing one is built by a single leader in a worker thread (the builders
+    are blocking), and every other caller in the process awaits it there,
+    building again like ``refresh`` if the leader's deadline was shorter.
+    """
+    entry = peek(name)
+    if entry is not None:
+        return entry
+    loop = asyncio.get_running_loop()
+    expires_at = time.monotonic() + (budget or latency_budget())
+    while True:
+        remaining = expires_at - time.monotonic()
+        entry = await singleflight.ado(f"summary:{name}", lambda: loop.run_in_executor(None, _build, name, remaining))
+        if _settled(entry, expires_at):
+            return entry
+
+
+def peek(name):
+    """The materialized entry if there is one (refreshing a stale one in the background), else None."""
+    if materialize_setting("IN_PROCESS_SCHEDULER"):
+        start_scheduler()
+
+    entry = _cache().get(_key(name))
+    if entry is None:
+        metrics.cache_requests.inc(cache="summary", outcome="miss")
+    elif is_stale(entry, name):
+        metrics.cache_requests.inc(cache="summary", outcome="stale")
+        refresh_in_background(name)
+    else:
+        metrics.cache_requests.inc(cache="summary", outcome="hit")
+    return entry
+
+
+def stored(name):
+    """The materialized entry as stored, without staleness checks (e.g. for a builder), or None."""
+    return _cache().get(_key(name))
+
+
+def refresh_due(names=None):
+    """Refresh every summary whose copy is missing or stale; returns the names refreshed."""
+    refreshed = []
+    for name in names or SUMMARIES:
+        entry = _cache().get(_key(name))
+        if entry is not None and not is_stale(entry, name):
+            continue
+        try:
+            refresh(name)
+            refreshed.append(name)
+        except Exception as e:
+            logger.error(f"Scheduled refresh of {name} failed: {e}")
+    return refreshed
+
+
+def run_scheduler(names=None, tick=5, stop_event=None):
+    """Refresh loop shared by the management command and the in-process thread."""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        refresh_due(names)
+        stop_event.wait(tick)
+
+
+def start_scheduler():
+    """Start the in-process scheduler thread once per worker process."""
+    global _scheduler
+    if _scheduler is not None and _scheduler.is_alive():
+        return
+    with _refreshing_lock:
+        if _scheduler is not None and _scheduler.is_alive():
+            return
+        _scheduler = threading.Thread(target=run_scheduler, name="summary-scheduler", daemon=True)
+        _scheduler.start()
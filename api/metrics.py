@@ -0,0 +1,368 @@
+"""
+Timing and throughput metrics in the Prometheus text format.
+
+Every upstream call is wrapped in ``upstream_call``. That covers the
+summary fan-out (api/fanout.py), ``proxy_geoserver`` and
+``check_server_connectivity``. Each call records:
+
+- the connect time and the time to first byte;
+- the bytes downloaded;
+- the time spent decoding and aggregating;
+- the features seen;
+- its outcome, which is ``ok`` or the error class.
+
+Calls are labelled by station, layer (the WFS ``typeName``, or the request
+type) and endpoint. The proxy passes on whatever ``typeName`` the client
+sends, so the layer label is bounded: a layer the app knows (the query
+engine's and the summaries') or a WFS request type, lowercased, and
+``other`` for anything else. The station and summary caches count hits
+and misses, and summary builds are timed.
+
+Each worker process keeps its own counters and publishes a copy of them to
+the shared cache every ``SHARE_INTERVAL`` seconds. ``/api/metrics`` merges
+the copies of every live worker, so a scrape sees the whole deployment
+whichever worker answers it.
+
+``/api/metrics`` only answers clients in ``ALLOWED_IPS`` (local ones by
+default; None lets everyone in). Behind a reverse proxy every request
+comes from the proxy's address, so the proxy must not pass
+``/api/metrics`` on from outside: deny it there, and let Prometheus scrape
+the application port directly.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlsplit
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "ENABLED": True,
+    "CACHE": "default",
+    "SHARE_INTERVAL": 10,
+    # Client addresses allowed to scrape /api/metrics (None: anyone)
+    "ALLOWED_IPS": ("127.0.0.1", "::1"),
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+
+
+def metrics_setting(name):
+    return getattr(settings, "DHA_METRICS", {}).get(name, DEFAULTS[name])
+
+
+def enabled():
+    return metrics_setting("ENABLED")
+
+
+def allowed(request):
+    """Whether the client may scrape ``/api/metrics``."""
+    ips = metrics_setting("ALLOWED_IPS")
+    return ips is None or request.META.get("REMOTE_ADDR") in ips
+
+
+# --- Registry -------------------------------------------------------------------
+
+REGISTRY = {}
+_lock = threading.Lock()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.series = {}
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, amount=1, **labels):
+        if not enabled():
+            return
+        _ensure_publisher()
+        key = self._key(labels)
+        with _lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not enabled():
+            return
+        _ensure_publisher()
+        key = self._key(labels)
+        with _lock:
+            # [count per bucket..., count above the last bucket, sum]
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+
+upstream_requests = Counter(
+    "dha_upstream_requests_total", "Upstream GeoServer calls by outcome (ok or error class).",
+    ["station", "layer", "endpoint", "outcome"],
+)
+upstream_duration = Histogram(
+    "dha_upstream_duration_seconds", "Total time of an upstream call, including download and processing.",
+    ["station", "layer", "endpoint"],
+)
+upstream_connect = Histogram(
+    "dha_upstream_connect_seconds", "Time to open a new connection to a station.",
+    ["station"],
+)
+upstream_ttfb = Histogram(
+    "dha_upstream_ttfb_seconds", "Time from sending an upstream request to receiving its headers.",
+    ["station", "layer", "endpoint"],
+)
+upstream_bytes = Counter(
+    "dha_upstream_bytes_total", "Bytes downloaded from stations.",
+    ["station", "layer", "endpoint"],
+)
+decode_seconds = Histogram(
+    "dha_decode_seconds", "Time spent decoding upstream bodies.",
+    ["station", "layer", "endpoint"],
+)
+aggregation_seconds = Histogram(
+    "dha_aggregation_seconds", "Time spent aggregating the features of an upstream call.",
+    ["station", "layer", "endpoint"],
+)
+features = Counter(
+    "dha_features_total", "Features received from stations.",
+    ["station", "layer", "endpoint"],
+)
+cache_requests = Counter(
+    "dha_cache_requests_total", "Cache lookups by outcome (hit, stale or miss).",
+    ["cache", "outcome"],
+)
+summary_build = Histogram(
+    "dha_summary_build_seconds", "Time to build a materialized summary.",
+    ["summary"],
+)
+
+
+# --- Upstream calls -------------------------------------------------------------
+
+def layer_of(url, params=None):
+    """The layer a WFS URL asks for (without workspace), else its request type."""
+    query = dict(parse_qsl(urlsplit(url).query))
+    query.update(params or {})
+    query = {k.lower(): v for k, v in query.items()}
+    type_name = query.get("typenames") or query.get("typename")
+    if type_name:
+        return type_name.split(",")[0].rpartition(":")[2]
+    return query.get("request", "")
+
+
+# Request types that label calls without a layer
+_REQUESTS = {
+    "getcapabilities", "describefeaturetype", "getfeature", "getpropertyvalue",
+    "getmap", "getfeatureinfo", "getlegendgraphic",
+}
+
+_known_layers = None
+
+
+def known_layers():
+    """The layers the app asks for: the query engine's and the summaries' (lowercase)."""
+    global _known_layers
+    if _known_layers is None:
+        # Imported late: the summary specs import the fan-out, which imports this module
+        from api.geo_server_config import GEOSERVER_CONFIG
+        from api.summary_specs import SUMMARY_SPECS
+        layers = set(GEOSERVER_CONFIG.get("query_engine_layers", {}).get("flat", []))
+        layers.update(layer["typeName"] for spec, _ in SUMMARY_SPECS.values() for layer in spec["layers"])
+        _known_layers = {layer.lower() for layer in layers}
+    return _known_layers
+
+
+def layer_label(layer):
+    """The ``layer`` label for a ``layer_of`` result: known layers and request types, else ``other``."""
+    layer = (layer or "").lower()
+    return layer if layer in _REQUESTS or layer in known_layers() else "other"
+
+
+class UpstreamCall:
+    """Measurements of one upstream call, recorded by ``finish``."""
+
+    def __init__(self, station, layer, endpoint):
+        self.labels = {"station": (station or "").lower(), "layer": layer_label(layer), "endpoint": endpoint}
+        self.started = time.perf_counter()
+        self.bytes = 0
+        self.decode = 0.0
+        self.aggregation = 0.0
+        self.features = 0
+
+    def first_byte(self, seconds=None):
+        upstream_ttfb.observe(time.perf_counter() - self.started if seconds is None else seconds, **self.labels)
+
+    def finish(self, exc=None):
+        outcome = "ok" if exc is None else type(exc).__name__
+        upstream_requests.inc(outcome=outcome, **self.labels)
+        upstream_duration.observe(time.perf_counter() - self.started, **self.labels)
+        if self.bytes:
+            upstream_bytes.inc(self.bytes, **self.labels)
+        if self.decode:
+            decode_seconds.observe(self.decode, **self.labels)
+        if self.aggregation:
+            aggregation_seconds.observe(self.aggregation, **self.labels)
+        if self.features:
+            features.inc(self.features, **self.labels)
+
+
+@contextmanager
+def upstream_call(station, url, endpoint, params=None):
+    """Measure one upstream call; the yielded ``UpstreamCall`` collects the details."""
+    call = UpstreamCall(station, layer_of(url, params), endpoint)
+    try:
+        yield call
+    except BaseException as e:
+        call.finish(e)
+        raise
+    call.finish()
+
+
+def trace_config(station):
+    """aiohttp trace hooks recording the connect time of a station's new connections."""
+    import aiohttp
+
+    async def start(session, ctx, params):
+        ctx.connect_started = time.perf_counter()
+
+    async def end(session, ctx, params):
+        upstream_connect.observe(time.perf_counter() - ctx.connect_started, station=station.lower())
+
+    config = aiohttp.TraceConfig()
+    config.on_connection_create_start.append(start)
+    config.on_connection_create_end.append(end)
+    return config
+
+
+# --- Sharing and exposition -----------------------------------------------------------
+
+_INDEX_KEY = "dha:metrics:processes"
+_publisher_pid = None
+
+
+def _process_key(pid):
+    return f"dha:metrics:{pid}"
+
+
+def snapshot():
+    with _lock:
+        return {name: {key: list(v) if isinstance(v, list) else v for key, v in metric.series.items()}
+                for name, metric in REGISTRY.items()}
+
+
+def _ensure_publisher():
+    """Start this process's publishing thread (once per process, also after a fork)."""
+    global _publisher_pid
+    if _publisher_pid == os.getpid():
+        return
+    with _lock:
+        if _publisher_pid == os.getpid():
+            return
+        _publisher_pid = os.getpid()
+    threading.Thread(target=_publish_loop, name="metrics-publisher", daemon=True).start()
+
+
+def _publish_loop():
+    while True:
+        time.sleep(metrics_setting("SHARE_INTERVAL"))
+        publish()
+
+
+def publish():
+    """Share this process's counters with the other workers."""
+    interval = metrics_setting("SHARE_INTERVAL")
+    cache = caches[metrics_setting("CACHE")]
+    pid = os.getpid()
+    try:
+        cache.set(_process_key(pid), snapshot(), timeout=interval * 6)
+        pids = cache.get(_INDEX_KEY) or []
+        if pid not in pids:
+            cache.set(_INDEX_KEY, pids + [pid], timeout=None)
+    except Exception as e:
+        logger.warning(f"Could not publish metrics: {e}")
+
+
+def collect():
+    """Counters of every live worker process, summed."""
+    publish()
+    cache = caches[metrics_setting("CACHE")]
+    pids = cache.get(_INDEX_KEY) or []
+    snapshots = cache.get_many([_process_key(pid) for pid in pids])
+    live = [pid for pid in pids if _process_key(pid) in snapshots]
+    if live != pids:
+        # Drop workers that stopped publishing
+        cache.set(_INDEX_KEY, live, timeout=None)
+
+    merged = {}
+    for snap in snapshots.values():
+        for name, series in snap.items():
+            target = merged.setdefault(name, {})
+            for key, value in series.items():
+                if key not in target:
+                    target[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target[key] = [a + b for a, b in zip(target[key], value)]
+                else:
+                    target[key] += value
+    return merged
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(merged=None):
+    """The Prometheus text exposition of ``collect()``."""
+    merged = collect() if merged is None else merged
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(merged.get(name, {}).items()):
+            if metric.kind == "counter":
+                lines.append(f"{name}{_labels(metric.label_names, key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(metric.label_names, key, le)} {cumulative}")
+            count = cumulative + value[len(metric.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{_labels(metric.label_names, key, le)} {count}")
+            lines.append(f"{name}_sum{_labels(metric.label_names, key)} {value[-1]}")
+            lines.append(f"{name}_count{_labels(metric.label_names, key)} {count}")
+    return "\n".join(lines) + "\n"
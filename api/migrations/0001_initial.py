@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotStation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.CharField(max_length=64)),
+                ('station', models.CharField(max_length=64)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+                ('attempted_at', models.DateTimeField(blank=True, null=True)),
+                ('feature_count', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('summary', 'station'), name='snapshot_station_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.CharField(max_length=64)),
+                ('station', models.CharField(max_length=64)),
+                ('layer', models.CharField(max_length=128)),
+                ('feature_id', models.CharField(max_length=255)),
+                ('dimension_1', models.CharField(blank=True, default='', max_length=255)),
+                ('dimension_2', models.CharField(blank=True, default='', max_length=255)),
+                ('dimension_3', models.CharField(blank=True, default='', max_length=255)),
+                ('metric', models.CharField(max_length=64)),
+                ('value', models.FloatField()),
+                ('is_float', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['summary', 'station', 'layer'], name='snapshot_value_layer_idx'), models.Index(fields=['summary', 'dimension_1', 'dimension_2'], name='snapshot_value_dims_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import models
+
+
+class SnapshotStation(models.Model):
+    """Sync status of one station's snapshot for one summary (see api/snapshot.py)."""
+
+    summary = models.CharField(max_length=64)
+    station = models.CharField(max_length=64)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    attempted_at = models.DateTimeField(null=True, blank=True)
+    feature_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["summary", "station"], name="snapshot_station_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.summary}/{self.station}"
+
+
+class SnapshotValue(models.Model):
+    """
+    One metric of one station feature, stored with the feature's normalized
+    dimension values so summaries can be grouped and summed in SQL.
+
+    ``dimension_1``..``dimension_3`` hold the spec's dimensions in
+    declaration order.
+    """
+
+    summary = models.CharField(max_length=64)
+    station = models.CharField(max_length=64)
+    layer = models.CharField(max_length=128)
+    feature_id = models.CharField(max_length=255)
+    dimension_1 = models.CharField(max_length=255, blank=True, default="")
+    dimension_2 = models.CharField(max_length=255, blank=True, default="")
+    dimension_3 = models.CharField(max_length=255, blank=True, default="")
+    metric = models.CharField(max_length=64)
+    value = models.FloatField()
+    # Whether the source value was a float, so integer metrics stay integers
+    is_float = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["summary", "station", "layer"], name="snapshot_value_layer_idx"),
+            models.Index(fields=["summary", "dimension_1", "dimension_2"], name="snapshot_value_dims_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.summary}/{self.station}/{self.feature_id}.{self.metric}"
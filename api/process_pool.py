@@ -0,0 +1,179 @@
+"""
+Process-pool parse-and-aggregate mode for the summary engine.
+
+The fan-out loop normally decodes every station response and runs the
+aggregation loop in the web worker, where JSON decoding and the per-feature
+Python loops of all nine stations share one GIL. With
+``DHA_PROCESS_POOL['ENABLED']`` the loop only downloads each page's raw
+bytes. A pool of worker processes decodes the page, aggregates it with the
+spec's aggregator and sends back just the grouped sums, which are merged
+into the station's ``MergedAggregate``. Large refreshes then spread across
+cores, and a parsed FeatureCollection never exists in the web worker.
+
+Pool workers look their spec up by summary name in ``SUMMARY_SPECS``,
+because specs hold lambdas and cannot be pickled. They are started with
+``spawn`` (the web worker runs threads, which do not survive ``fork``) and
+recycled after ``MAX_TASKS_PER_CHILD`` pages so memory from huge payloads is
+returned to the OS.
+
+Summed floats are merged page by page, so the last digit may differ from a
+single-pass run. When delta sync is enabled (api/delta_sync.py), specs with
+an ``updated_field`` layer are synced by it in the web worker instead.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from api import metrics
+from api.fanout import gather_or_cancel, get_bytes
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "ENABLED": False,
+    # Worker processes (default: one per CPU)
+    "WORKERS": None,
+    "MAX_TASKS_PER_CHILD": 50,
+}
+
+
+def pool_setting(name):
+    return getattr(settings, "DHA_PROCESS_POOL", {}).get(name, DEFAULTS[name])
+
+
+def enabled():
+    return pool_setting("ENABLED")
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def pool():
+    """The process pool of this web worker, started on first use."""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ProcessPoolExecutor(
+                    max_workers=pool_setting("WORKERS") or os.cpu_count(),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    max_tasks_per_child=pool_setting("MAX_TASKS_PER_CHILD"),
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+# --- Pool side ---------------------------------------------------------------
+
+def aggregate_body(summary_name, layer_index, body):
+    """
+    Decode one page and aggregate it; returns ``(feature_count, groups)``
+    and the decode and aggregation times.
+
+    Runs in a pool worker.
+    """
+    from api import json_codec
+    from api.summary_engine import make_aggregator
+    from api.summary_specs import SUMMARY_SPECS
+
+    spec, _interval = SUMMARY_SPECS[summary_name]
+    layer = spec["layers"][layer_index]
+    metric_names = layer.get("metrics")
+
+    started = time.perf_counter()
+    # An empty body is a page without features
+    data = json_codec.loads(body) if body.strip() else {}
+    del body
+    decoded = time.perf_counter()
+    agg = make_aggregator(spec)
+    for feature in data.get("features", []):
+        agg.add(feature.get("properties") or {}, metric_names)
+    groups = {group: dict(buckets) for group, buckets in agg.groups.items()}
+    return (agg.feature_count, groups), decoded - started, time.perf_counter() - decoded
+
+
+# --- Web worker side -----------------------------------------------------------
+
+class MergedAggregate:
+    """Grouped sums merged from pool results, shaped like ``summary_engine.Aggregator``."""
+
+    def __init__(self, spec):
+        self.initial = {name: m.get("initial", 0) for name, m in spec["metrics"].items()}
+        self.groups = {name: {} for name in spec["groups"]}
+        self.feature_count = 0
+
+    def zero(self):
+        return dict(self.initial)
+
+    def merge(self, result):
+        feature_count, groups = result
+        self.feature_count += feature_count
+        for group, buckets in groups.items():
+            merged = self.groups[group]
+            for key, metrics in buckets.items():
+                bucket = merged.get(key)
+                if bucket is None:
+                    merged[key] = dict(metrics)
+                    continue
+                # Every pool result starts its buckets from the initial values
+                for name, value in metrics.items():
+                    bucket[name] += value - self.initial[name]
+
+
+def page_fetcher(summary_name, layer_index):
+    """``aggregate_page`` fetch that hands the raw page to the pool."""
+    async def fetch(station_name, url, timeout, consume):
+        body = await get_bytes(station_name, url, timeout=timeout)
+        loop = asyncio.get_running_loop()
+        result, decode, aggregation = await loop.run_in_executor(pool(), aggregate_body, summary_name, layer_index, body)
+        labels = {"station": station_name, "layer": metrics.layer_label(metrics.layer_of(url)), "endpoint": "summary"}
+        metrics.decode_seconds.observe(decode, **labels)
+        metrics.aggregation_seconds.observe(aggregation, **labels)
+        metrics.features.inc(result[0], **labels)
+        consume(result)
+    return fetch
+
+
+def station_worker(summary_name, spec):
+    from api.summary_engine import aggregate_layer
+
+    async def worker(station_name, cfg):
+        agg = MergedAggregate(spec)
+        errors = []
+
+        async def run_layer(index, layer):
+            try:
+                await aggregate_layer(
+                    spec, agg.merge, station_name, cfg, layer,
+                    fetch=page_fetcher(summary_name, index),
+                )
+            except Exception as e:
+                if not spec.get("partial_layers"):
+                    raise
+                logger.warning(f"Error fetching {layer['typeName']} for {station_name}: {e}")
+                errors.append(f"{layer['typeName']}: {e}")
+
+        try:
+            await gather_or_cancel(run_layer(index, layer) for index, layer in enumerate(spec["layers"]))
+        except Exception as e:
+            return spec["error"](station_name, e)
+        try:
+            return spec["station"](station_name, agg, errors)
+        except Exception as e:
+            return spec["error"](station_name, e)
+    return worker
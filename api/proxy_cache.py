@@ -0,0 +1,352 @@
+"""
+Tiered response cache for ``proxy_geoserver``.
+
+The query engine sends the same ``DescribeFeatureType`` and ``GetFeature``
+requests over and over. It also sends every parameter twice: once inside
+the encoded ``url`` and once appended to the proxy URL. ``normalize`` folds
+the two into one set of parameters. WFS keys are case-insensitive, so
+``typeName`` and ``TYPENAME`` are one parameter. The folded request is what
+goes upstream and what the cache is keyed on, in a fixed order. The
+``authkey`` is part of the key, so a response is only served to callers
+that presented the same key.
+
+Responses are kept in two tiers:
+
+- a per-process LRU in memory, capped by entry count and total bytes;
+- a shared directory on disk, capped by total bytes. The least recently
+  used files are evicted first.
+
+Only request types listed in ``TTLS`` are cached. Schema responses are kept
+for hours, features for minutes, and ``LAYER_TTLS`` overrides the
+``GetFeature`` TTL per layer. Lookups are counted in
+``dha_cache_requests_total{cache="proxy_memory"|"proxy_disk"}``.
+
+Bodies are stored as GeoServer sent them. A compressed entry is decoded for
+clients that do not accept its encoding.
+
+GeoServer reports some failures (an unknown layer, a bad filter) as an OGC
+exception report with status 200. ``cacheable`` keeps those out of the
+cache: an XML body for a request that asked for JSON, or a body that
+starts with an exception report.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from api import metrics, responses
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "ENABLED": True,
+    # Seconds per WFS request type (lowercase); other request types are not cached
+    "TTLS": {
+        "describefeaturetype": 6 * 60 * 60,
+        "getcapabilities": 6 * 60 * 60,
+        "getfeature": 5 * 60,
+    },
+    # GetFeature TTL per layer (typeName without workspace), e.g. {"dte_land_khasra": 60}
+    "LAYER_TTLS": {},
+    "MEMORY_ENTRIES": 512,
+    "MEMORY_BYTES": 64 * 1024 * 1024,
+    "DISK_DIR": ".cache/proxy",
+    "DISK_BYTES": 1024 * 1024 * 1024,
+    # Larger responses are passed through without being cached
+    "MAX_ENTRY_BYTES": 8 * 1024 * 1024,
+}
+
+# WFS values that are case-insensitive too
+_FOLDED_VALUES = {"service", "request", "version"}
+
+
+def proxy_cache_setting(name):
+    return getattr(settings, "DHA_PROXY_CACHE", {}).get(name, DEFAULTS[name])
+
+
+def enabled():
+    return proxy_cache_setting("ENABLED")
+
+
+# --- Requests -------------------------------------------------------------------
+
+def normalize(url, params):
+    """
+    Fold the query of ``url`` and ``params`` into one request.
+
+    Returns the URL without its query and the parameters, keyed by their first
+    spelling. A later value for the same (case-insensitive) key wins.
+    """
+    parts = urlsplit(url)
+    spelling = {}
+    folded = {}
+    for key, value in parse_qsl(parts.query, keep_blank_values=True) + list(params.items()):
+        name = spelling.setdefault(key.lower(), key)
+        folded[name] = value
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", "")), folded
+
+
+def cache_key(url, params):
+    query = sorted(
+        (k.lower(), v.lower() if k.lower() in _FOLDED_VALUES else v)
+        for k, v in params.items()
+    )
+    return hashlib.sha256(f"{url}?{urlencode(query)}".encode("utf-8")).hexdigest()
+
+
+def ttl(params):
+    """Seconds to cache the response of a request, or None to pass it through."""
+    query = {k.lower(): v for k, v in params.items()}
+    request_type = query.get("request", "").lower()
+    seconds = proxy_cache_setting("TTLS").get(request_type)
+    if request_type == "getfeature":
+        layer = (query.get("typenames") or query.get("typename") or "").split(",")[0].rpartition(":")[2]
+        seconds = proxy_cache_setting("LAYER_TTLS").get(layer, seconds)
+    return seconds or None
+
+
+# --- Entries --------------------------------------------------------------------
+
+def entry(content, content_type, encoding, seconds):
+    return {
+        "content": content,
+        "content_type": content_type,
+        "encoding": encoding,
+        "expires": time.time() + seconds,
+    }
+
+
+# Root elements of WMS/WFS 1.x and OWS exception reports
+_EXCEPTION_REPORTS = (b"<ServiceExceptionReport", b"<ows:ExceptionReport", b"<ExceptionReport")
+
+
+def cacheable_type(params, content_type):
+    """False for an XML response to a request that asked for JSON."""
+    output_format = next((v for k, v in params.items() if k.lower() == "outputformat"), "")
+    return not ("json" in output_format.lower() and "xml" in (content_type or "").lower())
+
+
+def _head(content, encoding, size=1024):
+    """The first decoded bytes of a body."""
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(content, size)
+    if encoding == "deflate":
+        return zlib.decompressobj().decompress(content, size)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(content)[:size]
+    if encoding:
+        raise ValueError(f"Cannot decode {encoding}")
+    return content[:size]
+
+
+def is_exception_report(content, encoding=None):
+    try:
+        head = _head(content, encoding)
+    except Exception as e:
+        # A body that cannot be inspected is not trusted
+        logger.info(f"Cannot inspect a {encoding} proxy response: {e}")
+        return True
+    return any(report in head for report in _EXCEPTION_REPORTS)
+
+
+def cacheable(params, content, content_type, encoding):
+    """Whether a 200 response may be cached (see the module docstring)."""
+    return cacheable_type(params, content_type) and not is_exception_report(content, encoding)
+
+
+def _decode(content, encoding):
+    if encoding == "gzip":
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompress(content)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(content)
+    return None
+
+
+def for_client(request, cached):
+    """``(content, encoding)`` of an entry in a form the client accepts, or None."""
+    encoding = cached["encoding"]
+    if not encoding or responses.accepts(request, encoding):
+        return cached["content"], encoding
+    content = _decode(cached["content"], encoding)
+    return None if content is None else (content, None)
+
+
+# --- Memory tier ------------------------------------------------------------------
+
+_memory = OrderedDict()
+_memory_bytes = 0
+_memory_lock = threading.Lock()
+
+
+def _memory_get(key):
+    with _memory_lock:
+        cached = _memory.get(key)
+        if cached is not None:
+            _memory.move_to_end(key)
+    return cached
+
+
+def _memory_set(key, cached):
+    global _memory_bytes
+    size = len(cached["content"])
+    with _memory_lock:
+        old = _memory.pop(key, None)
+        if old is not None:
+            _memory_bytes -= len(old["content"])
+        _memory[key] = cached
+        _memory_bytes += size
+        while _memory and (len(_memory) > proxy_cache_setting("MEMORY_ENTRIES")
+                           or _memory_bytes > proxy_cache_setting("MEMORY_BYTES")):
+            _, evicted = _memory.popitem(last=False)
+            _memory_bytes -= len(evicted["content"])
+
+
+def _memory_delete(key):
+    global _memory_bytes
+    with _memory_lock:
+        old = _memory.pop(key, None)
+        if old is not None:
+            _memory_bytes -= len(old["content"])
+
+
+# --- Disk tier ----------------------------------------------------------------------
+
+_disk_written = 0
+_disk_lock = threading.Lock()
+# Bytes written between two size checks of the directory
+_SWEEP_EVERY = 32 * 1024 * 1024
+
+
+def _disk_root():
+    return Path(settings.BASE_DIR) / proxy_cache_setting("DISK_DIR")
+
+
+def _disk_path(key):
+    return _disk_root() / key[:2] / key
+
+
+def _disk_get(key):
+    path = _disk_path(key)
+    try:
+        with open(path, "rb") as f:
+            cached = pickle.load(f)
+        # Touching the file marks it as recently used for the sweep
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Dropping unreadable proxy cache file {path}: {e}")
+        path.unlink(missing_ok=True)
+        return None
+    if cached["expires"] <= time.time():
+        path.unlink(missing_ok=True)
+        return None
+    return cached
+
+
+def _disk_set(key, cached):
+    global _disk_written
+    path = _disk_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    with _disk_lock:
+        _disk_written += len(cached["content"])
+        sweep = _disk_written >= _SWEEP_EVERY
+        if sweep:
+            _disk_written = 0
+    if sweep:
+        sweep_disk()
+
+
+def sweep_disk():
+    """Delete expired and least recently used files until the directory is under ``DISK_BYTES``."""
+    files = []
+    total = 0
+    for path in _disk_root().glob("*/*"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    limit = proxy_cache_setting("DISK_BYTES")
+    if total <= limit:
+        return
+    # Down to 90% so the next sweep is not due right away
+    for _, size, path in sorted(files):
+        if total <= limit * 0.9:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+# --- Lookups ------------------------------------------------------------------------
+
+def get(key):
+    """The cached entry of a request from the nearest tier, or None."""
+    cached = _memory_get(key)
+    if cached is not None and cached["expires"] > time.time():
+        metrics.cache_requests.inc(cache="proxy_memory", outcome="hit")
+        return cached
+    if cached is not None:
+        _memory_delete(key)
+    metrics.cache_requests.inc(cache="proxy_memory", outcome="miss")
+
+    try:
+        cached = _disk_get(key)
+    except OSError as e:
+        logger.warning(f"Proxy disk cache read failed: {e}")
+        cached = None
+    metrics.cache_requests.inc(cache="proxy_disk", outcome="hit" if cached else "miss")
+    if cached is not None:
+        _memory_set(key, cached)
+    return cached
+
+
+def put(key, cached):
+    if len(cached["content"]) > proxy_cache_setting("MAX_ENTRY_BYTES"):
+        return
+    _memory_set(key, cached)
+    try:
+        _disk_set(key, cached)
+    except OSError as e:
+        logger.warning(f"Proxy disk cache write failed: {e}")
+
+
+def response(request, cached):
+    """Serve a cached entry, or None if the client cannot take its encoding."""
+    served = for_client(request, cached)
+    if served is None:
+        return None
+    content, encoding = served
+    response = HttpResponse(content, content_type=cached["content_type"])
+    if encoding:
+        response["Content-Encoding"] = encoding
+    response["Vary"] = "Accept-Encoding"
+    response["X-Cache"] = "HIT"
+    return response
@@ -0,0 +1,294 @@
+"""
+Streaming pass-through for ``proxy_geoserver``.
+
+The buffered proxy downloads a whole GeoServer response, decompresses it
+and only then sends it on, so a big ``GetFeature`` sits in worker memory
+before the browser sees a byte. In streaming mode (``DHA_PROXY['STREAM']``)
+the client's ``Accept-Encoding`` is forwarded upstream. The response body
+is then relayed chunk by chunk exactly as GeoServer sent it, still
+compressed. Memory stays at one chunk per request and the first byte
+leaves as soon as GeoServer's does.
+
+Both modes stop a response once it passes ``MAX_RESPONSE_BYTES``.
+When the ``Content-Length`` is over the cap, the request is refused before
+anything is sent. A stream that grows past it is cut off, which the client
+sees as a truncated response. Identical concurrent requests are only
+coalesced in buffered mode, because a stream cannot be shared.
+
+``ProxyCall`` holds the steps shared by the sync view (api/dha_servers.py)
+and the async one (api/async_views.py). ``stream`` relays with
+``requests`` in a worker thread. ``stream_async`` relays with aiohttp on
+the event loop.
+"""
+import asyncio
+import hashlib
+import logging
+from urllib.parse import urlencode
+
+import aiohttp
+import requests
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+
+from api import circuit, metrics, proxy_cache, singleflight, station_fixtures
+from api.responses import json_response
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "STREAM": True,
+    "CHUNK_SIZE": 64 * 1024,
+    # Larger responses are aborted (None: no limit)
+    "MAX_RESPONSE_BYTES": 256 * 1024 * 1024,
+    "TIMEOUT": 20,
+}
+
+# Upstream headers relayed to the client as they are
+PASSED_HEADERS = ("Content-Encoding", "Content-Length", "Content-Disposition", "Last-Modified", "ETag")
+
+
+def proxy_setting(name):
+    return getattr(settings, "DHA_PROXY", {}).get(name, DEFAULTS[name])
+
+
+def streaming():
+    return proxy_setting("STREAM")
+
+
+class ResponseTooLarge(Exception):
+    """An upstream response went over ``MAX_RESPONSE_BYTES``."""
+
+
+def error_response(exc, request=None):
+    """The proxy's answer to a failed upstream call."""
+    if isinstance(exc, circuit.CircuitOpenError):
+        response = json_response(request, {"error": str(exc)}, status=503)
+        response["Retry-After"] = str(int(exc.retry_in) + 1)
+        return response
+    if isinstance(exc, ResponseTooLarge):
+        return json_response(request, {"error": str(exc)}, status=502)
+    return json_response(request, {"error": str(exc)}, status=500)
+
+
+class ProxyCall:
+    """
+    One proxied request: the folded upstream request (see
+    ``proxy_cache.normalize``), its station and its cache policy.
+    """
+
+    def __init__(self, request):
+        url = request.GET.get("url")
+        if not url:
+            raise ValueError("Missing 'url' parameter")
+        # Remove 'url' from params before forwarding; the query engine repeats its params in both
+        params = request.GET.dict()
+        params.pop("url", None)
+        self.request = request
+        self.base_url, self.params = proxy_cache.normalize(url, params)
+        self.station = circuit.station_for_url(self.base_url)
+        self.ttl = proxy_cache.ttl(self.params) if proxy_cache.enabled() else None
+        self.cache_key = proxy_cache.cache_key(self.base_url, self.params) if self.ttl else None
+
+    def early_response(self):
+        """A replayed or cached response, if there is one (reads files)."""
+        if station_fixtures.replaying():
+            recorded = station_fixtures.lookup(self.station, self.base_url, self.params)
+            if recorded is None:
+                return json_response(self.request, {"error": "No recorded response for this request"}, status=404)
+            return HttpResponse(recorded.body[:], content_type=recorded.content_type)
+        if self.ttl:
+            cached = proxy_cache.get(self.cache_key)
+            return cached and proxy_cache.response(self.request, cached)
+        return None
+
+    def keep(self, content, content_type, encoding):
+        """Cache a complete 200 response, unless it is an exception report."""
+        if not self.ttl:
+            return
+        if not proxy_cache.cacheable(self.params, content, content_type, encoding):
+            logger.info(f"Not caching an exception report from {self.station or self.base_url}")
+            return
+        proxy_cache.put(self.cache_key, proxy_cache.entry(content, content_type, encoding, self.ttl))
+
+    def measure(self):
+        return metrics.UpstreamCall(self.station, metrics.layer_of(self.base_url, self.params), "proxy")
+
+    def upstream_headers(self):
+        # Ask for what the client accepts, so the body can be passed on undecoded
+        return {"Accept-Encoding": self.request.headers.get("Accept-Encoding") or "identity"}
+
+    def buffered(self):
+        """Buffered mode: forward the request, sharing the call with identical concurrent ones."""
+        def forward():
+            upstream = fetch(self.station, self.base_url, self.params)
+            if upstream["status"] == 200:
+                if station_fixtures.recording():
+                    station_fixtures.save(self.station, self.base_url, upstream["content"], upstream["content_type"], self.params)
+                self.keep(upstream["content"], upstream["content_type"], None)
+            return upstream
+
+        flight_key = "proxy:" + hashlib.sha1(
+            f"{self.base_url}?{urlencode(sorted(self.params.items()))}".encode("utf-8")
+        ).hexdigest()
+        upstream = singleflight.do(flight_key, forward)
+        return HttpResponse(upstream["content"], status=upstream["status"], content_type=upstream["content_type"])
+
+
+def _check_length(headers):
+    cap = proxy_setting("MAX_RESPONSE_BYTES")
+    length = headers.get("Content-Length", "")
+    if cap and length.isdigit() and int(length) > cap:
+        raise ResponseTooLarge(f"Upstream response of {int(length)} bytes is over the {cap} byte limit")
+
+
+def _count(chunk, measured):
+    cap = proxy_setting("MAX_RESPONSE_BYTES")
+    measured.bytes += len(chunk)
+    if cap and measured.bytes > cap:
+        raise ResponseTooLarge(f"Upstream response passed the {cap} byte limit")
+
+
+def _capped(chunks, measured):
+    for chunk in chunks:
+        _count(chunk, measured)
+        yield chunk
+
+
+class _Keeper:
+    """Collects a relayed 200 body for the cache while it fits ``MAX_ENTRY_BYTES``."""
+
+    def __init__(self, call, status, headers):
+        self.call = call
+        self.headers = headers
+        content_type = headers.get("Content-Type", "application/json")
+        cacheable = call.ttl and status == 200 and proxy_cache.cacheable_type(call.params, content_type)
+        self.chunks = [] if cacheable else None
+        self.size = 0
+
+    def add(self, chunk):
+        if self.chunks is None:
+            return
+        self.size += len(chunk)
+        if self.size <= proxy_cache.proxy_cache_setting("MAX_ENTRY_BYTES"):
+            self.chunks.append(chunk)
+        else:
+            self.chunks = None
+
+    def finish(self):
+        if self.chunks is not None:
+            self.call.keep(b"".join(self.chunks), self.headers.get("Content-Type", "application/json"),
+                           self.headers.get("Content-Encoding"))
+
+
+def _relay(body, status, headers):
+    response = StreamingHttpResponse(body, status=status, content_type=headers.get("Content-Type", "application/json"))
+    for header in PASSED_HEADERS:
+        if header in headers:
+            response[header] = headers[header]
+    response["Vary"] = "Accept-Encoding"
+    return response
+
+
+def _log_abort(call, measured, exc):
+    # A client that goes away closes the body generator (or cancels it, on the event loop)
+    if not isinstance(exc, (GeneratorExit, asyncio.CancelledError)):
+        logger.warning(f"Proxy stream from {call.station or call.base_url} aborted after {measured.bytes} bytes: {exc}")
+
+
+def _open(station, base_url, params, measured, headers=None):
+    """Send the upstream request under the station's breaker; the body is not read yet."""
+    with circuit.guard(station) as call:
+        upstream = requests.get(base_url, params=params, timeout=proxy_setting("TIMEOUT"), stream=True, headers=headers)
+        measured.first_byte(upstream.elapsed.total_seconds())
+        if upstream.status_code >= 500:
+            call.fail()
+    return upstream
+
+
+def fetch(station, base_url, params):
+    """
+    Buffered mode: the decoded body, status and content type of an upstream
+    call, read up to the size cap.
+    """
+    with metrics.upstream_call(station, base_url, "proxy", params) as measured:
+        upstream = _open(station, base_url, params, measured)
+        with upstream:
+            _check_length(upstream.headers)
+            content = b"".join(_capped(upstream.iter_content(proxy_setting("CHUNK_SIZE")), measured))
+    return {
+        "content": content,
+        "status": upstream.status_code,
+        "content_type": upstream.headers.get("Content-Type", "application/json"),
+    }
+
+
+def stream(call):
+    """Streaming mode: relay the upstream response to the client as it arrives."""
+    measured = call.measure()
+    upstream = None
+    try:
+        upstream = _open(call.station, call.base_url, call.params, measured, headers=call.upstream_headers())
+        _check_length(upstream.headers)
+    except BaseException as e:
+        if upstream is not None:
+            upstream.close()
+        measured.finish(e)
+        raise
+    keeper = _Keeper(call, upstream.status_code, upstream.headers)
+
+    def body():
+        error = None
+        try:
+            for chunk in _capped(upstream.raw.stream(proxy_setting("CHUNK_SIZE"), decode_content=False), measured):
+                keeper.add(chunk)
+                yield chunk
+            keeper.finish()
+        except BaseException as e:
+            error = e
+            _log_abort(call, measured, e)
+            raise
+        finally:
+            upstream.close()
+            measured.finish(error)
+
+    return _relay(body(), upstream.status_code, upstream.headers)
+
+
+async def stream_async(call, session):
+    """``stream`` on the event loop, with a shared aiohttp ``session`` that does not decompress."""
+    measured = call.measure()
+    timeout = aiohttp.ClientTimeout(sock_connect=proxy_setting("TIMEOUT"), sock_read=proxy_setting("TIMEOUT"))
+    upstream = None
+    try:
+        with circuit.guard(call.station) as guarded:
+            upstream = await session.get(call.base_url, params=call.params, headers=call.upstream_headers(), timeout=timeout)
+            measured.first_byte()
+            if upstream.status >= 500:
+                guarded.fail()
+        _check_length(upstream.headers)
+    except BaseException as e:
+        if upstream is not None:
+            upstream.release()
+        measured.finish(e)
+        raise
+    keeper = _Keeper(call, upstream.status, upstream.headers)
+
+    async def body():
+        error = None
+        try:
+            async for chunk in upstream.content.iter_chunked(proxy_setting("CHUNK_SIZE")):
+                _count(chunk, measured)
+                keeper.add(chunk)
+                yield chunk
+            # Cache writes touch the disk
+            await asyncio.to_thread(keeper.finish)
+        except BaseException as e:
+            error = e
+            _log_abort(call, measured, e)
+            raise
+        finally:
+            upstream.release()
+            measured.finish(error)
+
+    return _relay(body(), upstream.status, upstream.headers)
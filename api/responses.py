@@ -0,0 +1,196 @@
+"""
+Compact, conditional and compressed JSON responses for the api app.
+
+``encode`` serializes a payload once into compact JSON and derives a strong
+ETag from the bytes. ``respond`` answers ``If-None-Match`` with a 304 and
+otherwise sends the body brotli- or gzip-compressed, whichever the client
+ranks higher by q-value (brotli on a tie, and only when the ``brotli``
+package is installed). Compressed
+variants are produced on first use and kept on the ``Encoded`` object, so a
+payload that is encoded once and served many times is only serialized and
+compressed once per process.
+
+``materialized`` does exactly that for the materialized summaries: the
+encoded copy is reused until the summary is refreshed.
+"""
+import gzip
+import hashlib
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+
+from api import json_codec
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+DEFAULTS = {
+    "COMPRESS": True,
+    # Bodies smaller than this are sent uncompressed
+    "MIN_COMPRESS_SIZE": 1024,
+    "GZIP_LEVEL": 6,
+    "BROTLI_QUALITY": 5,
+}
+
+
+def response_setting(name):
+    return getattr(settings, "DHA_RESPONSES", {}).get(name, DEFAULTS[name])
+
+
+def _gzip(body):
+    return gzip.compress(body, compresslevel=response_setting("GZIP_LEVEL"), mtime=0)
+
+
+def _brotli(body):
+    return brotli.compress(body, quality=response_setting("BROTLI_QUALITY"))
+
+
+# Preferred first
+COMPRESSORS = {"gzip": _gzip}
+if brotli is not None:
+    COMPRESSORS = {"br": _brotli, **COMPRESSORS}
+
+
+class Encoded:
+    """One serialized payload with its ETag and lazily compressed variants."""
+
+    def __init__(self, body):
+        self.body = body
+        self.tag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def etag(self, encoding=None):
+        # Each representation gets its own strong validator
+        return f'"{self.tag}-{encoding}"' if encoding else f'"{self.tag}"'
+
+    def variant(self, encoding):
+        found = self._variants.get(encoding)
+        if found is None:
+            with self._lock:
+                found = self._variants.get(encoding)
+                if found is None:
+                    found = self._variants[encoding] = COMPRESSORS[encoding](self.body)
+        return found
+
+    def matches(self, if_none_match):
+        """Whether an ``If-None-Match`` header names any representation of this body."""
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate == "*":
+                return True
+            candidate = candidate.removeprefix("W/").strip('"')
+            if candidate == self.tag or candidate.startswith(f"{self.tag}-"):
+                return True
+        return False
+
+
+def encode(payload):
+    return Encoded(json_codec.dumps(payload))
+
+
+def _accepted(request):
+    """``{encoding: q}`` of the client's ``Accept-Encoding``."""
+    accepted = {}
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = q
+    return accepted
+
+
+def _quality(accepted, encoding):
+    return accepted.get(encoding, accepted.get("*", 0))
+
+
+def accepts(request, encoding):
+    """Whether the client's ``Accept-Encoding`` allows ``encoding``."""
+    return _quality(_accepted(request), encoding) > 0
+
+
+def accepted_encoding(request):
+    """
+    The compression the client ranks highest (ties go to the order of
+    ``COMPRESSORS``), or None if it accepts none or ranks ``identity`` above them.
+    """
+    accepted = _accepted(request)
+    best = max(COMPRESSORS, key=lambda encoding: _quality(accepted, encoding))
+    q = _quality(accepted, best)
+    if q <= 0 or accepted.get("identity", 0) > q:
+        return None
+    return best
+
+
+def respond(request, encoded, status=200):
+    """Serve an ``Encoded`` payload, honouring ``If-None-Match`` and ``Accept-Encoding``."""
+    encoding = None
+    if (
+        request is not None
+        and response_setting("COMPRESS")
+        and len(encoded.body) >= response_setting("MIN_COMPRESS_SIZE")
+    ):
+        encoding = accepted_encoding(request)
+
+    if_none_match = request.headers.get("If-None-Match") if request is not None else None
+    if status == 200 and if_none_match and encoded.matches(if_none_match):
+        # The same validator and Vary the 200 would have carried
+        response = HttpResponseNotModified()
+        response["ETag"] = encoded.etag(encoding)
+        response["Cache-Control"] = "no-cache"
+        response["Vary"] = "Accept-Encoding"
+        return response
+
+    response = HttpResponse(
+        encoded.variant(encoding) if encoding else encoded.body,
+        status=status,
+        content_type="application/json",
+    )
+    if encoding:
+        response["Content-Encoding"] = encoding
+    if status == 200:
+        response["ETag"] = encoded.etag(encoding)
+        # Cached by the browser, but revalidated (cheaply, with a 304) on every use
+        response["Cache-Control"] = "no-cache"
+    response["Vary"] = "Accept-Encoding"
+    return response
+
+
+def json_response(request, payload, status=200):
+    return respond(request, encode(payload), status=status)
+
+
+class JsonResponse(HttpResponse):
+    """``django.http.JsonResponse`` serialized with ``json_codec``."""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=json_codec.dumps(data), **kwargs)
+
+
+# name -> (version, Encoded)
+_materialized = {}
+_materialized_lock = threading.Lock()
+
+
+def materialized(request, name, entry):
+    """Serve a materialized summary entry, reusing its encoding until it is refreshed."""
+    version = entry["refreshed_at"]
+    found = _materialized.get(name)
+    if found is None or found[0] != version:
+        found = (version, encode(entry["payload"]))
+        with _materialized_lock:
+            _materialized[name] = found
+    return respond(request, found[1])
@@ -0,0 +1,229 @@
+"""
+Field schemas of the query engine layers, for every station.
+
+Selecting a layer in the query engine used to take two round trips: a
+proxied ``DescribeFeatureType`` to the first connected station, then a POST
+of its fields to ``filter_layer_fields``. The catalog asks every station for
+the schema of every layer in ``query_engine_layers['flat']`` ahead of time
+and keeps only the fields in ``allowed_fields``. The page then loads the
+fields of all layers in one request to ``/api/config/layer-fields``.
+
+The catalog is materialized like the summaries (see api/materialize.py)
+under ``schema_catalog``, so it is refreshed in the background by
+``manage.py refresh_summaries --loop`` or the in-process scheduler. It is
+refreshed every 6 hours unless ``DHA_MATERIALIZE['INTERVALS']`` says
+otherwise. A station that cannot be reached keeps the schemas from the
+last refresh. While a station has never been described the catalog is
+partial and is rebuilt every ``PARTIAL_RETRY`` seconds, but those rebuilds
+only ask the stations that failed; the others are described again once
+their schemas are older than the catalog's interval.
+
+``?servers=`` merges the layers of the given stations, first spelling
+first; ``?layers=`` limits the answer to some layers.
+"""
+import asyncio
+import logging
+import time
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+
+from api import circuit, materialize, responses
+from api.config_api import allowed_field_names
+from api.fanout import fan_out, get_json
+from api.geo_server_config import GEOSERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "WORKSPACE": "dha_coregis",
+    # Seconds per DescribeFeatureType request (None: the fan-out default)
+    "TIMEOUT": None,
+}
+
+NAME = "schema_catalog"
+
+DHA_CONFIGS = GEOSERVER_CONFIG['dha_servers']
+
+_NUMERIC = ("int", "long", "short", "double", "float", "decimal")
+_DATE = ("date", "time")
+
+
+def catalog_setting(name):
+    return getattr(settings, "DHA_SCHEMA_CATALOG", {}).get(name, DEFAULTS[name])
+
+
+def catalog_layers():
+    return GEOSERVER_CONFIG.get("query_engine_layers", {}).get("flat", [])
+
+
+def field_type(xsd):
+    """
+    The query engine's type for an XSD type: numeric, date or text. Keep in
+    step with ``processFieldData`` in graph_controller.js, which maps the
+    fallback ``DescribeFeatureType`` path.
+    """
+    xsd = (xsd or "").lower()
+    if any(t in xsd for t in _NUMERIC):
+        return "numeric"
+    if any(t in xsd for t in _DATE):
+        return "date"
+    return "text"
+
+
+def allowed_fields(description):
+    """The allowed ``{"name", "type"}`` fields of a ``DescribeFeatureType`` JSON body."""
+    allowed = allowed_field_names()
+    feature_types = (description or {}).get("featureTypes") or [{}]
+    return [
+        {"name": prop["name"], "type": field_type(prop.get("type"))}
+        for prop in feature_types[0].get("properties", [])
+        if prop.get("name", "").lower() in allowed
+    ]
+
+
+def describe_url(cfg, layer):
+    workspace = catalog_setting("WORKSPACE")
+    params = {
+        "service": "WFS",
+        "version": "2.0.0",
+        "request": "DescribeFeatureType",
+        "typeName": f"{workspace}:{layer}",
+        "outputFormat": "application/json",
+        "authkey": cfg["auth_key"],
+    }
+    return f"http://{cfg['dhaip']}/geoserver/{workspace}/ows?" + urlencode(params, quote_via=quote)
+
+
+# --- Building -----------------------------------------------------------------------
+
+async def _describe(station_name, cfg, layer):
+    try:
+        return allowed_fields(await get_json(station_name, describe_url(cfg, layer), timeout=catalog_setting("TIMEOUT")))
+    except circuit.CircuitOpenError:
+        raise
+    except Exception as e:
+        if circuit.is_station_failure(e):
+            raise
+        # Not every station publishes every layer
+        logger.info(f"{station_name}: no schema for {layer}: {e}")
+        return None
+
+
+async def _station(station_name, cfg):
+    tasks = [asyncio.ensure_future(_describe(station_name, cfg, layer)) for layer in catalog_layers()]
+    try:
+        described = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    layers = {layer: fields for layer, fields in zip(catalog_layers(), described) if fields is not None}
+    return station_name, layers, None
+
+
+def build(deadline=None):
+    """Describe every catalog layer on the stations that are due; failed stations keep their last schemas."""
+    previous = materialize.stored(NAME)
+    previous = previous["payload"] if previous else {}
+    known = previous.get("stations", {})
+    described_at = dict(previous.get("described_at", {}))
+    now = time.time()
+    interval = materialize.SUMMARIES[NAME]["interval"]
+
+    due = {name: cfg for name, cfg in DHA_CONFIGS.items() if now - described_at.get(name, 0) >= interval}
+    stations = {name: known[name] for name in DHA_CONFIGS if name in known and name not in due}
+    errors = {}
+    results = fan_out(due, _station, lambda name, e: (name, None, e), deadline=deadline) if due else []
+    for station_name, layers, error in results:
+        if error is None:
+            stations[station_name] = layers
+            described_at[station_name] = now
+            continue
+        errors[station_name] = str(error)
+        if station_name in known:
+            stations[station_name] = known[station_name]
+    return {
+        "stations": stations,
+        "errors": errors,
+        "described_at": described_at,
+        # Stations never described yet are retried soon
+        "partial": any(name not in stations for name in DHA_CONFIGS),
+    }
+
+
+materialize.summary(NAME, interval=6 * 60 * 60)(build)
+
+
+# --- Serving ------------------------------------------------------------------------
+
+def merge(catalog, servers, layers):
+    """``{layer: fields}`` over the given stations; a field named twice keeps its first spelling."""
+    merged = {}
+    for layer in layers:
+        fields = {}
+        for station_name in servers:
+            for field in catalog["stations"].get(station_name, {}).get(layer, ()):
+                fields.setdefault(field["name"].lower(), field)
+        if fields:
+            merged[layer] = list(fields.values())
+    return merged
+
+
+# (servers, layers) -> (refreshed_at, Encoded)
+_encodings = {}
+_MAX_ENCODINGS = 64
+
+
+def _encoded(entry, servers, layers):
+    """The encoded answer for a selection, reused until the catalog is refreshed."""
+    found = _encodings.get((servers, layers))
+    if found is None or found[0] != entry["refreshed_at"]:
+        catalog = entry["payload"]
+        found = (entry["refreshed_at"], responses.encode({
+            "layers": merge(catalog, servers, layers),
+            "missing": [s for s in servers if s not in catalog["stations"]],
+            "refreshed_at": entry["refreshed_at"],
+        }))
+        if len(_encodings) >= _MAX_ENCODINGS:
+            _encodings.clear()
+        _encodings[(servers, layers)] = found
+    return found[1]
+
+
+def _selection(request):
+    """``(servers, layers, budget)`` of a request, or the error response for it."""
+    def listed(name):
+        return tuple(dict.fromkeys(v.strip().lower() for v in request.GET.get(name, "").split(",") if v.strip()))
+
+    servers = listed("servers") or tuple(DHA_CONFIGS)
+    layers = tuple(v for v in listed("layers") if v in catalog_layers()) or tuple(catalog_layers())
+    unknown = [s for s in servers if s not in DHA_CONFIGS]
+    if unknown:
+        return responses.JsonResponse({"error": f"Unknown server '{unknown[0]}'"}, status=400)
+
+    try:
+        budget = materialize.latency_budget(request.GET.get("budget"))
+    except ValueError:
+        return responses.JsonResponse({"error": "'budget' must be a number of seconds"}, status=400)
+    return servers, layers, budget
+
+
+def response(request):
+    selection = _selection(request)
+    if isinstance(selection, responses.JsonResponse):
+        return selection
+    servers, layers, budget = selection
+    entry = materialize.get(NAME, budget=budget)
+    return responses.respond(request, _encoded(entry, servers, layers))
+
+
+async def aresponse(request):
+    """``response`` for the async views."""
+    selection = _selection(request)
+    if isinstance(selection, responses.JsonResponse):
+        return selection
+    servers, layers, budget = selection
+    entry = await materialize.aget(NAME, budget=budget)
+    return responses.respond(request, _encoded(entry, servers, layers))
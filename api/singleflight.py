@@ -0,0 +1,168 @@
+"""
+Single-flight coalescing of identical upstream work.
+
+``do(key, fn)`` makes sure only one call of ``fn`` per key is in flight:
+
+* within a process, concurrent callers wait on the leader thread's result
+  (with ``ado`` in the async views, on the leader task's result);
+* across worker processes, the leader holds a lock in the shared cache and
+  publishes its result there for the other processes to pick up.
+
+Cross-process coalescing relies on ``cache.add`` being atomic, which holds
+for the Redis, Memcached and database backends. The file-based default is
+close enough to collapse a stampede to a handful of calls.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "CACHE": "default",
+    # Upper bound on one leader's call; its lock expires after this long
+    "LOCK_TTL": 60,
+    # How long a published result stays available to waiting processes
+    "RESULT_TTL": 10,
+    "POLL_INTERVAL": 0.05,
+}
+
+
+def singleflight_setting(name):
+    return getattr(settings, "DHA_SINGLEFLIGHT", {}).get(name, DEFAULTS[name])
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+# (event loop, key) -> leader task
+_tasks = {}
+
+
+def _cache():
+    return caches[singleflight_setting("CACHE")]
+
+
+def do(key, fn):
+    """Run ``fn()`` once per key across threads and processes and share its result."""
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = _do_shared(key, fn)
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.done.set()
+
+
+def _do_shared(key, fn):
+    cache = _cache()
+    lock_key = f"dha:flight:{key}:lock"
+    result_key = f"dha:flight:{key}:result"
+    lock_ttl = singleflight_setting("LOCK_TTL")
+    poll = singleflight_setting("POLL_INTERVAL")
+    deadline = time.monotonic() + lock_ttl
+
+    while True:
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, timeout=lock_ttl):
+            try:
+                result = fn()
+                cache.set(result_key, {"token": token, "value": result}, timeout=singleflight_setting("RESULT_TTL"))
+                return result
+            finally:
+                cache.delete(lock_key)
+
+        # Another process is the leader: wait for it to release the lock,
+        # then pick up the result it published just before releasing
+        leader_token = cache.get(lock_key)
+        while leader_token is not None and time.monotonic() < deadline:
+            time.sleep(poll)
+            if cache.get(lock_key) != leader_token:
+                break
+
+        published = cache.get(result_key)
+        if published is not None and leader_token in (None, published["token"]):
+            logger.debug(f"Shared result of in-flight {key}")
+            return published["value"]
+
+        if time.monotonic() >= deadline:
+            logger.warning(f"Gave up waiting on in-flight {key}, calling upstream directly")
+            return fn()
+        # The leader failed without publishing: try to take over
+
+
+async def ado(key, fn):
+    """
+    ``do`` for coroutines: ``await fn()`` once per key. Callers on the same
+    event loop await the leader task, so a caller that goes away (a client
+    disconnect) does not cancel the call for the others.
+    """
+    flight = (asyncio.get_running_loop(), key)
+    task = _tasks.get(flight)
+    if task is None:
+        task = _tasks[flight] = asyncio.ensure_future(_ado_shared(key, fn))
+        task.add_done_callback(lambda _: _tasks.pop(flight, None))
+    return await asyncio.shield(task)
+
+
+async def _ado_shared(key, fn):
+    """``_do_shared`` waiting on the event loop."""
+    cache = _cache()
+    lock_key = f"dha:flight:{key}:lock"
+    result_key = f"dha:flight:{key}:result"
+    lock_ttl = singleflight_setting("LOCK_TTL")
+    poll = singleflight_setting("POLL_INTERVAL")
+    deadline = time.monotonic() + lock_ttl
+
+    while True:
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, timeout=lock_ttl):
+            try:
+                result = await fn()
+                cache.set(result_key, {"token": token, "value": result}, timeout=singleflight_setting("RESULT_TTL"))
+                return result
+            finally:
+                cache.delete(lock_key)
+
+        leader_token = cache.get(lock_key)
+        while leader_token is not None and time.monotonic() < deadline:
+            await asyncio.sleep(poll)
+            if cache.get(lock_key) != leader_token:
+                break
+
+        published = cache.get(result_key)
+        if published is not None and leader_token in (None, published["token"]):
+            logger.debug(f"Shared result of in-flight {key}")
+            return published["value"]
+
+        if time.monotonic() >= deadline:
+            logger.warning(f"Gave up waiting on in-flight {key}, calling upstream directly")
+            return await fn()
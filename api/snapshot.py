@@ -0,0 +1,278 @@
+"""
+Local snapshot store for the summary layers.
+
+``sync`` fans a spec out to the stations like the live engine does, but
+instead of aggregating in Python it stores every feature's normalized
+dimensions and coerced metrics in ``SnapshotValue`` rows. A station (or a
+layer of one) that fails keeps the rows of its last good sync. ``summarize``
+then computes every group of the spec with SQL ``GROUP BY``/``SUM`` queries
+and shapes the result with the spec's own station/consolidate functions, so
+the payload is the one the live engine builds.
+
+Enabled with ``DHA_SNAPSHOT['ENABLED']``; the materialized summaries are
+then built by ``build`` (sync, then summarize).
+"""
+import asyncio
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from api.fanout import fan_out
+from api.models import SnapshotStation, SnapshotValue
+from api.summary_engine import DHA_CONFIGS, SKIP, aggregate_layer, compile_dimension, compile_metric
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "ENABLED": False,
+    "BATCH_SIZE": 5000,
+}
+
+DIMENSION_COLUMNS = ["dimension_1", "dimension_2", "dimension_3"]
+
+
+def snapshot_setting(name):
+    return getattr(settings, "DHA_SNAPSHOT", {}).get(name, DEFAULTS[name])
+
+
+def enabled():
+    return snapshot_setting("ENABLED")
+
+
+def dimension_columns(spec):
+    """Map each spec dimension to the ``SnapshotValue`` column holding it."""
+    if len(spec["dimensions"]) > len(DIMENSION_COLUMNS):
+        raise ValueError(f"Snapshots support at most {len(DIMENSION_COLUMNS)} dimensions")
+    return dict(zip(spec["dimensions"], DIMENSION_COLUMNS))
+
+
+# --- Syncing ----------------------------------------------------------------
+
+class SnapshotCollector:
+    """Turns features into ``(feature_id, dimensions, metric, value, is_float)`` rows."""
+
+    def __init__(self, spec):
+        self.dimensions = [compile_dimension(dim) for dim in spec["dimensions"].values()]
+        self.metrics = {name: compile_metric(m) for name, m in spec["metrics"].items()}
+
+    def consumer(self, layer, rows):
+        metric_names = layer.get("metrics") or list(self.metrics)
+        anonymous = 0
+
+        def consume(feature):
+            nonlocal anonymous
+            props = feature.get("properties") or {}
+            dims = []
+            for value in self.dimensions:
+                val = value(props)
+                if val is SKIP:
+                    return
+                dims.append(val)
+            feature_id = feature.get("id")
+            if feature_id is None:
+                anonymous += 1
+                feature_id = f"#{anonymous}"
+            for name in metric_names:
+                val = self.metrics[name](props)
+                if not isinstance(val, (int, float)):
+                    # Same failure the aggregators hit when summing it
+                    raise TypeError(f"{name} is not numeric: {val!r}")
+                rows.append((str(feature_id), dims, name, float(val), isinstance(val, float)))
+        return consume
+
+
+def station_worker(spec):
+    """Fetch every layer of a station into rows; returns ``(station, {layer: rows}, {layer: error})``."""
+    collector = SnapshotCollector(spec)
+
+    async def worker(station_name, cfg):
+        layers = {}
+        errors = {}
+
+        async def run_layer(layer):
+            rows = []
+            try:
+                await aggregate_layer(spec, collector.consumer(layer, rows), station_name, cfg, layer)
+            except Exception as e:
+                logger.warning(f"Snapshot of {layer['typeName']} for {station_name} failed: {e}")
+                errors[layer["typeName"]] = e
+            else:
+                layers[layer["typeName"]] = rows
+
+        await asyncio.gather(*(run_layer(layer) for layer in spec["layers"]))
+        return station_name, layers, errors
+    return worker
+
+
+@contextmanager
+def _fresh_connection():
+    """
+    ORM work from the scheduler and executor threads, outside Django's request
+    cycle: drop connections that went stale (or are past ``CONN_MAX_AGE``)
+    before and after, as Django does around each request.
+    """
+    # Inside a caller's transaction (or a TestCase) the connection is in use
+    managed = not connection.in_atomic_block
+    if managed:
+        close_old_connections()
+    try:
+        yield
+    finally:
+        if managed:
+            close_old_connections()
+
+
+def sync(name, spec, stations=None, deadline=None):
+    """Refresh the snapshot of every station; returns ``{station: error or None}``."""
+    stations = stations or DHA_CONFIGS
+    jobs = {station.title(): cfg for station, cfg in stations.items()}
+    columns = dimension_columns(spec)
+
+    def on_error(station_name, e):
+        return station_name, {}, {"*": e}
+
+    status = {}
+    # Rows are written here, on the calling thread, rather than from the fan-out loop
+    for station_name, layers, errors in fan_out(jobs, station_worker(spec), on_error, deadline=deadline):
+        with _fresh_connection():
+            store(name, station_name, layers, errors, columns)
+        status[station_name] = "; ".join(f"{layer}: {e}" for layer, e in errors.items()) or None
+    return status
+
+
+def store(name, station_name, layers, errors, columns):
+    """
+    Bring the rows of every layer that synced up to date; failed layers keep
+    their old rows. Rows stored as they are now are left alone, so a sync
+    only writes the features that changed.
+    """
+    now = timezone.now()
+    dimension_fields = list(columns.values())
+    written = removed = 0
+
+    with transaction.atomic():
+        for layer, rows in layers.items():
+            added, dropped = store_layer(name, station_name, layer, rows, dimension_fields)
+            written += added
+            removed += dropped
+
+        feature_count = (
+            SnapshotValue.objects.filter(summary=name, station=station_name)
+            .values("layer", "feature_id").distinct().count()
+        )
+        defaults = {
+            "attempted_at": now,
+            "error": "; ".join(f"{layer}: {e}" for layer, e in errors.items()),
+            "feature_count": feature_count,
+        }
+        if layers:
+            defaults["synced_at"] = now
+        SnapshotStation.objects.update_or_create(summary=name, station=station_name, defaults=defaults)
+
+    logger.info(f"Snapshot {name}/{station_name}: {written} rows written, {removed} removed in {len(layers)} layer(s)")
+
+
+def store_layer(name, station_name, layer, rows, dimension_fields):
+    """Insert the rows not stored yet and delete the stored rows that are gone; returns both counts."""
+    batch_size = snapshot_setting("BATCH_SIZE")
+    stored = SnapshotValue.objects.filter(summary=name, station=station_name, layer=layer)
+
+    # row -> ids of its stored copies (a station may send a feature twice)
+    existing = {}
+    for pk, feature_id, metric, value, is_float, *dims in stored.values_list(
+        "id", "feature_id", "metric", "value", "is_float", *dimension_fields
+    ).iterator(chunk_size=batch_size):
+        existing.setdefault((feature_id, tuple(dims), metric, value, is_float), []).append(pk)
+
+    new = []
+    for feature_id, dims, metric, value, is_float in rows:
+        ids = existing.get((feature_id, tuple(dims), metric, value, is_float))
+        if ids:
+            ids.pop()
+        else:
+            new.append(SnapshotValue(
+                summary=name, station=station_name, layer=layer, feature_id=feature_id,
+                metric=metric, value=value, is_float=is_float,
+                **dict(zip(dimension_fields, dims)),
+            ))
+
+    gone = [pk for ids in existing.values() for pk in ids]
+    step = min(batch_size, connection.ops.bulk_batch_size(["id"], gone) or batch_size)
+    for start in range(0, len(gone), step):
+        SnapshotValue.objects.filter(id__in=gone[start:start + step]).delete()
+    SnapshotValue.objects.bulk_create(new, batch_size=batch_size)
+    return len(new), len(gone)
+
+
+# --- Summarizing --------------------------------------------------------------
+
+class SnapshotAggregate:
+    """Grouped sums read back from the snapshot, shaped like ``summary_engine.Aggregator``."""
+
+    def __init__(self, spec, feature_count):
+        self.initial = {name: m.get("initial", 0) for name, m in spec["metrics"].items()}
+        self.groups = {name: {} for name in spec["groups"]}
+        self.feature_count = feature_count
+
+    def zero(self):
+        return dict(self.initial)
+
+
+def summarize(name, spec, stations=None):
+    """Build the summary payload from the snapshot with one SQL aggregate per group."""
+    station_names = [station.title() for station in stations or DHA_CONFIGS]
+    columns = dimension_columns(spec)
+    synced = {
+        s.station: s
+        for s in SnapshotStation.objects.filter(summary=name, station__in=station_names)
+    }
+    aggs = {
+        station: SnapshotAggregate(spec, s.feature_count)
+        for station, s in synced.items() if s.synced_at
+    }
+
+    values = SnapshotValue.objects.filter(summary=name, station__in=list(aggs))
+    for group, dim_names in spec["groups"].items():
+        group_columns = [columns[d] for d in dim_names]
+        rows = (
+            values.values("station", *group_columns, "metric")
+            .annotate(total=Sum("value"), floats=Count("id", filter=Q(is_float=True)))
+            .order_by("station", *group_columns, "metric")
+        )
+        for row in rows:
+            agg = aggs[row["station"]]
+            key = tuple(row[c] for c in group_columns)
+            bucket = agg.groups[group].get(key)
+            if bucket is None:
+                bucket = agg.groups[group][key] = agg.zero()
+            initial = agg.initial[row["metric"]]
+            if row["floats"] or isinstance(initial, float):
+                bucket[row["metric"]] = initial + row["total"]
+            else:
+                bucket[row["metric"]] = initial + int(round(row["total"]))
+
+    results = []
+    for station_name in station_names:
+        if station_name not in aggs:
+            last_error = synced[station_name].error if station_name in synced else "never synced"
+            results.append(spec["error"](station_name, ValueError(f"No snapshot yet ({last_error})")))
+            continue
+        try:
+            results.append(spec["station"](station_name, aggs[station_name], []))
+        except Exception as e:
+            results.append(spec["error"](station_name, e))
+    return spec["consolidate"](results)
+
+
+def build(name, spec, stations=None, deadline=None):
+    """Materialization builder: sync the snapshot, then summarize it."""
+    logger.info(f"[{datetime.now()}] {name} snapshot sync started")
+    sync(name, spec, stations, deadline=deadline)
+    with _fresh_connection():
+        return summarize(name, spec, stations)
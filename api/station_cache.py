@@ -0,0 +1,147 @@
+"""
+Per-station result cache for the summary fetchers.
+
+Every station's result is cached under its own key, so a partial refresh
+only goes upstream for the stations whose entries have expired. Healthy
+results are kept for ``HEALTHY_TTL`` seconds, failures only for
+``FAILURE_TTL`` so a flaky station is retried soon without spoiling the
+healthy entries of the others.
+
+The last healthy result of every station is also kept without expiry. When
+a station misses the fan-out deadline it is filled in from that copy and
+marked ``stale`` (or marked ``pending`` if it has never succeeded), while
+its fetch finishes in the background and lands in the cache for the next
+refresh.
+"""
+import time
+from datetime import datetime
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+from api import metrics
+from api.fanout import DeadlineExceeded, iter_fan_out
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    "CACHE": "default",
+    "HEALTHY_TTL": 60 * 10,
+    "FAILURE_TTL": 60,
+    # Per-summary overrides of HEALTHY_TTL, e.g. {"security_summary": 300}
+    "HEALTHY_TTLS": {},
+}
+
+
+def station_cache_setting(name):
+    return getattr(settings, "DHA_STATION_CACHE", {}).get(name, DEFAULTS[name])
+
+
+def _cache():
+    return caches[station_cache_setting("CACHE")]
+
+
+def _key(summary, station_name):
+    return f"dha:station:{summary}:{station_name}"
+
+
+def _good_key(summary, station_name):
+    return f"dha:station-good:{summary}:{station_name}"
+
+
+def is_failure(result):
+    """Station results mark failures with an ``error`` key, ``success: False`` or ``None``."""
+    if result is None:
+        return True
+    return "error" in result or result.get("success") is False
+
+
+def ttl_for(summary, result):
+    if is_failure(result):
+        return station_cache_setting("FAILURE_TTL")
+    return station_cache_setting("HEALTHY_TTLS").get(summary, station_cache_setting("HEALTHY_TTL"))
+
+
+def store(summary, station_name, result):
+    # Wrapped so that a cached ``None`` result can be told apart from a miss
+    _cache().set(_key(summary, station_name), {"result": result}, timeout=ttl_for(summary, result))
+    if not is_failure(result):
+        _cache().set(_good_key(summary, station_name), {"result": result, "stored_at": time.time()}, timeout=None)
+
+
+def last_good(summary, station_name):
+    """The station's last healthy result marked as stale, or None."""
+    entry = _cache().get(_good_key(summary, station_name))
+    if entry is None:
+        return None
+    return dict(entry["result"], stale=True, as_of=datetime.fromtimestamp(entry["stored_at"]).isoformat())
+
+
+def lookup(summary, station_names):
+    """Return ``{station_name: result}`` for the stations that have a cached entry."""
+    keys = {_key(summary, name): name for name in station_names}
+    found = _cache().get_many(list(keys))
+    metrics.cache_requests.inc(len(found), cache="station", outcome="hit")
+    metrics.cache_requests.inc(len(keys) - len(found), cache="station", outcome="miss")
+    return {keys[key]: entry["result"] for key, entry in found.items()}
+
+
+def invalidate(summary, station_names):
+    _cache().delete_many([_key(summary, name) for name in station_names])
+
+
+def fan_out_cached(summary, jobs, worker, on_error, deadline=None):
+    """
+    Drop-in replacement for ``fan_out`` that serves stations from the cache.
+
+    Only stations without a live cache entry are fetched; their results
+    (including failures) are cached before everything is returned. Stations
+    that miss the deadline are filled from ``last_good`` and cached once
+    they finish.
+    """
+    return list(iter_fan_out_cached(summary, jobs, worker, on_error, deadline=deadline))
+
+
+def iter_fan_out_cached(summary, jobs, worker, on_error, deadline=None, late=None):
+    """
+    Streaming ``fan_out_cached``: cached stations first, then each fetched one
+    as it finishes. The names of stations that missed the deadline are
+    appended to ``late``, since a placeholder may be None.
+    """
+    cached = lookup(summary, jobs)
+    missing = {name: job for name, job in jobs.items() if name not in cached}
+    logger.info(f"{summary}: {len(cached)} station(s) cached, fetching {len(missing)}")
+
+    yield from cached.values()
+    if not missing:
+        return
+
+    # Results are tagged with their station and cached here, on the calling
+    # thread, rather than from the fan-out loop
+    def tagged_error(station_name, e):
+        return station_name, on_error(station_name, e), isinstance(e, DeadlineExceeded)
+
+    async def tagged_worker(station_name, job):
+        return station_name, await worker(station_name, job), False
+
+    def finish_late(station_name, tagged, exc):
+        result = on_error(station_name, exc) if exc else tagged[1]
+        store(summary, station_name, result)
+        logger.info(f"{summary}: late result of {station_name} cached")
+
+    fetched = iter_fan_out(missing, tagged_worker, tagged_error, deadline=deadline, on_late=finish_late)
+    for station_name, result, missed in fetched:
+        if missed:
+            if late is not None:
+                late.append(station_name)
+            result = last_good(summary, station_name) or pending(result)
+        else:
+            store(summary, station_name, result)
+        yield result
+
+
+def pending(placeholder):
+    """Mark a failure placeholder as still loading rather than failed."""
+    return dict(placeholder, pending=True) if placeholder is not None else None
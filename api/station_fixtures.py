@@ -0,0 +1,191 @@
+"""
+Record and replay of upstream station traffic.
+
+With ``DHA_FIXTURES['MODE'] = 'record'`` every WFS response fetched by the
+fan-out engine (api/fanout.py) or ``proxy_geoserver`` is also saved,
+gzip-compressed, under ``DIR/<station>/<layer>/``. With ``'replay'`` those
+responses are served instead of calling the stations, so nothing goes over
+the network. The summary code still decodes and aggregates them the same
+way, which gives deterministic offline runs and an instant demo mode.
+
+Responses are keyed by station and request with the ``authkey`` dropped, so
+recordings can be replayed against any station address. A replayed file is
+unpacked once next to its archive and memory-mapped, so workers share it
+through the page cache instead of each holding a copy.
+
+To record every summary: ``STATION_FIXTURES=record manage.py
+refresh_summaries --full-sync``. Incremental syncs ask for new features
+since a timestamp, which will not match a recording, so keep
+``DELTA_SYNC_ENABLED`` off when replaying.
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from django.conf import settings
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    # 'off', 'record' or 'replay'
+    "MODE": "off",
+    "DIR": "station_fixtures",
+    "COMPRESS_LEVEL": 6,
+}
+
+_SUFFIXES = {"application/json": "json", "application/xml": "xml", "text/xml": "xml"}
+
+
+def fixtures_setting(name):
+    return getattr(settings, "DHA_FIXTURES", {}).get(name, DEFAULTS[name])
+
+
+def recording():
+    return fixtures_setting("MODE") == "record"
+
+
+def replaying():
+    return fixtures_setting("MODE") == "replay"
+
+
+def root():
+    return Path(settings.BASE_DIR) / fixtures_setting("DIR")
+
+
+class FixtureMissing(LookupError):
+    """Replay mode was asked for a response that was never recorded."""
+
+
+def request_key(station, url, params=None):
+    """The station, path and query of a request, without its authkey, in a stable order."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True) + list((params or {}).items())
+    query = sorted((k.lower(), str(v)) for k, v in query if k.lower() != "authkey")
+    return f"{(station or '').lower()} {parts.path}?{urlencode(query)}"
+
+
+def _safe(name):
+    return re.sub(r"[^\w.-]+", "_", name) or "_"
+
+
+def _base(station, url, params=None):
+    digest = hashlib.sha1(request_key(station, url, params).encode("utf-8")).hexdigest()[:20]
+    return root() / _safe((station or "unknown").lower()) / _safe(metrics.layer_of(url, params)) / digest
+
+
+def _suffix(content_type):
+    return _SUFFIXES.get((content_type or "").split(";")[0].strip().lower(), "bin")
+
+
+def save(station, url, body, content_type="application/json", params=None):
+    """Store one response, replacing an earlier recording of the same request."""
+    path = _base(station, url, params).with_suffix(f".{_suffix(content_type)}.gz")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed so a concurrent replay never sees half a file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(gzip.compress(body, compresslevel=fixtures_setting("COMPRESS_LEVEL"), mtime=0))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    logger.debug(f"Recorded {len(body)} bytes for {station} {metrics.layer_of(url, params)} at {path}")
+
+
+_mapped = {}
+_mapped_lock = threading.Lock()
+
+
+def _map(archive):
+    """The unpacked body of an archive, memory-mapped; unpacked again if the archive changed."""
+    mtime = archive.stat().st_mtime
+    with _mapped_lock:
+        cached = _mapped.get(archive)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        if cached and isinstance(cached[1], mmap.mmap):
+            # Unmap the old body; the fd mmap holds on to is closed with it
+            try:
+                cached[1].close()
+            except BufferError:
+                logger.warning(f"{archive} changed while its old body is still in use; leaving it mapped")
+        unpacked = archive.with_suffix("")
+        if not unpacked.exists() or unpacked.stat().st_mtime < mtime:
+            fd, tmp = tempfile.mkstemp(dir=archive.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f, gzip.open(archive, "rb") as source:
+                while chunk := source.read(1 << 20):
+                    f.write(chunk)
+            os.replace(tmp, unpacked)
+        with open(unpacked, "rb") as f:
+            # mmap cannot map an empty file
+            body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        _mapped[archive] = (mtime, body)
+        return body
+
+
+def lookup(station, url, params=None):
+    """The recorded response of a request as a ``Recorded``, or None."""
+    base = _base(station, url, params)
+    for suffix in ("json", "xml", "bin"):
+        archive = base.with_suffix(f".{suffix}.gz")
+        if archive.exists():
+            content_type = "application/octet-stream" if suffix == "bin" else f"application/{suffix}"
+            return Recorded(_map(archive), content_type)
+    return None
+
+
+def replay(station, url, params=None):
+    recorded = lookup(station, url, params)
+    if recorded is None:
+        raise FixtureMissing(f"No recorded response for {station} {metrics.layer_of(url, params)}")
+    return recorded
+
+
+def recorded_bodies(layer):
+    """``(station, body)`` for every recorded response of a layer (e.g. benchmark inputs)."""
+    for archive in sorted(root().glob(f"*/{_safe(layer)}/*.gz")):
+        yield archive.parent.parent.name, _map(archive)
+
+
+class _Content:
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+
+class Recorded:
+    """A stored response body, read like an aiohttp response."""
+
+    def __init__(self, body, content_type="application/json"):
+        self.body = body
+        self.content_type = content_type
+        self.content = _Content(body)
+
+    async def read(self):
+        return self.body[:]
+
+    async def text(self):
+        return self.body[:].decode("utf-8")
+
+
+async def record(station, url, resp):
+    """Read an aiohttp response, store it, and return it as a ``Recorded`` to read from."""
+    body = await resp.read()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, save, station, url, body, resp.content_type)
+    return Recorded(body, resp.content_type)
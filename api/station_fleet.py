@@ -0,0 +1,178 @@
+"""
+Stand-in GeoServer stations for load tests.
+
+``StationFleet`` serves one local WFS endpoint per station in
+``GEOSERVER_CONFIG['dha_servers']``. Each endpoint answers:
+
+- GetFeature with synthetic layers (see api/synthetic.py), honouring
+  ``propertyName``, ``maxFeatures``, ``startIndex``/``count``,
+  ``resultType=hits`` and ``Field >= 'value'`` CQL filters;
+- DescribeFeatureType;
+- GetCapabilities.
+
+Latency, jitter, error rate and layer size are configurable. The fleet runs
+in its own process so serving it does not compete for the GIL with the
+load generator. ``env()`` gives the ``<STATION>_DHAIP``/``_AUTH_KEY``
+variables that point the app at it.
+"""
+import asyncio
+import logging
+import multiprocessing
+import random
+import re
+from collections import OrderedDict
+
+from api import json_codec, synthetic
+from api.geo_server_config import GEOSERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_CQL_AT_LEAST = re.compile(r"^\s*(\w+)\s*>=\s*'([^']*)'\s*$")
+
+CAPABILITIES = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<wfs:WFS_Capabilities version="2.0.0" xmlns:wfs="http://www.opengis.net/wfs/2.0">'
+    "<ows:ServiceIdentification xmlns:ows=\"http://www.opengis.net/ows/1.1\"><ows:Title>Load-test station</ows:Title>"
+    "</ows:ServiceIdentification></wfs:WFS_Capabilities>"
+)
+
+
+class StationFleet:
+
+    def __init__(self, host="127.0.0.1", base_port=18100, features=5000, latency=0.05, jitter=0.02,
+                 error_rate=0.0, seed=0, stations=None):
+        self.host = host
+        self.base_port = base_port
+        self.features = features
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.stations = list(stations or GEOSERVER_CONFIG["dha_servers"])
+        self._process = None
+
+    def address(self, station):
+        return f"{self.host}:{self.base_port + self.stations.index(station)}"
+
+    def env(self):
+        """Environment overrides pointing ``GEOSERVER_CONFIG`` at the fleet."""
+        env = {}
+        for station in self.stations:
+            env[f"{station.upper()}_DHAIP"] = self.address(station)
+            env[f"{station.upper()}_AUTH_KEY"] = f"loadtest-{station}"
+        return env
+
+    def start(self):
+        ready = multiprocessing.get_context("spawn").Event()
+        self._process = multiprocessing.get_context("spawn").Process(
+            target=_serve, args=(self._options(), ready), name="station-fleet", daemon=True,
+        )
+        self._process.start()
+        if not ready.wait(30):
+            self.stop()
+            raise RuntimeError("The station fleet did not start")
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(5)
+            self._process = None
+
+    def _options(self):
+        return {
+            "host": self.host, "base_port": self.base_port, "features": self.features,
+            "latency": self.latency, "jitter": self.jitter, "error_rate": self.error_rate,
+            "seed": self.seed, "stations": self.stations,
+        }
+
+
+def _serve(options, ready):
+    asyncio.run(serve(options, ready))
+
+
+async def serve(options, ready=None):
+    from aiohttp import web
+
+    bodies = OrderedDict()
+    rng = random.Random(options["seed"])
+
+    def feature_body(type_name, start, count, properties, cql, total):
+        key = (type_name, start, count, properties, cql)
+        body = bodies.get(key)
+        if body is not None:
+            bodies.move_to_end(key)
+            return body
+        props = set(properties.split(",")) if properties else None
+        if cql:
+            field, since = cql
+            selected = [
+                f for f in synthetic.features(type_name, total, options["seed"])
+                if str(f["properties"].get(field) or "") >= since
+            ]
+            if props is not None:
+                selected = [dict(f, geometry=None, properties={k: v for k, v in f["properties"].items() if k in props}) for f in selected]
+            body = (
+                f'{{"type":"FeatureCollection","totalFeatures":{len(selected)},"features":['.encode()
+                + b",".join(json_codec.dumps(f) for f in selected) + b"]}"
+            )
+        else:
+            body = synthetic.feature_collection(type_name, count, options["seed"], start=start, properties=props, total=total)
+        bodies[key] = body
+        if len(bodies) > 256:
+            bodies.popitem(last=False)
+        return body
+
+    async def handle(request):
+        query = {k.lower(): v for k, v in request.query.items()}
+        delay = options["latency"] + rng.uniform(-options["jitter"], options["jitter"])
+        await asyncio.sleep(max(0.0, delay))
+        if rng.random() < options["error_rate"]:
+            return web.Response(status=503, text="Service temporarily unavailable")
+
+        operation = query.get("request", "").lower()
+        if operation == "getcapabilities":
+            return web.Response(text=CAPABILITIES, content_type="application/xml")
+
+        type_name = (query.get("typenames") or query.get("typename") or "").split(",")[0]
+        workspace, _, layer = type_name.rpartition(":")
+        if not layer:
+            return web.Response(status=400, text="typeName is required")
+        if operation == "describefeaturetype":
+            return web.Response(body=json_codec.dumps(synthetic.describe_feature_type(layer, workspace or "dha_coregis")),
+                                content_type="application/json")
+        if operation != "getfeature":
+            return web.Response(status=400, text=f"Unsupported request {operation!r}")
+
+        total = options["features"]
+        if query.get("resulttype") == "hits":
+            return web.Response(
+                text=f'<wfs:FeatureCollection numberMatched="{total}" numberReturned="0" xmlns:wfs="http://www.opengis.net/wfs/2.0"/>',
+                content_type="application/xml",
+            )
+        start = int(query.get("startindex", 0))
+        count = int(query.get("count") or query.get("maxfeatures") or total)
+        count = max(0, min(count, total - start))
+        cql = None
+        if query.get("cql_filter"):
+            match = _CQL_AT_LEAST.match(query["cql_filter"])
+            if not match:
+                return web.Response(status=400, text="Unsupported CQL_FILTER")
+            cql = match.groups()
+        body = feature_body(layer, start, count, query.get("propertyname"), cql, total)
+        return web.Response(body=body, content_type="application/json")
+
+    runners = []
+    for index, station in enumerate(options["stations"]):
+        app = web.Application()
+        app.router.add_route("GET", "/{tail:.*}", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, options["host"], options["base_port"] + index).start()
+        runners.append(runner)
+    if ready is not None:
+        ready.set()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
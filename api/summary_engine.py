@@ -0,0 +1,379 @@
+"""
+Engine that runs the declarative summary specs in api/summary_specs.py.
+
+For every station it builds property-limited WFS requests for the spec's
+layers, streams the features through a single-pass ``Aggregator`` and
+shapes the grouped sums into the station entry the dashboards expect.
+"""
+import logging
+import re
+from datetime import datetime
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+
+from api import circuit
+from api.fanout import gather_or_cancel, get_text, iter_features
+from api.geo_server_config import GEOSERVER_CONFIG
+from api.station_cache import iter_fan_out_cached
+
+logger = logging.getLogger(__name__)
+
+
+DHA_CONFIGS = GEOSERVER_CONFIG['dha_servers']
+
+# Raised by a dimension to drop the feature from every group
+SKIP = object()
+
+# (station, typeName) pairs whose GeoServer rejected a propertyName selection
+_unselectable = set()
+
+_NUMBER_MATCHED = re.compile(r'number(?:Matched|OfFeatures)="(\d+)"')
+
+
+# --- Coercion and normalization rules --------------------------------------
+
+def parse_number(val):
+    """Lenient float parsing for numeric strings such as ``"1,234.5"``."""
+    try:
+        if val is None:
+            return 0.0
+        if isinstance(val, str):
+            val = val.replace(",", "").strip()
+        return float(val)
+    except Exception:
+        return 0.0
+
+
+COERCIONS = {
+    "or_zero": lambda v: v or 0,
+    "int": lambda v: int(v or 0),
+    "float": lambda v: float(v or 0),
+    "number": parse_number,
+}
+
+NORMALIZERS = {
+    "strip": str.strip,
+    "lower": str.lower,
+    "title": str.title,
+}
+
+
+def compile_dimension(dim):
+    fields = dim["fields"]
+    default = dim.get("default", "")
+    steps = [NORMALIZERS[n] for n in dim.get("normalize", [])]
+    contains = dim.get("contains")
+    choices = set(dim["choices"]) if "choices" in dim else None
+
+    def value(props):
+        raw = None
+        for field in fields:
+            raw = props.get(field)
+            if raw:
+                break
+        val = str(raw or default)
+        for step in steps:
+            val = step(val)
+        val = val or default
+        if contains is not None:
+            for needle, label in contains:
+                if needle in val:
+                    return label
+            return SKIP
+        if choices is not None and val not in choices:
+            return SKIP
+        return val
+
+    return value
+
+
+def compile_metric(metric):
+    if metric.get("count"):
+        return lambda props: 1
+    coerce = COERCIONS[metric.get("coerce", "or_zero")]
+    if "compute" in metric:
+        fields = metric["fields"]
+        compute = metric["compute"]
+        return lambda props: compute(*(coerce(props.get(f)) for f in fields))
+    field = metric["field"]
+    return lambda props: coerce(props.get(field))
+
+
+def spec_properties(spec, layer):
+    """Every attribute the spec reads from a layer (never the geometry)."""
+    props = []
+    for dim in spec["dimensions"].values():
+        props.extend(dim["fields"])
+    for name in layer.get("metrics", spec["metrics"]):
+        metric = spec["metrics"][name]
+        props.extend(metric.get("fields", [metric["field"]] if "field" in metric else []))
+    return list(dict.fromkeys(props))
+
+
+# --- Aggregation ------------------------------------------------------------
+
+class Aggregator:
+    """
+    Single-pass group-by over feature properties.
+
+    ``groups`` maps each group name of the spec to
+    ``{(dimension values...): {metric: sum}}``.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.dimensions = [(name, compile_dimension(dim)) for name, dim in spec["dimensions"].items()]
+        self.metrics = {name: compile_metric(m) for name, m in spec["metrics"].items()}
+        self.initial = {name: m.get("initial", 0) for name, m in spec["metrics"].items()}
+        self.group_dims = spec["groups"]
+        self.groups = {name: {} for name in self.group_dims}
+        self.feature_count = 0
+
+    def add(self, props, metric_names=None):
+        dims = {}
+        for name, value in self.dimensions:
+            val = value(props)
+            if val is SKIP:
+                return
+            dims[name] = val
+
+        values = [
+            (name, self.metrics[name](props))
+            for name in (metric_names or self.metrics)
+        ]
+        self.feature_count += 1
+
+        for group, dim_names in self.group_dims.items():
+            key = tuple(dims[d] for d in dim_names)
+            bucket = self.groups[group].get(key)
+            if bucket is None:
+                bucket = self.groups[group][key] = dict(self.initial)
+            for name, val in values:
+                bucket[name] += val
+
+    def zero(self):
+        return dict(self.initial)
+
+
+def make_aggregator(spec):
+    """Columnar aggregator when enabled and NumPy is installed, row aggregator otherwise."""
+    if getattr(settings, "DHA_AGGREGATION", {}).get("COLUMNAR", True):
+        from api import columnar
+        if columnar.available():
+            return columnar.ColumnarAggregator(spec)
+    return Aggregator(spec)
+
+
+# --- Fetching ---------------------------------------------------------------
+
+def layer_url(cfg, layer, properties=None, start=None, count=None, hits=False, cql_filter=None):
+    """
+    GetFeature URL for a spec layer.
+
+    Plain requests use WFS 1.0.0 like the rest of the dashboard; paged and
+    ``resultType=hits`` requests need WFS 2.0.0 (``startIndex``/``count``).
+    ``cql_filter`` is passed through as GeoServer's ``CQL_FILTER``.
+    """
+    workspace = layer["workspace"]
+    type_name = f"{workspace}:{layer['typeName']}"
+    paged = hits or start is not None
+    params = {
+        "service": "WFS",
+        "version": "2.0.0" if paged else "1.0.0",
+        "request": "GetFeature",
+        "typeNames" if paged else "typeName": type_name,
+    }
+    if hits:
+        params["resultType"] = "hits"
+    elif start is not None:
+        params["startIndex"] = start
+        params["count"] = count
+    elif layer.get("maxFeatures"):
+        params["maxFeatures"] = layer["maxFeatures"]
+    if properties and not hits:
+        params["propertyName"] = ",".join(properties)
+    if cql_filter:
+        params["CQL_FILTER"] = cql_filter
+    if not hits:
+        params["outputFormat"] = "application/json"
+    params["authkey"] = cfg["auth_key"]
+    return f"http://{cfg['dhaip']}/geoserver/{workspace}/ows?" + urlencode(params, quote_via=quote)
+
+
+async def count_features(station_name, cfg, layer, timeout=None):
+    """
+    Number of features in a layer from a ``resultType=hits`` probe, or None
+    if the station does not support it. Station failures are raised.
+    """
+    try:
+        body = await get_text(station_name, layer_url(cfg, layer, hits=True), timeout=timeout)
+    except circuit.CircuitOpenError:
+        raise
+    except Exception as e:
+        if circuit.is_station_failure(e):
+            # An unreachable station would not answer the unpaged request either
+            raise
+        logger.info(f"{station_name}: hits probe failed for {layer['typeName']}: {e}")
+        return None
+    match = _NUMBER_MATCHED.search(body)
+    return int(match.group(1)) if match else None
+
+
+async def stream_features(station_name, url, timeout, consume):
+    """Default page fetch: feed every feature of the response to ``consume``."""
+    async for feature in iter_features(station_name, url, timeout=timeout):
+        consume(feature)
+
+
+async def aggregate_page(spec, consume, station_name, cfg, layer, start=None, count=None, extra=(), cql_filter=None, fetch=stream_features):
+    """
+    Stream one layer (or one page of it) into ``consume(feature)``, selecting
+    only the properties the spec needs plus any ``extra`` ones.
+
+    ``fetch(station_name, url, timeout, consume)`` downloads the page and
+    feeds ``consume``; the default hands it one feature at a time.
+    """
+    select_key = (station_name, layer["typeName"])
+    properties = None if select_key in _unselectable else spec_properties(spec, layer) + list(extra)
+    timeout = layer.get("timeout", spec.get("timeout"))
+    url = layer_url(cfg, layer, properties, start=start, count=count, cql_filter=cql_filter)
+
+    seen = 0
+
+    def counted(item):
+        nonlocal seen
+        seen += 1
+        consume(item)
+
+    try:
+        await fetch(station_name, url, timeout, counted)
+    except Exception as e:
+        # Only a rejected selection is worth retrying, not an unreachable station
+        if not properties or seen or isinstance(e, circuit.CircuitOpenError) or circuit.is_station_failure(e):
+            raise
+        if extra:
+            # The extra (bookkeeping) properties may not exist on this layer
+            logger.info(f"{station_name}: {', '.join(extra)} rejected for {layer['typeName']} ({e}), retrying without")
+            await aggregate_page(spec, consume, station_name, cfg, layer, start=start, count=count, cql_filter=cql_filter, fetch=fetch)
+            return
+        # Older layers may lack some of the spec's optional fields; fall back to full features
+        logger.info(f"{station_name}: property selection rejected for {layer['typeName']} ({e}), retrying unfiltered")
+        _unselectable.add(select_key)
+        await aggregate_page(spec, consume, station_name, cfg, layer, start=start, count=count, cql_filter=cql_filter, fetch=fetch)
+
+
+async def aggregate_layer(spec, consume, station_name, cfg, layer, extra=(), fetch=stream_features):
+    """
+    Stream a whole layer into ``consume(feature)``.
+
+    Layers with a ``page_size`` are probed with ``resultType=hits`` and then
+    fetched as concurrent ``startIndex``/``count`` pages (bounded by the
+    per-station slots of the fan-out engine), so nothing is truncated. If
+    the probe fails the layer is fetched in one unpaged request.
+    """
+    page_size = layer.get("page_size")
+    if page_size:
+        total = await count_features(station_name, cfg, layer, timeout=layer.get("timeout", spec.get("timeout")))
+        if total is not None:
+            await gather_or_cancel(
+                aggregate_page(spec, consume, station_name, cfg, layer, start=start, count=page_size, extra=extra, fetch=fetch)
+                for start in range(0, total, page_size)
+            )
+            return
+    await aggregate_page(spec, consume, station_name, cfg, layer, extra=extra, fetch=fetch)
+
+
+def station_worker(spec):
+    async def worker(station_name, cfg):
+        agg = make_aggregator(spec)
+        errors = []
+
+        async def run_layer(layer):
+            metric_names = layer.get("metrics")
+            try:
+                await aggregate_layer(
+                    spec, lambda feature: agg.add(feature.get("properties") or {}, metric_names),
+                    station_name, cfg, layer,
+                )
+            except Exception as e:
+                if not spec.get("partial_layers"):
+                    raise
+                logger.warning(f"Error fetching {layer['typeName']} for {station_name}: {e}")
+                errors.append(f"{layer['typeName']}: {e}")
+
+        # All layers of a station are fetched concurrently
+        try:
+            await gather_or_cancel(run_layer(layer) for layer in spec["layers"])
+        except Exception as e:
+            return spec["error"](station_name, e)
+        try:
+            return spec["station"](station_name, agg, errors)
+        except Exception as e:
+            return spec["error"](station_name, e)
+    return worker
+
+
+def iter_summary(name, spec, stations=None, deadline=None):
+    """
+    Fan a spec out to every station, yielding ``("station", entry)`` as each
+    station's entry is ready and finally ``("summary", payload)``.
+
+    Stations still running at ``deadline`` are served from their last good
+    result; the payload then lists them under ``stale_stations`` (or
+    ``pending_stations`` when there is nothing to fall back on).
+
+    The first path that applies aggregates the stations:
+
+    1. delta sync (api/delta_sync.py), if ``DHA_DELTA_SYNC['ENABLED']`` is
+       on and a spec layer has an ``updated_field``;
+    2. the process pool (api/process_pool.py), if it is enabled;
+    3. ``make_aggregator`` in the fan-out loop: columnar when NumPy is
+       available and ``DHA_AGGREGATION['COLUMNAR']`` is on, else row by row.
+
+    Delta sync is off by default, because its full syncs aggregate one feature
+    at a time and skip the faster paths below it.
+    """
+    stations = stations or DHA_CONFIGS
+    jobs = {station.title(): cfg for station, cfg in stations.items()}
+    logger.info(f"[{datetime.now()}] {name} started")
+
+    from api import delta_sync, process_pool
+    synced = None
+    if delta_sync.enabled(spec):
+        # Layers with a change timestamp only fetch the features edited since the last refresh
+        states = delta_sync.load(name, jobs)
+        synced = delta_sync.SyncedStates(name)
+        worker = delta_sync.station_worker(name, spec, states, synced)
+    elif process_pool.enabled():
+        # Pages are decoded and aggregated in worker processes
+        worker = process_pool.station_worker(name, spec)
+    else:
+        worker = station_worker(spec)
+
+    results = []
+    late = []
+    for result in iter_fan_out_cached(name, jobs, worker, spec["error"], deadline=deadline, late=late):
+        results.append(result)
+        if result is not None:
+            yield "station", result
+    if synced is not None:
+        synced.save()
+    payload = spec["consolidate"](results)
+
+    stale = [r["station_name"] for r in results if r and r.get("stale")]
+    # Specs whose error placeholder is None have no entry to mark as pending
+    pending = [station_name for station_name in late if station_name not in stale]
+    if stale or pending:
+        payload["partial"] = True
+        payload["stale_stations"] = stale
+        payload["pending_stations"] = pending
+    logger.info(f"[{datetime.now()}] {name} completed")
+    yield "summary", payload
+
+
+def run_summary(name, spec, stations=None, deadline=None):
+    """Fan a spec out to every station and consolidate the station entries."""
+    for kind, record in iter_summary(name, spec, stations=stations, deadline=deadline):
+        if kind == "summary":
+            return record
@@ -0,0 +1,422 @@
+"""
+Declarative specs for the dashboard summaries.
+
+Each spec names the WFS layer(s) to read, the dimensions features are
+grouped by (with their normalization rules), the metric fields and how to
+coerce them, and the groups to accumulate. ``station``, ``error`` and
+``consolidate`` shape the grouped sums into the JSON the dashboard pages
+already consume. A new summary only needs a new entry in ``SUMMARY_SPECS``;
+the defaults below cover the common "totals + one breakdown per dimension"
+shape. Layers with an ``updated_field`` can be synced incrementally when
+``DHA_DELTA_SYNC['ENABLED']`` is on (see api/delta_sync.py).
+
+See api/summary_engine.py for the engine that runs them.
+"""
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+# --- Default shapers ----------------------------------------------------------
+
+def default_station(spec):
+    """``{station_name, totals, <group>: {key: metrics}}`` with optional rounding."""
+    digits = spec.get("round")
+
+    def fmt(metrics):
+        if digits is None:
+            return dict(metrics)
+        return {k: round(v, digits) for k, v in metrics.items()}
+
+    def station(station_name, agg, errors):
+        if not agg.feature_count:
+            logger.info(f"{station_name}: No features found in GeoJSON.")
+            entry = {"station_name": station_name, "totals": agg.zero()}
+            entry.update({group: {} for group in agg.groups if group != "totals"})
+            return entry
+
+        entry = {"station_name": station_name, "totals": fmt(agg.groups["totals"].get((), agg.zero()))}
+        for group, buckets in agg.groups.items():
+            if group != "totals":
+                entry[group] = {"/".join(key): fmt(metrics) for key, metrics in buckets.items()}
+        if errors:
+            entry["error"] = "; ".join(errors)
+        return entry
+
+    return station
+
+
+def default_error(spec):
+    def error(station_name, e):
+        logger.warning(f"Error fetching data for {station_name}: {e}")
+        entry = {
+            "station_name": station_name,
+            "error": str(e),
+            "totals": {name: m.get("initial", 0) for name, m in spec["metrics"].items()},
+        }
+        entry.update({group: {} for group in spec["groups"] if group != "totals"})
+        return entry
+    return error
+
+
+def default_consolidate(spec):
+    """Sum the totals of every successful station into ``total_summary``."""
+    prefix = spec.get("total_prefix", "")
+    digits = spec.get("round")
+
+    def consolidate(stations):
+        totals = {name: 0 for name in spec["metrics"]}
+        for station in stations:
+            if "error" not in station:
+                for k in totals:
+                    totals[k] += station["totals"][k]
+        return {
+            "total_summary": {
+                f"{prefix}{k}": round(v, digits) if digits is not None else v
+                for k, v in totals.items()
+            },
+            "stations": stations,
+            "timestamp": datetime.now().isoformat(),
+        }
+    return consolidate
+
+
+def with_defaults(spec):
+    spec.setdefault("station", default_station(spec))
+    spec.setdefault("error", default_error(spec))
+    spec.setdefault("consolidate", default_consolidate(spec))
+    return spec
+
+
+# --- Land acquisition (finalreport) ---------------------------------------------
+
+LAND_SUMMARY = with_defaults({
+    "layers": [
+        {"workspace": "dha_coregis", "typeName": "finalreport", "updated_field": "Last_Updated"},
+    ],
+    "timeout": 15,
+    "dimensions": {
+        "phase": {"fields": ["phase", "phase_name"], "default": "Unknown", "normalize": ["title"]},
+        "land_provider": {"fields": ["land_provider", "provider"], "default": "Unknown", "normalize": ["title"]},
+    },
+    "metrics": {
+        "possessed": {"field": "totalpossessedland"},
+        "unpossessed": {"field": "totalunpossessedland"},
+        "purchased": {"field": "purchasedarea"},
+        "unpurchased": {
+            "fields": ["totalarea", "purchasedarea"],
+            "compute": lambda total_area, purchased: total_area - purchased if total_area else 0,
+        },
+        "hold": {"field": "totalholdland"},
+        "litigation": {"field": "totallitigationland"},
+    },
+    "groups": {
+        "totals": [],
+        "phase_summary": ["phase"],
+        "land_provider_summary": ["land_provider"],
+    },
+    "round": 3,
+    "total_prefix": "total_",
+})
+
+
+# --- Town planning (phase_plot_category_summary) ---------------------------------
+
+TOWN_CATEGORIES = ["Residential", "Commercial", "Education", "Amenities", "Parks", "Total_Plots"]
+
+
+def town_station(station_name, agg, errors):
+    phases = {}
+    for (phase, category), metrics in agg.groups["phase_category"].items():
+        if phase not in phases:
+            phases[phase] = {cat: 0 for cat in TOWN_CATEGORIES}
+        phases[phase][category] += metrics["count"]
+        phases[phase]["Total_Plots"] += metrics["total"]
+
+    totals = {cat: 0 for cat in TOWN_CATEGORIES}
+    for (category,), metrics in agg.groups["category"].items():
+        totals[category] += metrics["count"]
+        totals["Total_Plots"] += metrics["total"]
+
+    return {"station_name": station_name, "phases": phases, "totals": totals}
+
+
+def town_error(station_name, e):
+    logger.warning(f"[Error] {station_name}: {e}")
+    return {
+        "station_name": station_name,
+        "error": str(e),
+        "phases": {},
+        "totals": {cat: 0 for cat in TOWN_CATEGORIES}
+    }
+
+
+def town_consolidate(stations):
+    total_summary = {cat: 0 for cat in TOWN_CATEGORIES}
+    for station in stations:
+        for cat in TOWN_CATEGORIES:
+            total_summary[cat] += station["totals"].get(cat, 0)
+    return {
+        "total_summary": total_summary,
+        "stations": stations,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+TOWN_SUMMARY = with_defaults({
+    "layers": [
+        {"workspace": "dha_coregis_v2", "typeName": "phase_plot_category_summary", "maxFeatures": 50},
+    ],
+    "timeout": 10,
+    "dimensions": {
+        "phase": {"fields": ["Phase"], "normalize": ["lower"]},
+        "category": {
+            "fields": ["Category"],
+            "normalize": ["lower"],
+            "contains": [
+                ("residential", "Residential"),
+                ("commercial", "Commercial"),
+                ("education", "Education"),
+                ("amen", "Amenities"),
+                ("park", "Parks"),
+            ],
+        },
+    },
+    "metrics": {
+        "count": {"field": "Count_of_Plots", "coerce": "int"},
+        "total": {"field": "Total_Plots", "coerce": "int"},
+    },
+    "groups": {
+        "phase_category": ["phase", "category"],
+        "category": ["category"],
+    },
+    "station": town_station,
+    "error": town_error,
+    "consolidate": town_consolidate,
+})
+
+
+# --- Chief engineering services (infrastructure_summary) --------------------------
+
+SERVICES_FIELD_MAP = {
+    "Total Roads Planned (KM)": "Roads",
+    "Total Daily Yield (GPD)": "Water Supply",
+    "Total Electricity Production (KV)": "Electricity",
+    "Total Gas Supply (BTU)": "Gas Supply",
+    "Total Sewerage Lines (KM)": "Sewerage",
+    "Total Drain Capacity": "Drainage",
+    "Area Coverage (Kanals)": "Communication",
+}
+
+
+def services_station(station_name, agg, errors):
+    if not agg.feature_count:
+        raise ValueError("No features found")
+
+    phase_wise = {}
+    for (phase, status), metrics in agg.groups["phase_status"].items():
+        phase_wise.setdefault(phase, {})[status] = metrics
+
+    # Phase totals
+    phase_totals = {phase: agg.zero() for phase in phase_wise}
+    for phase, statuses in phase_wise.items():
+        for status, metrics in statuses.items():
+            for k, v in metrics.items():
+                phase_totals[phase][k] += v
+
+    return {
+        "station_name": station_name,
+        "success": True,
+        "phase_wise": phase_wise,
+        "phase_totals": phase_totals,
+        "totals": agg.groups["totals"][()],
+    }
+
+
+def services_error(station_name, e):
+    return {
+        "station_name": station_name,
+        "success": False,
+        "error": str(e),
+        "phase_wise": {},
+        "phase_totals": {},
+        "totals": {v: 0 for v in SERVICES_FIELD_MAP.values()},
+    }
+
+
+def services_consolidate(stations):
+    total_summary = {v: 0 for v in SERVICES_FIELD_MAP.values()}
+    for station in stations:
+        # Merge into global totals if successful
+        if station["success"]:
+            for key in SERVICES_FIELD_MAP.values():
+                total_summary[key] += station["totals"].get(key, 0)
+    return {
+        "total_summary": total_summary,
+        "stations": stations,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+SERVICES_SUMMARY = with_defaults({
+    "layers": [
+        {"workspace": "dha_coregis_v2", "typeName": "infrastructure_summary", "maxFeatures": 100},
+    ],
+    "timeout": 15,
+    "dimensions": {
+        "phase": {"fields": ["Phase"], "default": "Unknown", "normalize": ["strip", "lower"]},
+        "status": {"fields": ["Status"], "default": "Unknown", "normalize": ["strip", "title"]},
+    },
+    "metrics": {
+        alias: {"field": field, "coerce": "number"}
+        for field, alias in SERVICES_FIELD_MAP.items()
+    },
+    "groups": {
+        "totals": [],
+        "phase_status": ["phase", "status"],
+    },
+    "station": services_station,
+    "error": services_error,
+    "consolidate": services_consolidate,
+})
+
+
+# --- Horticulture (polygon / line / point layers) ---------------------------------
+
+def horticulture_station(station_name, agg, errors):
+    entry = {
+        "station_name": station_name,
+        "summary": agg.groups["totals"].get((), agg.zero()),
+        "phases": {phase: metrics for (phase,), metrics in agg.groups["phase"].items()},
+    }
+    # Mark partial results so the station cache keeps them only briefly
+    if errors:
+        entry["error"] = "; ".join(errors)
+    return entry
+
+
+def horticulture_error(station_name, e):
+    logger.warning(f"Error fetching horticulture for {station_name}: {e}")
+    return {
+        "station_name": station_name,
+        "error": str(e),
+        "summary": {"Area_Kanals": 0.0, "Length_Km": 0.0, "Points": 0},
+        "phases": {}
+    }
+
+
+def horticulture_consolidate(stations):
+    total_summary = {"Area_Kanals": 0.0, "Length_Km": 0.0, "Points": 0}
+    for station in stations:
+        for k in total_summary:
+            total_summary[k] += station["summary"][k]
+    return {
+        "total_summary": total_summary,
+        "stations": stations,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+HORTICULTURE_SUMMARY = with_defaults({
+    "layers": [
+        {"workspace": "dha_coregis_v2", "typeName": "Horticulture Polygon", "page_size": 1000, "updated_field": "Last_Updated", "metrics": ["Area_Kanals"]},
+        {"workspace": "dha_coregis_v2", "typeName": "Horticulture Line", "page_size": 1000, "updated_field": "Last_Updated", "metrics": ["Length_Km"]},
+        {"workspace": "dha_coregis_v2", "typeName": "Horticulture Point", "page_size": 1000, "updated_field": "Last_Updated", "metrics": ["Points"]},
+    ],
+    "timeout": 10,
+    # A failed layer still leaves the other two in the station's result
+    "partial_layers": True,
+    "dimensions": {
+        "phase": {"fields": ["Phase"], "default": "unknown", "normalize": ["lower", "strip"]},
+    },
+    "metrics": {
+        "Area_Kanals": {"field": "Area_Kanals", "coerce": "float", "initial": 0.0},
+        "Length_Km": {"field": "Length_Km", "coerce": "float", "initial": 0.0},
+        "Points": {"count": True},
+    },
+    "groups": {
+        "totals": [],
+        "phase": ["phase"],
+    },
+    "station": horticulture_station,
+    "error": horticulture_error,
+    "consolidate": horticulture_consolidate,
+})
+
+
+# --- Security (phase_security_summary) ---------------------------------------------
+
+SECURITY_CATEGORIES = ["Camera", "Check Post", "Picquet", "QRF", "Incidents"]
+
+
+def security_station(station_name, agg, errors):
+    phases = {}
+    for (phase, category), metrics in agg.groups["phase_category"].items():
+        if phase not in phases:
+            phases[phase] = {cat: 0 for cat in SECURITY_CATEGORIES}
+            phases[phase]["Total_Features"] = 0
+        phases[phase][category] += metrics["count"]
+        phases[phase]["Total_Features"] += metrics["total"]
+
+    totals = {}
+    for (category,), metrics in agg.groups["category"].items():
+        totals[category] = metrics["count"]
+        totals["Total_Features"] = totals.get("Total_Features", 0) + metrics["total"]
+
+    return {"station_name": station_name, "totals": totals, "phases": phases}
+
+
+def security_error(station_name, e):
+    # Failed stations are left out of the security summary entirely
+    logger.warning(f"Failed to fetch {station_name}: {e}")
+    return None
+
+
+def security_consolidate(stations):
+    total_summary = {cat: 0 for cat in SECURITY_CATEGORIES}
+    reported = []
+    for station in stations:
+        if station:
+            reported.append(station)
+            for cat, val in station["totals"].items():
+                if cat in total_summary:
+                    total_summary[cat] += val
+    return {
+        "total_summary": total_summary,
+        "stations": reported,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+SECURITY_SUMMARY = with_defaults({
+    "layers": [
+        {"workspace": "dha_coregis_v2", "typeName": "phase_security_summary", "maxFeatures": 50},
+    ],
+    "timeout": 10,
+    "dimensions": {
+        "phase": {"fields": ["Phase"], "normalize": ["lower"]},
+        "category": {"fields": ["Category"], "choices": SECURITY_CATEGORIES},
+    },
+    "metrics": {
+        "count": {"field": "Count_of_Features"},
+        "total": {"field": "Total_Features"},
+    },
+    "groups": {
+        "phase_category": ["phase", "category"],
+        "category": ["category"],
+    },
+    "station": security_station,
+    "error": security_error,
+    "consolidate": security_consolidate,
+})
+
+
+# Summary name -> (spec, materialization interval in seconds)
+SUMMARY_SPECS = {
+    "land_summary": (LAND_SUMMARY, 60 * 15),
+    "town_summary": (TOWN_SUMMARY, 60 * 30),
+    "services_summary": (SERVICES_SUMMARY, 60 * 30),
+    "horticulture_summary": (HORTICULTURE_SUMMARY, 60 * 30),
+    "security_summary": (SECURITY_SUMMARY, 60 * 10),
+}
@@ -0,0 +1,195 @@
+"""
+Synthetic GeoJSON shaped like the layers the summary specs read.
+
+Every generator yields feature properties with the field names, value
+types and messiness of the real station data. That includes phase labels
+in mixed case and spacing, missing values, and numbers sent as
+comma-formatted strings. The output is deterministic for a given seed and
+scales to any feature count, so the benchmarks (``manage.py
+bench_aggregation``) and the load-test station fleet (``manage.py
+loadtest``) use the same shapes.
+"""
+import random
+import zlib
+
+from api import json_codec
+
+PHASES = ["Phase 1", "phase 2", "PHASE 3 ", "Phase 4", "Phase 5", "Phase 6", "Phase 7", "Phase 8", None, ""]
+
+
+def _phase(rng):
+    return rng.choice(PHASES)
+
+
+def _number_string(rng, high):
+    """Numbers the way some layers send them: ``"1,234.5"``, blanks or junk."""
+    roll = rng.random()
+    if roll < 0.05:
+        return None
+    if roll < 0.08:
+        return "n/a"
+    return f"{rng.uniform(0, high):,.2f}"
+
+
+def finalreport(rng, i):
+    total = round(rng.uniform(1, 500), 2)
+    purchased = round(total * rng.random(), 2)
+    possessed = round(purchased * rng.random(), 2)
+    return {
+        "phase": _phase(rng),
+        "phase_name": rng.choice(["Phase 1", "Phase 2", None]),
+        "land_provider": rng.choice(["govt", "private", "Private ", "DHA", None]),
+        "provider": rng.choice(["govt", "private", None]),
+        "totalarea": total,
+        "purchasedarea": purchased,
+        "totalpossessedland": possessed,
+        "totalunpossessedland": round(purchased - possessed, 2),
+        "totalholdland": rng.choice([0, 0.25, 1.5, None]),
+        "totallitigationland": rng.choice([0, 2.75, None]),
+        "khasra_no": f"{rng.randint(1, 9999)}/{rng.randint(1, 99)}",
+        "Last_Updated": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:00Z",
+    }
+
+
+PLOT_CATEGORIES = ["Residential Plot", "Commercial", "Education", "Amenity", "Park", "Graveyard", "Other"]
+
+
+def phase_plot_category_summary(rng, i):
+    total = rng.randint(0, 5000)
+    return {
+        "Phase": _phase(rng),
+        "Category": rng.choice(PLOT_CATEGORIES),
+        "Count_of_Plots": rng.randint(0, total),
+        "Total_Plots": total,
+    }
+
+
+def infrastructure_summary(rng, i):
+    return {
+        "Phase": _phase(rng),
+        "Status": rng.choice(["completed", "In Progress", " in progress", "planned"]),
+        "Total Roads Planned (KM)": _number_string(rng, 5000),
+        "Total Daily Yield (GPD)": rng.choice([rng.randint(0, 100000), _number_string(rng, 100000)]),
+        "Total Electricity Production (KV)": _number_string(rng, 500),
+        "Total Gas Supply (BTU)": _number_string(rng, 1e6),
+        "Total Sewerage Lines (KM)": rng.uniform(0, 300),
+        "Total Drain Capacity": _number_string(rng, 1e4),
+        "Area Coverage (Kanals)": rng.randint(0, 20000),
+    }
+
+
+def horticulture_polygon(rng, i):
+    return {"Phase": _phase(rng), "Area_Kanals": rng.uniform(0, 50), "Last_Updated": f"2025-01-{1 + i % 28:02d}T00:00:00Z"}
+
+
+def horticulture_line(rng, i):
+    return {"Phase": _phase(rng), "Length_Km": rng.uniform(0, 5), "Last_Updated": f"2025-01-{1 + i % 28:02d}T00:00:00Z"}
+
+
+def horticulture_point(rng, i):
+    return {"Phase": _phase(rng), "Species": rng.choice(["Neem", "Palm", "Pine"]), "Last_Updated": f"2025-01-{1 + i % 28:02d}T00:00:00Z"}
+
+
+SECURITY_CATEGORIES = ["Camera", "Check Post", "Picquet", "QRF", "Incidents", "Other"]
+
+
+def phase_security_summary(rng, i):
+    total = rng.randint(0, 500)
+    return {
+        "Phase": _phase(rng),
+        "Category": rng.choice(SECURITY_CATEGORIES),
+        "Count_of_Features": rng.randint(0, total),
+        "Total_Features": total,
+    }
+
+
+def generic(rng, i):
+    """Any other layer, e.g. the query engine's utility and boundary layers."""
+    return {
+        "Name": f"Feature {i + 1}",
+        "Phase": _phase(rng),
+        "Sector": rng.choice("ABCDEFGHJK"),
+        "Status": rng.choice(["Existing", "Proposed", "Under Construction"]),
+        "Area": round(rng.uniform(0, 100), 3),
+        "Length": round(rng.uniform(0, 10), 3),
+        "Count": rng.randint(0, 50),
+    }
+
+
+# typeName -> (properties generator, geometry type)
+LAYERS = {
+    "finalreport": (finalreport, "MultiPolygon"),
+    "phase_plot_category_summary": (phase_plot_category_summary, None),
+    "infrastructure_summary": (infrastructure_summary, None),
+    "Horticulture Polygon": (horticulture_polygon, "MultiPolygon"),
+    "Horticulture Line": (horticulture_line, "LineString"),
+    "Horticulture Point": (horticulture_point, "Point"),
+    "phase_security_summary": (phase_security_summary, None),
+}
+
+
+def _geometry(rng, kind):
+    x, y = rng.uniform(74.0, 74.6), rng.uniform(31.3, 31.6)
+    if kind == "Point":
+        return {"type": "Point", "coordinates": [x, y]}
+    ring = [[x + rng.uniform(-0.001, 0.001), y + rng.uniform(-0.001, 0.001)] for _ in range(6)]
+    if kind == "LineString":
+        return {"type": "LineString", "coordinates": ring}
+    return {"type": "MultiPolygon", "coordinates": [[ring + [ring[0]]]]}
+
+
+def features(type_name, count, seed=0, start=0, geometry=True, properties=None):
+    """
+    Yield ``count`` features of a layer, beginning at feature ``start``.
+
+    Feature ``i`` is the same for a given seed however the layer is paged.
+    ``properties`` limits the attributes like a WFS ``propertyName`` does,
+    which also drops the geometry.
+    """
+    make_properties, kind = LAYERS.get(type_name, (generic, "Point"))
+    base = (seed << 52) ^ (zlib.crc32(type_name.encode()) << 20)
+    for i in range(start, start + count):
+        rng = random.Random(base ^ i)
+        props = make_properties(rng, i)
+        if properties is not None:
+            props = {k: v for k, v in props.items() if k in properties}
+        yield {
+            "type": "Feature",
+            "id": f"{type_name}.{i + 1}",
+            "geometry": _geometry(rng, kind) if geometry and kind and properties is None else None,
+            "properties": props,
+        }
+
+
+def feature_collection(type_name, count, seed=0, start=0, geometry=True, properties=None, total=None):
+    """A GeoJSON FeatureCollection body (bytes) like GeoServer's ``application/json`` output."""
+    parts = [json_codec.dumps(f) for f in features(type_name, count, seed, start, geometry, properties)]
+    total = start + count if total is None else total
+    header = f'{{"type":"FeatureCollection","totalFeatures":{total},"numberReturned":{count},"features":['.encode()
+    return header + b",".join(parts) + b"]}"
+
+
+_XSD_TYPES = {bool: ("xsd:boolean", "boolean"), int: ("xsd:int", "int"), float: ("xsd:double", "number"), str: ("xsd:string", "string")}
+
+
+def describe_feature_type(type_name, workspace):
+    """GeoServer's ``DescribeFeatureType`` JSON for a synthetic layer."""
+    make_properties, kind = LAYERS.get(type_name, (generic, "Point"))
+    sample = {}
+    for i in range(50):
+        for name, value in make_properties(random.Random(i), i).items():
+            if value is not None and not isinstance(sample.get(name), str):
+                sample[name] = value
+    properties = [
+        {"name": "the_geom", "maxOccurs": 1, "minOccurs": 0, "nillable": True,
+         "type": f"gml:{kind or 'Geometry'}", "localType": kind or "Geometry"},
+    ]
+    for name, value in sample.items():
+        xsd, local = _XSD_TYPES.get(type(value), _XSD_TYPES[str])
+        properties.append({"name": name, "maxOccurs": 1, "minOccurs": 0, "nillable": True, "type": xsd, "localType": local})
+    return {
+        "elementFormDefault": "qualified",
+        "targetNamespace": f"http://{workspace}",
+        "targetPrefix": workspace,
+        "featureTypes": [{"typeName": type_name, "properties": properties}],
+    }
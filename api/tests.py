@@ -0,0 +1,874 @@
+"""
+Tests for the api app. Stations are served by a local fleet
+(api/station_fleet.py), so no GeoServer is needed::
+
+    python manage.py test api
+"""
+import asyncio
+import copy
+import gzip
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.core.cache import caches
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from api import (
+    async_views, circuit, columnar, config_api, delta_sync, fanout, geojson_stream, graph_aggregate, json_codec, materialize, metrics,
+    process_pool, proxy_cache, proxy_stream, responses, schema_catalog, singleflight, snapshot, station_cache, station_fixtures,
+    synthetic, views,
+)
+from api.geo_server_config import GEOSERVER_CONFIG
+from api.models import SnapshotValue
+from api.station_fleet import StationFleet
+from api.summary_engine import Aggregator, run_summary
+from api.summary_specs import SUMMARY_SPECS
+
+STATIONS = ["multan", "lahore", "karachi"]
+
+LOCMEM = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def same(a, b):
+    """Equal payloads, with floats equal up to summation order."""
+    if isinstance(a, dict):
+        return isinstance(b, dict) and a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return isinstance(b, list) and len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        return type(a) is type(b) and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    return type(a) is type(b) and a == b
+
+
+class _BlankBody(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b" \r\n"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ExceptionReport(BaseHTTPRequestHandler):
+    """GeoServer's answer to a bad filter: an exception report served with status 200."""
+    body = (b'<?xml version="1.0" encoding="UTF-8"?>\n<ows:ExceptionReport version="2.0.0">'
+            b'<ows:Exception exceptionCode="InvalidParameterValue"/></ows:ExceptionReport>')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml" if "json" in self.path.lower() else "text/plain")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(handler):
+    """Serve ``handler`` on a free local port; returns the server and its URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+def by_station(payload):
+    """A payload's station entries in a fixed order (they are listed as they arrive)."""
+    return sorted(payload["stations"], key=lambda entry: entry["station_name"])
+
+
+def fleet_stations(fleet):
+    """``dha_servers``-shaped config pointing the fleet's stations at it."""
+    return {
+        name: dict(GEOSERVER_CONFIG["dha_servers"][name], dhaip=fleet.address(name), auth_key=f"test-{name}")
+        for name in fleet.stations
+    }
+
+
+@override_settings(CACHES=LOCMEM)
+class SnapshotTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fleet = StationFleet(base_port=18300, features=400, latency=0, jitter=0, stations=STATIONS)
+        cls.fleet.start()
+        cls.addClassCleanup(cls.fleet.stop)
+        cls.stations = fleet_stations(cls.fleet)
+
+    def test_build_matches_live_summary(self):
+        for name, (spec, _) in SUMMARY_SPECS.items():
+            with self.subTest(summary=name):
+                built = snapshot.build(name, spec, self.stations)
+                live = run_summary(name, spec, self.stations)
+                self.assertFalse([s for s in live["stations"] if "error" in s])
+                self.assertTrue(same(by_station(built), by_station(live)))
+                self.assertTrue(same(built["total_summary"], live["total_summary"]))
+
+    def test_resync_keeps_unchanged_rows(self):
+        spec = SUMMARY_SPECS["land_summary"][0]
+        snapshot.sync("land_summary", spec, self.stations)
+        stored = set(SnapshotValue.objects.values_list("id", flat=True))
+        self.assertTrue(stored)
+
+        snapshot.sync("land_summary", spec, self.stations)
+        self.assertEqual(set(SnapshotValue.objects.values_list("id", flat=True)), stored)
+
+    def test_background_builds_drop_stale_connections(self):
+        spec = SUMMARY_SPECS["land_summary"][0]
+        # As on a scheduler thread, outside any transaction
+        with mock.patch("api.snapshot.close_old_connections") as close, \
+                mock.patch.object(type(snapshot.connection), "in_atomic_block", False, create=True):
+            snapshot.build("land_summary", spec, self.stations)
+        # Around every station's rows and around the summary queries
+        self.assertEqual(close.call_count, 2 * (len(self.stations) + 1))
+
+
+@skipUnless(json_codec.orjson, "orjson is not installed")
+@override_settings(DHA_JSON={"CODEC": "auto"})
+class JsonCodecTests(SimpleTestCase):
+    def test_dumps_matches_stdlib_across_magnitudes(self):
+        rng = random.Random(0)
+        values = [0.0, -0.0, 5e-324, 1e-4, 9.999999999999999e-05, 1e16, 9999999999999998.0, float("inf"), float("nan")]
+        for exponent in range(-320, 309):
+            values.extend(sign * rng.uniform(1, 10) * 10.0 ** exponent for sign in (1, -1) for _ in range(20))
+        for value in values:
+            for payload in (value, [1, value], {"a": {"b": [value, "x"]}}):
+                self.assertEqual(json_codec.dumps(payload), json_codec.stdlib_dumps(payload), repr(value))
+
+
+class EmptyBodyTests(SimpleTestCase):
+    """A blank GetFeature body is a layer without features on every decode path."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server, cls.url = serve(_BlankBody)
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+
+    def fetch(self):
+        async def worker(station_name, url):
+            return [feature async for feature in fanout.iter_features(station_name, url)]
+        return fanout.fan_out({"Blank": self.url}, worker, lambda station_name, e: e)
+
+    def test_parser(self):
+        self.assertEqual(list(geojson_stream.iter_features([b"", b" \r\n"])), [])
+        with self.assertRaises(ValueError):
+            list(geojson_stream.iter_features([b"<ServiceExceptionReport/>"]))
+
+    @override_settings(DHA_FANOUT={"STREAM_FEATURES": True})
+    def test_streaming_fetch(self):
+        self.assertEqual(self.fetch(), [[]])
+
+    @override_settings(DHA_FANOUT={"STREAM_FEATURES": False})
+    def test_buffered_fetch(self):
+        self.assertEqual(self.fetch(), [[]])
+
+    def test_pool_page(self):
+        spec = SUMMARY_SPECS["land_summary"][0]
+        (feature_count, groups), _decode, _aggregation = process_pool.aggregate_body("land_summary", 0, b" \n")
+        self.assertEqual(feature_count, 0)
+        self.assertEqual(groups, {group: {} for group in spec["groups"]})
+
+
+@skipUnless(columnar.available(), "NumPy is not installed")
+class ColumnarTests(SimpleTestCase):
+    def test_matches_row_aggregator(self):
+        for name, (spec, _) in SUMMARY_SPECS.items():
+            with self.subTest(summary=name):
+                # Small pages of every layer arrive interleaved, as they do from concurrent fetches
+                rng = random.Random(name)
+                pages = []
+                for index, layer in enumerate(spec["layers"]):
+                    features = list(synthetic.features(layer["typeName"], 1500, seed=index))
+                    while features:
+                        size = rng.randint(1, 8)
+                        pages.append((layer, features[:size]))
+                        features = features[size:]
+                rng.shuffle(pages)
+
+                row, batch = Aggregator(spec), columnar.ColumnarAggregator(spec)
+                for layer, features in pages:
+                    for feature in features:
+                        row.add(feature["properties"], layer.get("metrics"))
+                        batch.add(feature["properties"], layer.get("metrics"))
+
+                self.assertEqual(batch.feature_count, row.feature_count)
+                for group in spec["groups"]:
+                    self.assertEqual(list(batch.groups[group].items()), list(row.groups[group].items()), group)
+
+
+@override_settings(CACHES=LOCMEM)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        caches["default"].clear()
+
+    def run_concurrently(self, fn, followers=5):
+        """Call ``do`` from a leader and from followers that arrive while it runs."""
+        started, release = threading.Event(), threading.Event()
+        outcomes = []
+
+        def leader_fn():
+            started.set()
+            release.wait(5)
+            return fn()
+
+        def call(work):
+            try:
+                outcomes.append(singleflight.do("test:key", work))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call, args=(leader_fn,))]
+        threads[0].start()
+        started.wait(5)
+        threads += [threading.Thread(target=call, args=(fn,)) for _ in range(followers)]
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_followers_share_the_leader_result(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            return {"calls": len(calls)}
+
+        self.assertEqual(self.run_concurrently(fn), [{"calls": 1}] * 6)
+        self.assertEqual(len(calls), 1)
+
+    def test_followers_share_the_leader_error(self):
+        error = ValueError("upstream failed")
+
+        def fn():
+            raise error
+
+        self.assertEqual(self.run_concurrently(fn), [error] * 6)
+
+    def test_finished_calls_run_again(self):
+        self.assertEqual(singleflight.do("test:key", lambda: 1), 1)
+        self.assertEqual(singleflight.do("test:key", lambda: 2), 2)
+
+
+@override_settings(DHA_CIRCUIT={"FAILURE_THRESHOLD": 2, "RESET_TIMEOUT": 30, "MAX_RESET_TIMEOUT": 300})
+class CircuitTests(SimpleTestCase):
+    def open_breaker(self):
+        breaker = circuit.Breaker("test-station")
+        breaker.record_failure(0.1)
+        self.assertEqual(breaker.state, circuit.CLOSED)
+        breaker.record_failure(0.1)
+        self.assertEqual(breaker.state, circuit.OPEN)
+        self.assertFalse(breaker.allow())
+        return breaker
+
+    def probe(self, breaker, ok):
+        """Make the reset timeout due and let the half-open probe run."""
+        breaker.opened_at -= breaker.reset_timeout
+        with mock.patch("api.circuit.probe_station", return_value=ok) as probe_station:
+            # Calls are still rejected while the probe runs
+            self.assertFalse(breaker.allow())
+            deadline = time.monotonic() + 5
+            while breaker.state == circuit.HALF_OPEN and time.monotonic() < deadline:
+                time.sleep(0.01)
+        probe_station.assert_called_once_with("test-station")
+
+    def test_successful_probe_closes(self):
+        breaker = self.open_breaker()
+        self.probe(breaker, ok=True)
+        self.assertEqual(breaker.state, circuit.CLOSED)
+        self.assertEqual(breaker.consecutive_failures, 0)
+        self.assertTrue(breaker.allow())
+
+    def test_failed_probe_reopens_for_longer(self):
+        breaker = self.open_breaker()
+        self.probe(breaker, ok=False)
+        self.assertEqual(breaker.state, circuit.OPEN)
+        self.assertEqual(breaker.reset_timeout, 60)
+        self.assertFalse(breaker.allow())
+
+    def test_guard_counts_station_failures_only(self):
+        breaker = circuit.breaker("test-guarded")
+        for _ in range(2):
+            with self.assertRaises(ValueError), circuit.guard("test-guarded"):
+                raise ValueError("malformed body")
+        self.assertEqual(breaker.state, circuit.CLOSED)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError), circuit.guard("test-guarded"):
+                raise ConnectionError("refused")
+        self.assertEqual(breaker.state, circuit.OPEN)
+        with self.assertRaises(circuit.CircuitOpenError):
+            circuit.check("test-guarded")
+
+
+@override_settings(CACHES=LOCMEM)
+class LatencyBudgetTests(SimpleTestCase):
+    NAME = "security_summary"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fleet = StationFleet(base_port=18400, features=50, latency=1.0, jitter=0, stations=STATIONS)
+        cls.fleet.start()
+        cls.addClassCleanup(cls.fleet.stop)
+        cls.stations = fleet_stations(cls.fleet)
+        cls.titles = sorted(name.title() for name in STATIONS)
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_pending_then_stale(self):
+        spec = SUMMARY_SPECS[self.NAME][0]
+        started = time.monotonic()
+        payload = run_summary(self.NAME, spec, self.stations, deadline=0.2)
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertTrue(payload["partial"])
+        self.assertEqual(sorted(payload["pending_stations"]), self.titles)
+
+        payload = run_summary(self.NAME, spec, self.stations)
+        self.assertNotIn("partial", payload)
+
+        # Expired station entries are served from the last good results within the budget
+        station_cache.invalidate(self.NAME, self.titles)
+        payload = run_summary(self.NAME, spec, self.stations, deadline=0.2)
+        self.assertEqual(sorted(payload["stale_stations"]), self.titles)
+        self.assertEqual(payload["pending_stations"], [])
+        self.assertTrue(all(entry["stale"] and entry["as_of"] for entry in payload["stations"]))
+        self.wait_for_late_results()
+
+    def wait_for_late_results(self):
+        """Late fetches keep running after the deadline; let them land before the fleet stops."""
+        deadline = time.monotonic() + 5
+        while len(station_cache.lookup(self.NAME, self.titles)) < len(self.titles) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+@override_settings(DHA_RESPONSES={"COMPRESS": True, "MIN_COMPRESS_SIZE": 1024})
+class ResponseTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.encoded = responses.encode({"rows": list(range(1000))})
+
+    def get(self, encoded=None, **headers):
+        return responses.respond(self.factory.get("/api/summary", **headers), encoded or self.encoded)
+
+    def test_compressed_200(self):
+        response = self.get(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), self.encoded.body)
+        self.assertEqual(response["ETag"], self.encoded.etag("gzip"))
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+    def test_304_carries_the_representation_headers(self):
+        etag = self.get(HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        response = self.get(HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(response.content, b"")
+
+        # Any representation of the same body validates; the 304 names the one this client gets
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], self.encoded.etag())
+
+    def test_changed_body_is_sent_again(self):
+        etag = self.get()["ETag"]
+        response = self.get(responses.encode({"rows": []}), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_small_bodies_are_not_compressed(self):
+        response = self.get(responses.encode({"ok": True}), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response.content, b'{"ok":true}')
+
+    def test_encoding_follows_q_values(self):
+        compressors = {"br": lambda body: body, "gzip": responses._gzip}
+        cases = {
+            "gzip, br": "br",
+            "gzip;q=1.0, br;q=0.5": "gzip",
+            "br;q=0, gzip": "gzip",
+            "br; q=0, gzip; q=0": None,
+            "*;q=0.2, gzip;q=0.8": "gzip",
+            "gzip;q=0.5, identity": None,
+            "deflate": None,
+        }
+        with mock.patch.object(responses, "COMPRESSORS", compressors):
+            for header, expected in cases.items():
+                with self.subTest(header=header):
+                    request = self.factory.get("/api/summary", HTTP_ACCEPT_ENCODING=header)
+                    self.assertEqual(responses.accepted_encoding(request), expected)
+
+    def test_proxy_errors_and_field_filter_use_json_response(self):
+        request = self.factory.get("/api/proxy/geoserver", HTTP_ACCEPT_ENCODING="gzip")
+        response = proxy_stream.error_response(circuit.CircuitOpenError("multan", 12.5), request)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "13")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertIn("multan", json_codec.loads(response.content)["error"])
+
+        fields = [{"name": "Phase", "type": "text"}, {"name": "geom", "type": "text"}]
+        request = self.factory.post("/api/config/filter-fields", json_codec.dumps({"fields": fields}), content_type="application/json")
+        response = config_api.filter_layer_fields(request)
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertIn("ETag", response)
+        self.assertEqual(json_codec.loads(response.content), {"filtered_fields": fields[:1]})
+
+
+class ProxyCacheKeyTests(SimpleTestCase):
+    URL = "http://127.0.0.1:9001/geoserver/dha_coregis/wfs"
+
+    def test_normalize_folds_url_and_params(self):
+        url, params = proxy_cache.normalize(
+            f"{self.URL}?service=WFS&typeName=dha_coregis:roads&outputFormat=application/json",
+            {"TYPENAME": "dha_coregis:parks", "request": "GetFeature", "SERVICE": "WFS"},
+        )
+        self.assertEqual(url, self.URL)
+        # First spelling of each key, last value
+        self.assertEqual(params, {
+            "service": "WFS",
+            "typeName": "dha_coregis:parks",
+            "outputFormat": "application/json",
+            "request": "GetFeature",
+        })
+
+    def test_cache_key_folds_case_and_order(self):
+        key = proxy_cache.cache_key(self.URL, {"service": "WFS", "request": "GetFeature", "typeName": "a:roads", "authkey": "k"})
+        self.assertEqual(key, proxy_cache.cache_key(
+            self.URL, {"AUTHKEY": "k", "TYPENAME": "a:roads", "REQUEST": "getfeature", "Service": "wfs"},
+        ))
+        # Layer names and auth keys are case-sensitive values
+        self.assertNotEqual(key, proxy_cache.cache_key(
+            self.URL, {"service": "WFS", "request": "GetFeature", "typeName": "a:Roads", "authkey": "k"},
+        ))
+        self.assertNotEqual(key, proxy_cache.cache_key(
+            self.URL, {"service": "WFS", "request": "GetFeature", "typeName": "a:roads", "authkey": "other"},
+        ))
+
+    @override_settings(DHA_PROXY_CACHE={"TTLS": {"getfeature": 300}, "LAYER_TTLS": {"roads": 60}})
+    def test_ttl_by_request_and_layer(self):
+        self.assertEqual(proxy_cache.ttl({"REQUEST": "GetFeature", "typeName": "dha_coregis:parks"}), 300)
+        self.assertEqual(proxy_cache.ttl({"request": "getfeature", "TYPENAMES": "dha_coregis:roads"}), 60)
+        self.assertIsNone(proxy_cache.ttl({"request": "DescribeFeatureType"}))
+
+
+class ProxyExceptionReportTests(SimpleTestCase):
+    def setUp(self):
+        server, self.url = serve(_ExceptionReport)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        setting = override_settings(DHA_PROXY_CACHE={"DISK_DIR": directory.name})
+        setting.enable()
+        self.addCleanup(setting.disable)
+
+    def proxy(self, streamed, **params):
+        params = {"url": self.url, "service": "WFS", "request": "GetFeature", "typeName": "dha_coregis:roads", **params}
+        call = proxy_stream.ProxyCall(RequestFactory().get("/api/proxy/geoserver", params))
+        if streamed:
+            response = proxy_stream.stream(call)
+            body = b"".join(response.streaming_content)
+        else:
+            response = call.buffered()
+            body = response.content
+        self.assertEqual((response.status_code, body), (200, _ExceptionReport.body))
+        return proxy_cache.get(call.cache_key)
+
+    def test_reports_are_not_cached(self):
+        for streamed in (True, False):
+            with self.subTest(streamed=streamed):
+                # XML for a JSON request, and a report sniffed from the body
+                self.assertIsNone(self.proxy(streamed, outputFormat="application/json"))
+                self.assertIsNone(self.proxy(streamed))
+
+    def test_cacheable(self):
+        params = {"outputFormat": "application/json"}
+        self.assertTrue(proxy_cache.cacheable(params, b'{"features": []}', "application/json", None))
+        self.assertFalse(proxy_cache.cacheable(params, b'{"features": []}', "text/xml; subtype=gml/3.2", None))
+        self.assertTrue(proxy_cache.cacheable({}, b"<wfs:FeatureCollection/>", "text/xml", None))
+        report = gzip.compress(_ExceptionReport.body)
+        self.assertFalse(proxy_cache.cacheable({}, report, "text/xml", "gzip"))
+        self.assertTrue(proxy_cache.cacheable({}, gzip.compress(b"<wfs:FeatureCollection/>"), "text/xml", "gzip"))
+
+
+class StationFixtureTests(SimpleTestCase):
+    URL = "http://127.0.0.1:9001/geoserver/dha_coregis/wfs?typeName=dha_coregis:roads"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        setting = override_settings(DHA_FIXTURES={"MODE": "replay", "DIR": directory.name})
+        setting.enable()
+        self.addCleanup(setting.disable)
+
+    def test_changed_archive_is_remapped(self):
+        station_fixtures.save("multan", self.URL, b'{"features": []}')
+        first = station_fixtures.lookup("multan", self.URL)
+        self.assertEqual(first.body[:], b'{"features": []}')
+        self.assertIs(station_fixtures.lookup("multan", self.URL).body, first.body)
+
+        station_fixtures.save("multan", self.URL, b'{"features": [{}]}')
+        archive = next(Path(station_fixtures.root()).rglob("*.gz"))
+        later = time.time() + 10
+        os.utime(archive, (later, later))
+        second = station_fixtures.lookup("multan", self.URL)
+        self.assertEqual(second.body[:], b'{"features": [{}]}')
+        self.assertTrue(first.body.closed)
+
+
+@override_settings(CACHES=LOCMEM)
+class MetricsTests(SimpleTestCase):
+    def test_layer_label_is_bounded(self):
+        url = "http://127.0.0.1:9001/geoserver/dha_coregis/wfs"
+        self.assertEqual(metrics.layer_label(metrics.layer_of(url, {"typeName": "dha_coregis:Roads"})), "roads")
+        self.assertEqual(metrics.layer_label(metrics.layer_of(url, {"typeName": "finalreport"})), "finalreport")
+        self.assertEqual(metrics.layer_label(metrics.layer_of(url, {"request": "GetCapabilities"})), "getcapabilities")
+        for layer in ("dha_coregis:x1", "dha_coregis:x2", "<script>"):
+            call = metrics.UpstreamCall("Multan", metrics.layer_of(url, {"typeName": layer}), "proxy")
+            self.assertEqual(call.labels["layer"], "other")
+
+    def test_scrapes_from_allowed_addresses_only(self):
+        factory = RequestFactory()
+        self.assertEqual(views.metrics_view(factory.get("/api/metrics")).status_code, 200)
+        self.assertEqual(views.metrics_view(factory.get("/api/metrics", REMOTE_ADDR="203.0.113.7")).status_code, 403)
+        with override_settings(DHA_METRICS={"ALLOWED_IPS": None}):
+            self.assertEqual(views.metrics_view(factory.get("/api/metrics", REMOTE_ADDR="203.0.113.7")).status_code, 200)
+
+
+class GraphAggregateTests(SimpleTestCase):
+    ROWS = [
+        {"Phase": "1", "Area_Kanals": "1,000.5", "Category": "A"},
+        {"Phase": 1, "Area_Kanals": 2, "Category": "B"},
+        {"Phase": 1.0, "Area_Kanals": "n/a", "Category": "A"},
+        {"Phase": "2", "Area_Kanals": None, "Category": ""},
+        {"Phase": "2", "Area_Kanals": -3, "Category": "C"},
+        {"Phase": None, "Area_Kanals": 0, "Category": "A"},
+    ]
+
+    def matrix(self, fn, y="Area_Kanals", rows=ROWS):
+        query = graph_aggregate.GraphQuery("roads", "Phase", [y], {y: fn}, ["multan"])
+        groups = graph_aggregate.GroupBy(query)
+        for props in rows:
+            groups.add(props)
+        categories, series = groups.matrix()
+        return categories, series[y]
+
+    def test_functions(self):
+        # "1", 1 and 1.0 are one category, labelled and sorted as the chart shows them
+        self.assertEqual(self.matrix("sum"), (["1", "2", "null"], [1002.5, -3, 0]))
+        # Non-numeric values are skipped by sums and means but counted
+        self.assertEqual(self.matrix("count")[1], [3, 1, 1])
+        self.assertEqual(self.matrix("mean")[1], [501.25, -3, 0])
+        # min/max start from the first numeric value rather than 0
+        self.assertEqual(self.matrix("min")[1], [2, -3, 0])
+        self.assertEqual(self.matrix("max")[1], [1000.5, -3, 0])
+        self.assertEqual(self.matrix("count_distinct", y="Category")[1], [2, 1, 1])
+
+    def test_merged_stations_match_one_pass(self):
+        for fn in sorted(graph_aggregate.FUNCTIONS):
+            with self.subTest(fn=fn):
+                query = graph_aggregate.GraphQuery("roads", "Phase", ["Area_Kanals"], {"Area_Kanals": fn}, ["multan"])
+                first, second = graph_aggregate.GroupBy(query), graph_aggregate.GroupBy(query)
+                for index, props in enumerate(self.ROWS):
+                    (first if index % 2 else second).add(props)
+                first.merge(second)
+                self.assertEqual(first.matrix()[1]["Area_Kanals"], self.matrix(fn)[1])
+                self.assertEqual(first.features, len(self.ROWS))
+
+    @override_settings(DHA_GRAPH_AGGREGATE={"MAX_CATEGORIES": 2})
+    def test_too_many_categories(self):
+        with self.assertRaises(graph_aggregate.TooManyCategories):
+            self.matrix("sum")
+
+    def test_invalid_queries(self):
+        factory = RequestFactory()
+        for params in (
+            {"layer": "nope", "x": "Phase", "y": "Area_Kanals"},
+            {"layer": "roads", "x": "Phase"},
+            {"layer": "roads", "x": "Phase", "y": "geom"},
+            {"layer": "roads", "x": "Phase", "y": "Area_Kanals", "agg": "median"},
+            {"layer": "roads", "x": "Phase", "y": "Area_Kanals,Category", "agg": "sum,sum,sum"},
+            {"layer": "roads", "x": "Phase", "y": "Area_Kanals", "servers": "mars"},
+        ):
+            with self.subTest(params=params):
+                response = graph_aggregate.response(factory.get("/api/query/aggregate", params))
+                self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM)
+class DeltaSyncTests(SimpleTestCase):
+    NAME = "land_summary"
+    FEATURES = 300
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fleet = StationFleet(base_port=18500, features=cls.FEATURES, latency=0, jitter=0, stations=STATIONS)
+        cls.fleet.start()
+        cls.addClassCleanup(cls.fleet.stop)
+        cls.stations = fleet_stations(cls.fleet)
+        cls.titles = sorted(name.title() for name in STATIONS)
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def run_delta(self):
+        # Station results are cached; only a fetch goes through the sync
+        station_cache.invalidate(self.NAME, self.titles)
+        with override_settings(DHA_DELTA_SYNC={"ENABLED": True, "CHUNK_FEATURES": 50}):
+            return run_summary(self.NAME, SUMMARY_SPECS[self.NAME][0], self.stations)
+
+    def layer_states(self):
+        states = delta_sync.load(self.NAME, self.titles)
+        self.assertEqual(sorted(states), self.titles)
+        return [states[title]["layers"]["finalreport"] for title in self.titles]
+
+    def test_watermarks(self):
+        spec = SUMMARY_SPECS[self.NAME][0]
+        full = run_summary(self.NAME, spec, self.stations)
+        first = self.run_delta()
+        self.assertTrue(same(by_station(first), by_station(full)))
+        self.assertTrue(same(first["total_summary"], full["total_summary"]))
+
+        newest = max(f["properties"]["Last_Updated"] for f in synthetic.features("finalreport", self.FEATURES))
+        synced = self.layer_states()
+        for layer in synced:
+            self.assertTrue(layer["incremental"])
+            self.assertEqual(layer["watermark"], newest)
+            self.assertEqual(layer["size"], self.FEATURES)
+            self.assertEqual(layer["chunks"], math.ceil(self.FEATURES / 50))
+
+        # The next refresh only re-reads the features at the watermark, which
+        # leaves the sums exactly as they were
+        for _ in range(2):
+            again = self.run_delta()
+            self.assertEqual(by_station(again), by_station(first))
+            self.assertEqual(again["total_summary"], first["total_summary"])
+        for before, after in zip(synced, self.layer_states()):
+            self.assertEqual(after["full_synced_at"], before["full_synced_at"])
+            self.assertEqual(after["watermark"], newest)
+
+    def test_edits_replace_contributions(self):
+        spec = SUMMARY_SPECS[self.NAME][0]
+        features = list(synthetic.features("finalreport", 200))
+        agg = delta_sync.DeltaAggregator(spec)
+        for feature in features:
+            agg.upsert(feature["id"], feature["properties"])
+        groups = copy.deepcopy(agg.groups)
+
+        agg.changed.clear()
+        for feature in features:
+            agg.upsert(feature["id"], feature["properties"])
+        self.assertEqual(agg.changed, set())
+        self.assertEqual(agg.groups, groups)
+
+        for feature in features[::20]:
+            feature["properties"] = dict(feature["properties"], phase="Phase 9", totalarea=1.5)
+            agg.upsert(feature["id"], feature["properties"])
+        self.assertEqual(len(agg.changed), 10)
+
+        fresh = Aggregator(spec)
+        for feature in features:
+            fresh.add(feature["properties"])
+        self.assertEqual(agg.feature_count, fresh.feature_count)
+        self.assertTrue(same(agg.groups, fresh.groups))
+
+    def sync(self, watermark):
+        return {"state": {"layers": {"finalreport": {"watermark": watermark}}}, "chunks": {}, "stale": []}
+
+    def test_late_stations_save_themselves(self):
+        synced = delta_sync.SyncedStates("land_summary")
+        self.assertTrue(synced.put("Multan", self.sync("2025-01-01")))
+        synced.save()
+        self.assertFalse(synced.put("Lahore", self.sync("2025-02-01")))
+
+        stored = delta_sync.load("land_summary", ["Multan", "Lahore"])
+        self.assertEqual(list(stored), ["Multan"])
+        self.assertEqual(stored["Multan"]["layers"]["finalreport"]["watermark"], "2025-01-01")
+
+
+@override_settings(CACHES=LOCMEM)
+class SchemaCatalogTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fleet = StationFleet(base_port=18600, features=10, latency=0, jitter=0, stations=STATIONS)
+        cls.fleet.start()
+        cls.addClassCleanup(cls.fleet.stop)
+
+    def setUp(self):
+        caches["default"].clear()
+        stations = fleet_stations(self.fleet)
+        # Nothing listens on the discard port
+        stations["islamabad"] = dict(GEOSERVER_CONFIG["dha_servers"]["islamabad"], dhaip="127.0.0.1:9", auth_key="x")
+        patcher = mock.patch.object(schema_catalog, "DHA_CONFIGS", stations)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self):
+        with mock.patch.object(schema_catalog, "_station", wraps=schema_catalog._station) as station:
+            entry = materialize.refresh(schema_catalog.NAME)
+        return entry["payload"], sorted(call.args[0] for call in station.call_args_list)
+
+    def test_partial_retry_only_asks_failed_stations(self):
+        first, asked = self.build()
+        self.assertTrue(first["partial"])
+        self.assertEqual(asked, sorted(schema_catalog.DHA_CONFIGS))
+        self.assertEqual(list(first["errors"]), ["islamabad"])
+        self.assertEqual(sorted(first["stations"]), sorted(self.fleet.stations))
+
+        again, asked = self.build()
+        self.assertEqual(asked, ["islamabad"])
+        self.assertTrue(again["partial"])
+        self.assertEqual(again["stations"], first["stations"])
+        self.assertEqual(again["described_at"], first["described_at"])
+
+        # Once the schemas are older than the interval every station is asked again
+        entry = materialize.stored(schema_catalog.NAME)
+        interval = materialize.SUMMARIES[schema_catalog.NAME]["interval"]
+        entry["payload"]["described_at"] = {name: t - interval for name, t in entry["payload"]["described_at"].items()}
+        materialize.store(schema_catalog.NAME, entry["payload"])
+        _, asked = self.build()
+        self.assertEqual(asked, sorted(schema_catalog.DHA_CONFIGS))
+
+
+@override_settings(CACHES=LOCMEM)
+class AsyncViewTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fleet = StationFleet(base_port=18700, features=50, latency=0, jitter=0, stations=STATIONS)
+        cls.fleet.start()
+        cls.addClassCleanup(cls.fleet.stop)
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_aggregate_matches_sync(self):
+        params = {"layer": "roads", "x": "Phase", "y": "Area_Kanals", "agg": "sum", "servers": ",".join(STATIONS)}
+        with mock.patch.object(graph_aggregate, "DHA_CONFIGS", fleet_stations(self.fleet)):
+            expected = graph_aggregate.response(RequestFactory().get("/api/query/aggregate", params))
+            caches["default"].clear()
+            response = asyncio.run(async_views.query_aggregate(AsyncRequestFactory().get("/api/query/aggregate", params)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_codec.loads(response.content), json_codec.loads(expected.content))
+
+    def test_missing_copy_is_built_once(self):
+        builds = []
+
+        def build(deadline=None):
+            builds.append(deadline)
+            time.sleep(0.2)
+            return {"built": len(builds)}
+
+        materialize.summary("async_test", interval=60)(build)
+        self.addCleanup(materialize.SUMMARIES.pop, "async_test")
+
+        async def requests():
+            return await asyncio.gather(*(materialize.aget("async_test", budget=3) for _ in range(5)))
+
+        entries = asyncio.run(requests())
+        self.assertEqual(len(builds), 1)
+        self.assertAlmostEqual(builds[0], 3, places=2)
+        self.assertEqual({entry["payload"]["built"] for entry in entries}, {1})
+
+    def test_disconnect_closes_live_stream(self):
+        release, closed = threading.Event(), threading.Event()
+
+        def live_records(name, budget):
+            try:
+                yield "station", {"station_name": "Multan"}
+                release.wait(5)
+                yield "station", {"station_name": "Lahore"}
+            finally:
+                closed.set()
+
+        async def disconnect():
+            response = await async_views.land_summary_stream(AsyncRequestFactory().get("/api/land-summary/stream"))
+            parts = aiter(response)
+            self.assertIn(b"Multan", await anext(parts))
+            # The client goes away while the second station is still being pulled
+            pulling = asyncio.ensure_future(anext(parts))
+            await asyncio.sleep(0.05)
+            pulling.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await pulling
+            self.assertFalse(closed.is_set())
+            release.set()
+            await asyncio.get_running_loop().run_in_executor(None, closed.wait, 5)
+
+        with mock.patch("api.views.live_records", live_records):
+            asyncio.run(disconnect())
+        self.assertTrue(closed.is_set())
+
+
+@override_settings(CACHES=LOCMEM)
+class BudgetedRefreshTests(SimpleTestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.deadlines = []
+
+        def build(deadline=None):
+            self.deadlines.append(deadline)
+            time.sleep(0.3)
+            # Stations need a second to answer
+            return {"partial": deadline is not None and deadline < 1}
+
+        materialize.summary("budget_test", interval=60)(build)
+        self.addCleanup(materialize.SUMMARIES.pop, "budget_test")
+
+    def refresh_together(self, budgets):
+        entries = {}
+
+        def call(budget):
+            entries[budget] = materialize.refresh("budget_test", deadline=budget)
+
+        threads = []
+        for budget in budgets:
+            threads.append(threading.Thread(target=call, args=(budget,)))
+            threads[-1].start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join(5)
+        return entries
+
+    def test_longer_budget_builds_again(self):
+        entries = self.refresh_together([0.2, 5])
+        self.assertTrue(entries[0.2]["partial"])
+        self.assertFalse(entries[5]["partial"])
+        self.assertEqual(len(self.deadlines), 2)
+        self.assertAlmostEqual(self.deadlines[0], 0.2, places=2)
+        self.assertGreater(self.deadlines[1], 4)
+
+    def test_shorter_budget_takes_the_leader_copy(self):
+        entries = self.refresh_together([5, 0.2])
+        self.assertFalse(entries[0.2]["partial"])
+        self.assertEqual(len(self.deadlines), 1)
+
+    def test_async_followers(self):
+        async def requests():
+            small = asyncio.ensure_future(materialize.aget("budget_test", budget=0.2))
+            await asyncio.sleep(0.05)
+            return await asyncio.gather(small, materialize.aget("budget_test", budget=5))
+
+        small, large = asyncio.run(requests())
+        self.assertTrue(small["partial"])
+        self.assertFalse(large["partial"])
+        self.assertEqual(len(self.deadlines), 2)
@@ -1,21 +1,34 @@
 ﻿from django.urls import path
-from . import views
+from . import async_views, dha_servers, views
 
 from django.views.decorators.cache import cache_page
 # from django.views.generic import RedirectView
 
-from .dha_servers import get_dha_servers, check_server_connectivity,proxy_geoserver
+from .dha_servers import get_dha_servers
 from .config_api import get_geoserver_config, get_allowed_fields, filter_layer_fields
 
+# ASGI deployments serve the upstream-bound views natively async (see api/async_views.py)
+summaries = async_views if async_views.enabled() else views
+upstream = async_views if async_views.enabled() else dha_servers
+
 urlpatterns = [
 
 
-    # Summary Views
-    path('land-summary/', cache_page(60 * 30)(views.land_summary), name='land_summary'),    
-    path('town-summary/', cache_page(60 * 30)(views.town_summary), name='town_summary'),  
-    path('services-summary/', cache_page(60 * 30)(views.services_summary), name='services_summary'),
-    path('horticulture-summary/', cache_page(60 * 30)(views.horticulture_summary), name='horticulture_summary'), 
-    path('security-summary/', cache_page(60 * 30)(views.security_summary), name='security_summary'), 
+    # Summary Views (served from materialized copies, see api/materialize.py)
+    path('land-summary/', summaries.land_summary, name='land_summary'),
+    path('town-summary/', summaries.town_summary, name='town_summary'),
+    path('services-summary/', summaries.services_summary, name='services_summary'),
+    path('horticulture-summary/', summaries.horticulture_summary, name='horticulture_summary'),
+    path('security-summary/', summaries.security_summary, name='security_summary'),
+    path('summary/<str:name>/', summaries.summary, name='summary'),
+
+    # Streaming variants: one NDJSON/SSE record per station as it arrives, then the totals
+    path('land-summary/stream/', summaries.land_summary_stream, name='land_summary_stream'),
+    path('town-summary/stream/', summaries.town_summary_stream, name='town_summary_stream'),
+    path('services-summary/stream/', summaries.services_summary_stream, name='services_summary_stream'),
+    path('horticulture-summary/stream/', summaries.horticulture_summary_stream, name='horticulture_summary_stream'),
+    path('security-summary/stream/', summaries.security_summary_stream, name='security_summary_stream'),
+    path('summary/<str:name>/stream/', summaries.summary_stream, name='summary_stream'),
 
 
     # Query Engine APIs
@@ -26,10 +39,17 @@ urlpatterns = [
     # path('config/filter-fields',cache_page(60 * 30)(filter_layer_fields), name='api_filter_fields'),
 
     path('dha/servers',get_dha_servers, name='api_dha_servers'),
-    path('dha/server/check',check_server_connectivity, name='api_check_server_connectivity'),
+    path('dha/server/check',upstream.check_server_connectivity, name='api_check_server_connectivity'),
     path('config/geoserver',get_geoserver_config, name='api_geoserver_config'),
     path('config/allowed-fields',get_allowed_fields, name='api_allowed_fields'),
     path('config/filter-fields',filter_layer_fields, name='api_filter_fields'),
-    path("proxy/geoserver/", proxy_geoserver, name="proxy_geoserver"),
+    # Allowed fields of every layer from the schema catalog (see api/schema_catalog.py)
+    path('config/layer-fields', summaries.layer_fields, name='api_layer_fields'),
+    path("proxy/geoserver/", upstream.proxy_geoserver, name="proxy_geoserver"),
+    # Graph data grouped on the server (see api/graph_aggregate.py)
+    path('query/aggregate', summaries.query_aggregate, name='api_query_aggregate'),
+
+    # Prometheus metrics (see api/metrics.py)
+    path('metrics', views.metrics_view, name='api_metrics'),
 ]
 
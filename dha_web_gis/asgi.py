@@ -5,6 +5,18 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+With ASYNC_VIEWS=True the proxy, connectivity check and summary views run
+natively on the event loop (see api/async_views.py). Recommended worker
+profile, one process per CPU core:
+
+    ASYNC_VIEWS=True gunicorn dha_web_gis.asgi:application \
+        -k uvicorn_worker.UvicornWorker --workers <cores> \
+        --timeout 60 --graceful-timeout 30
+
+Each worker keeps up to DHA_ASYNC['MAX_CONNECTIONS'] upstream requests in
+flight. The WSGI profile (dha_web_gis.wsgi, gthread workers) is limited to
+workers x threads.
 """
 
 import os
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -142,3 +142,211 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+
+
+# Upstream station fan-out (see api/fanout.py)
+
+DHA_FANOUT = {
+    'MAX_CONCURRENCY': config('FANOUT_MAX_CONCURRENCY', default=32, cast=int),
+    'PER_STATION_CONNECTIONS': config('FANOUT_PER_STATION_CONNECTIONS', default=4, cast=int),
+    'REQUEST_TIMEOUT': config('FANOUT_REQUEST_TIMEOUT', default=15, cast=float),
+    'GLOBAL_DEADLINE': config('FANOUT_GLOBAL_DEADLINE', default=20, cast=float),
+    # Parse GeoJSON features incrementally off the socket instead of decoding whole bodies
+    'STREAM_FEATURES': config('FANOUT_STREAM_FEATURES', default=True, cast=bool),
+    'STREAM_CHUNK_SIZE': 64 * 1024,
+}
+
+
+# Cache shared by all worker processes and the refresh_summaries command
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / '.cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+
+# Materialized dashboard summaries (see api/materialize.py)
+
+DHA_MATERIALIZE = {
+    'CACHE': 'default',
+    'IN_PROCESS_SCHEDULER': config('SUMMARY_IN_PROCESS_SCHEDULER', default=False, cast=bool),
+    # Per-summary refresh intervals in seconds, overriding the defaults in api/views.py
+    'INTERVALS': {},
+    # How long a request waits for a summary that has to be built (?budget= overrides, up to the max)
+    'LATENCY_BUDGET': config('SUMMARY_LATENCY_BUDGET', default=8, cast=float),
+    'MAX_LATENCY_BUDGET': 30,
+    # Partial copies (stations still loading) are refreshed again after this many seconds
+    'PARTIAL_RETRY': 10,
+}
+
+
+# Per-station summary results (see api/station_cache.py)
+
+DHA_STATION_CACHE = {
+    'CACHE': 'default',
+    'HEALTHY_TTL': config('STATION_CACHE_HEALTHY_TTL', default=60 * 10, cast=int),
+    'FAILURE_TTL': config('STATION_CACHE_FAILURE_TTL', default=60, cast=int),
+    'HEALTHY_TTLS': {},
+}
+
+
+# Coalescing of identical in-flight upstream calls (see api/singleflight.py)
+
+DHA_SINGLEFLIGHT = {
+    'CACHE': 'default',
+    'LOCK_TTL': 60,
+    'RESULT_TTL': 10,
+    'POLL_INTERVAL': 0.05,
+}
+
+
+# Summary aggregation (see api/summary_engine.py and api/columnar.py)
+
+DHA_AGGREGATION = {
+    # Batch group-by sums with NumPy when it is installed
+    'COLUMNAR': config('AGGREGATION_COLUMNAR', default=True, cast=bool),
+}
+
+
+# Incremental sync of layers with a change timestamp (see api/delta_sync.py)
+
+DHA_DELTA_SYNC = {
+    # Off by default: it replaces the process pool and columnar paths for specs with an updated_field
+    'ENABLED': config('DELTA_SYNC_ENABLED', default=False, cast=bool),
+    'CACHE': 'default',
+    # Every layer is downloaded in full at least this often (catches drift and missed deletions)
+    'FULL_SYNC_INTERVAL': config('DELTA_SYNC_FULL_INTERVAL', default=60 * 60 * 24, cast=int),
+    'VERIFY_COUNT': True,
+    'CHUNK_FEATURES': 1000,
+}
+
+
+# Local snapshot of the summary layers, summarized with SQL (see api/snapshot.py)
+
+DHA_SNAPSHOT = {
+    'ENABLED': config('SNAPSHOT_ENABLED', default=False, cast=bool),
+    'BATCH_SIZE': 5000,
+}
+
+
+# Per-station circuit breakers for every upstream call (see api/circuit.py)
+
+DHA_CIRCUIT = {
+    'ENABLED': config('CIRCUIT_ENABLED', default=True, cast=bool),
+    'FAILURE_THRESHOLD': config('CIRCUIT_FAILURE_THRESHOLD', default=3, cast=int),
+    'RESET_TIMEOUT': config('CIRCUIT_RESET_TIMEOUT', default=30, cast=float),
+    'MAX_RESET_TIMEOUT': 300,
+    'WINDOW': 50,
+}
+
+
+# Compact JSON with ETags and gzip/brotli for the api endpoints (see api/responses.py).
+# Brotli is used when the optional 'brotli' package is installed.
+
+DHA_RESPONSES = {
+    'COMPRESS': config('API_COMPRESS', default=True, cast=bool),
+    'MIN_COMPRESS_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+}
+
+
+# JSON codec for upstream bodies and api responses (see api/json_codec.py).
+# 'auto' uses the optional 'orjson' package when installed.
+
+DHA_JSON = {
+    'CODEC': config('JSON_CODEC', default='auto'),
+}
+
+
+# Decode and aggregate station pages in worker processes (see api/process_pool.py)
+
+DHA_PROCESS_POOL = {
+    'ENABLED': config('PROCESS_POOL_ENABLED', default=False, cast=bool),
+    'WORKERS': config('PROCESS_POOL_WORKERS', default=0, cast=int) or None,
+    'MAX_TASKS_PER_CHILD': 50,
+}
+
+
+# Prometheus metrics at /api/metrics, shared between workers through the cache (see api/metrics.py).
+# Only local clients may scrape them; behind a reverse proxy, deny /api/metrics at the proxy.
+
+DHA_METRICS = {
+    'ENABLED': config('METRICS_ENABLED', default=True, cast=bool),
+    'CACHE': 'default',
+    'SHARE_INTERVAL': 10,
+    'ALLOWED_IPS': config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv()),
+}
+
+
+# Record station responses to a compressed store, or replay them without the network
+# (see api/station_fixtures.py). MODE is 'off', 'record' or 'replay'.
+
+DHA_FIXTURES = {
+    'MODE': config('STATION_FIXTURES', default='off'),
+    'DIR': config('STATION_FIXTURES_DIR', default='station_fixtures'),
+    'COMPRESS_LEVEL': 6,
+}
+
+
+# GeoServer proxy: relay responses as they arrive and cap their size (see api/proxy_stream.py)
+
+DHA_PROXY = {
+    'STREAM': config('PROXY_STREAM', default=True, cast=bool),
+    'CHUNK_SIZE': 64 * 1024,
+    'MAX_RESPONSE_BYTES': config('PROXY_MAX_RESPONSE_MB', default=256, cast=int) * 1024 * 1024 or None,
+    'TIMEOUT': 20,
+}
+
+
+# Memory and disk cache of proxied GeoServer responses, TTLs per request type and layer
+# (see api/proxy_cache.py)
+
+DHA_PROXY_CACHE = {
+    'ENABLED': config('PROXY_CACHE_ENABLED', default=True, cast=bool),
+    'TTLS': {
+        'describefeaturetype': 6 * 60 * 60,
+        'getcapabilities': 6 * 60 * 60,
+        'getfeature': 5 * 60,
+    },
+    'LAYER_TTLS': {},
+    'MEMORY_ENTRIES': 512,
+    'MEMORY_BYTES': 64 * 1024 * 1024,
+    'DISK_DIR': config('PROXY_CACHE_DIR', default='.cache/proxy'),
+    'DISK_BYTES': config('PROXY_CACHE_DISK_MB', default=1024, cast=int) * 1024 * 1024,
+    'MAX_ENTRY_BYTES': 8 * 1024 * 1024,
+}
+
+
+# Async proxy, connectivity and summary views for ASGI deployments (see api/async_views.py).
+# Only enable under an ASGI server, e.g. gunicorn with uvicorn workers (see dha_web_gis/asgi.py).
+
+DHA_ASYNC = {
+    'ENABLED': config('ASYNC_VIEWS', default=False, cast=bool),
+    'MAX_CONNECTIONS': 512,
+    'PER_STATION_CONNECTIONS': 64,
+}
+
+
+# Server-side grouping of query engine graphs (see api/graph_aggregate.py)
+
+DHA_GRAPH_AGGREGATE = {
+    'WORKSPACE': 'dha_coregis',
+    'TIMEOUT': None,
+    'DEADLINE': None,
+    'MAX_CATEGORIES': config('GRAPH_MAX_CATEGORIES', default=5000, cast=int),
+}
+
+
+# Field schemas of the query engine layers, described ahead of time on every station
+# (see api/schema_catalog.py; refreshed like the summaries, every 6 hours by default)
+
+DHA_SCHEMA_CATALOG = {
+    'WORKSPACE': 'dha_coregis',
+    'TIMEOUT': None,
+}
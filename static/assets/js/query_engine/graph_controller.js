@@ -686,7 +686,15 @@ class GraphController {
             
             // Store the list of connected servers for later use when fetching data
             this.connectedServers = connectedServers;
-            
+
+            // The schema catalog answers for every layer of these servers at once
+            const catalog = await this.getLayerCatalog(connectedServers);
+            if (catalog && catalog.layers && catalog.layers[layerName]) {
+                this.layerFields[layerName] = catalog.layers[layerName];
+                console.log(`Loaded ${this.layerFields[layerName].length} fields for layer ${layerName} from the schema catalog`);
+                return this.layerFields[layerName];
+            }
+
             // Construct the URL for the WFS DescribeFeatureType request with workspace and authkey
             // This is a standard GeoServer WFS request to get the field information
             const workspace = 'dha_coregis'; // Use the workspace name as specified by the user
@@ -784,6 +792,32 @@ class GraphController {
         }
     }
     
+    /**
+     * Get the allowed fields of every layer for a set of servers from the schema catalog.
+     * One request per server selection; resolves to null if the catalog is unavailable.
+     */
+    async getLayerCatalog(servers) {
+        const key = [...servers].sort().join(',');
+        this.layerCatalogs = this.layerCatalogs || {};
+        if (!this.layerCatalogs[key]) {
+            this.layerCatalogs[key] = fetch(`/api/config/layer-fields?servers=${encodeURIComponent(key)}`, {
+                headers: { 'Accept': 'application/json' }
+            })
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! status: ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .catch(error => {
+                    console.warn('Schema catalog unavailable, describing the layer instead:', error);
+                    delete this.layerCatalogs[key];
+                    return null;
+                });
+        }
+        return this.layerCatalogs[key];
+    }
+
     /**
      * Process field data from WFS DescribeFeatureType response
      */
@@ -797,9 +831,9 @@ class GraphController {
                 data.featureTypes[0].properties.forEach(prop => {
                     let type = 'text'; // Default type
                     
-                    // Map GeoServer/WFS types to our simplified types
-                    if (prop.type.includes('int') || prop.type.includes('double') || 
-                        prop.type.includes('float') || prop.type.includes('decimal')) {
+                    // Map GeoServer/WFS types to our simplified types (as field_type in api/schema_catalog.py does)
+                    if (prop.type.includes('int') || prop.type.includes('long') || prop.type.includes('short') ||
+                        prop.type.includes('double') || prop.type.includes('float') || prop.type.includes('decimal')) {
                         type = 'numeric';
                     } else if (prop.type.includes('date') || prop.type.includes('time')) {
                         type = 'date';
@@ -1295,223 +1329,52 @@ class GraphController {
         }
         
         try {
-            // We'll fetch data from all connected servers and combine the results
-            const allServerData = [];
-            
-            // For each server to use, fetch the data
-            for (const serverName of serversToUse) {
-                try {
-                    const serverDetails = this.dhaServers[serverName];
-                    if (!serverDetails) {
-                        console.warn(`Server details not found for ${serverName}, skipping`);
-                        continue;
-                    }
-                    
-                    console.log(`Fetching data from server: ${serverName}`);
-                    
-                    // Construct the URL for the WFS GetFeature request
-                    const workspace = 'dha_coregis';
-                    const wfsUrl = `http://${serverDetails.dhaip}/geoserver/${workspace}/wfs`;
+            // The servers are queried in parallel and grouped on the server;
+            // only the category x series matrix comes back
+            const params = new URLSearchParams({
+                layer: graphConfig.layer,
+                x: graphConfig.xAxis,
+                y: graphConfig.yAxes.join(','),
+                agg: graphConfig.yAxes.map(field => graphConfig.summaryTechniques[field]?.selected || 'sum').join(','),
+                servers: serversToUse.join(',')
+            });
 
-                    console.log(wfsUrl);
-                    
-                    // Build the WFS query parameters
-                    const params = new URLSearchParams({
-                        service: 'WFS',
-                        version: '2.0.0',
-                        request: 'GetFeature',
-                        typeName: `${workspace}:${graphConfig.layer}`,
-                        outputFormat: 'application/json',
-                        authkey: serverDetails.auth_key,
-                        // Add property names to limit the response to just the fields we need
-                        propertyName: [graphConfig.xAxis, ...graphConfig.yAxes].join(',')
-                    });
-                    
-                    const url = `${wfsUrl}?${params.toString()}`;
-                    console.log(`Fetching data from URL: ${url}`);
-                    
-                    // Make the API call
-                    const controller = new AbortController();
-                    const timeoutId = setTimeout(() => controller.abort(), 15000); // 15 second timeout
-                    const reqURL = `/api/proxy/geoserver/?url=${encodeURIComponent(url)}&${params.toString()}`
-                    const response = await fetch(reqURL, {
-                        method: 'GET',
-                        headers: {
-                            'Content-Type': 'application/json',
-                            'Accept': 'application/json'
-                        },
-                        signal: controller.signal
-                    });
-                    
-                    clearTimeout(timeoutId);
-                    
-                    if (!response.ok) {
-                        console.warn(`Error fetching data from ${serverName}: ${response.status} ${response.statusText}`);
-                        continue;
-                    }
-                    
-                    const data = await response.json();
-                    console.log(`Data received from ${serverName}:`, data);
-                    
-                    // Add the server data to our collection
-                    if (data && data.features) {
-                        // Add server name to each feature for tracking
-                        data.features.forEach(feature => {
-                            feature.properties.serverName = serverName;
-                        });
-                        
-                        allServerData.push(data);
-                    }
-                } catch (error) {
-                    console.warn(`Error fetching data from server ${serverName}:`, error);
-                }
+            const controller = new AbortController();
+            const timeoutId = setTimeout(() => controller.abort(), 30000); // 30 second timeout
+            const response = await fetch(`/api/query/aggregate?${params.toString()}`, {
+                method: 'GET',
+                headers: {
+                    'Accept': 'application/json'
+                },
+                signal: controller.signal
+            });
+            clearTimeout(timeoutId);
+
+            const data = await response.json();
+            if (data.stations) {
+                data.stations
+                    .filter(station => station.error)
+                    .forEach(station => console.warn(`Error fetching data from server ${station.station_name}: ${station.error}`));
             }
-            
+
             // If we didn't get any data, throw an error
-            if (allServerData.length === 0) {
-                showToast('No data received from any server', 'error');
-                console.error('No data received from any server');
-                throw new Error('No data received from any server. Please try again or select different servers.');
+            if (!response.ok) {
+                showToast(data.error || 'No data received from any server', 'error');
+                console.error('No data received from any server', data);
+                throw new Error(data.error || 'No data received from any server. Please try again or select different servers.');
             }
-            
-            // Process and combine the data from all servers
-            return this.processGraphData(allServerData, graphConfig);
-        } catch (error) {
-            console.error(`Error in fetchGraphData:`, error);
-            throw error;
-        }
-    }
-    
-    /**
-     * Process and combine data from multiple servers
-     */
-    processGraphData(allServerData, graphConfig) {
-        console.log(`Processing graph data from ${allServerData.length} servers`);
-        
-        try {
-            // Combine all features from all servers
-            const allFeatures = [];
-            allServerData.forEach(serverData => {
-                if (serverData && serverData.features) {
-                    allFeatures.push(...serverData.features);
-                }
-            });
-            
-            console.log(`Combined ${allFeatures.length} features from all servers`);
-            
-            // Extract unique categories (X-Axis values)
-            const categoriesSet = new Set();
-            allFeatures.forEach(feature => {
-                if (feature.properties && feature.properties[graphConfig.xAxis] !== undefined) {
-                    categoriesSet.add(feature.properties[graphConfig.xAxis]);
-                }
-            });
-            
-            // Convert to array and sort
-            const categories = Array.from(categoriesSet).sort();
-            console.log(`Extracted ${categories.length} unique categories`);
-            
-            // Initialize series data
-            const seriesData = {};
-            graphConfig.yAxes.forEach(field => {
-                seriesData[field] = Array(categories.length).fill(0);
-            });
-            
-            // Aggregate data for each category and field
-            allFeatures.forEach(feature => {
-                if (!feature.properties) return;
-                
-                const xValue = feature.properties[graphConfig.xAxis];
-                if (xValue === undefined) return;
-                
-                const categoryIndex = categories.indexOf(xValue);
-                if (categoryIndex === -1) return;
-                
-                // For each Y-Axis field, add the value to the corresponding category
-                graphConfig.yAxes.forEach(field => {
-                    const value = parseFloat(feature.properties[field]);
-                    if (!isNaN(value)) {
-                        // Apply the selected summary technique
-                        const technique = graphConfig.summaryTechniques[field]?.selected || 'sum';
-                        
-                        switch (technique) {
-                            case 'sum':
-                                seriesData[field][categoryIndex] += value;
-                                break;
-                            case 'average':
-                                // For average, we'll need to count and sum, then divide later
-                                if (!seriesData[`${field}_count`]) {
-                                    seriesData[`${field}_count`] = Array(categories.length).fill(0);
-                                    seriesData[`${field}_sum`] = Array(categories.length).fill(0);
-                                }
-                                seriesData[`${field}_count`][categoryIndex]++;
-                                seriesData[`${field}_sum`][categoryIndex] += value;
-                                break;
-                            case 'max':
-                                if (seriesData[field][categoryIndex] < value || seriesData[field][categoryIndex] === 0) {
-                                    seriesData[field][categoryIndex] = value;
-                                }
-                                break;
-                            case 'min':
-                                if (seriesData[field][categoryIndex] > value || seriesData[field][categoryIndex] === 0) {
-                                    seriesData[field][categoryIndex] = value;
-                                }
-                                break;
-                            case 'count':
-                                seriesData[field][categoryIndex]++;
-                                break;
-                            case 'count_distinct':
-                                // Initialize unique value sets if not already done
-                                if (!seriesData[`${field}_unique_values`]) {
-                                    seriesData[`${field}_unique_values`] = Array(categories.length).fill().map(() => new Set());
-                                }
-                                // Add the raw text value to the set for this category
-                                const rawValue = feature.properties[field];
-                                if (rawValue !== undefined && rawValue !== null) {
-                                    seriesData[`${field}_unique_values`][categoryIndex].add(String(rawValue));
-                                }
-                                // Update the count to the current size of the set
-                                seriesData[field][categoryIndex] = seriesData[`${field}_unique_values`][categoryIndex].size;
-                                break;
-                            default:
-                                seriesData[field][categoryIndex] += value;
-                        }
-                    }
-                });
-            });
-            
-            // Calculate averages if needed and clean up temporary data
-            graphConfig.yAxes.forEach(field => {
-                const technique = graphConfig.summaryTechniques[field]?.selected || 'sum';
-                if (technique === 'average' && seriesData[`${field}_count`] && seriesData[`${field}_sum`]) {
-                    for (let i = 0; i < categories.length; i++) {
-                        if (seriesData[`${field}_count`][i] > 0) {
-                            seriesData[field][i] = seriesData[`${field}_sum`][i] / seriesData[`${field}_count`][i];
-                        }
-                    }
-                    // Clean up temporary data
-                    delete seriesData[`${field}_count`];
-                    delete seriesData[`${field}_sum`];
-                }
-                
-                // Clean up temporary data for count_distinct
-                if (technique === 'count_distinct' && seriesData[`${field}_unique_values`]) {
-                    delete seriesData[`${field}_unique_values`];
-                }
-            });
-            
-            console.log('Processed graph data:', { categories, seriesData });
-            
+
+            console.log(`Aggregated ${data.features} features into ${data.categories.length} categories`);
             return {
-                categories: categories,
-                series: seriesData
+                categories: data.categories,
+                series: data.series
             };
         } catch (error) {
-            console.error('Error processing graph data:', error);
+            console.error(`Error in fetchGraphData:`, error);
             throw error;
         }
     }
-
+    
     /**
      * Create Highcharts options based on graph configuration
      */